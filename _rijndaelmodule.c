@@ -0,0 +1,525 @@
+/*
+ * _rijndael: CPython extension module over rijndael.c.
+ *
+ * _rijndael.AES is a key-schedule object holding one aes_context. It offers
+ * the methods of the pure-Python AES in test_aes.py (encrypt_block,
+ * decrypt_block, encrypt_blocks, decrypt_blocks, close) and the bulk modes
+ * of aes_ctypes.AES, so either can be swapped for it.
+ *
+ * Inputs are taken through the buffer protocol. The bulk modes work in
+ * place on writable buffers (bytearray, memoryview, mmap, NumPy arrays)
+ * and copy read-only ones into a new bytearray, like aes_ctypes. The GIL
+ * is released around the cipher for inputs of GIL_THRESHOLD bytes or more;
+ * smaller ones finish faster than the thread hand-off. Such a call counts
+ * as a user of the key schedule, and close() from another thread meanwhile
+ * leaves the zeroing to the last user, so the call never runs on a
+ * half-cleared schedule.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "rijndael.h"
+
+#define GIL_THRESHOLD 4096
+
+// in_use and closed are only touched with the GIL held
+#define CALL_MAYBE_WITHOUT_GIL(self, len, stmt) \
+  do {                                          \
+    if ((len) >= GIL_THRESHOLD) {               \
+      (self)->in_use++;                         \
+      Py_BEGIN_ALLOW_THREADS stmt;              \
+      Py_END_ALLOW_THREADS                      \
+      release_context(self);                    \
+    } else {                                    \
+      stmt;                                     \
+    }                                           \
+  } while (0)
+
+typedef struct {
+  PyObject_HEAD
+  aes_context ctx;
+  int closed;
+  int in_use;  // calls running on ctx without the GIL
+} AESObject;
+
+static PyTypeObject AESType;
+
+// Drop one GIL-free user; the last one performs a close() deferred for it
+static void release_context(AESObject *self) {
+  if (--self->in_use == 0 && self->closed) {
+    aes_context_clear(&self->ctx);
+  }
+}
+
+static int check_open(AESObject *self) {
+  if (self->closed) {
+    PyErr_SetString(PyExc_ValueError, "key schedule has been closed");
+    return -1;
+  }
+  return 0;
+}
+
+/*
+ * Borrow a writable, contiguous view of data. Returns a new reference to
+ * the object being written: data itself when it is writable, otherwise a
+ * bytearray copy of it. NULL with an exception set on failure.
+ */
+static PyObject *writable_buffer(PyObject *data, Py_buffer *view) {
+  PyObject *copy;
+
+  if (PyObject_GetBuffer(data, view, PyBUF_WRITABLE) == 0) {
+    Py_INCREF(data);
+    return data;
+  }
+  // Read-only exporters raise BufferError; anything else is a real error
+  if (!PyErr_ExceptionMatches(PyExc_BufferError)) {
+    return NULL;
+  }
+  PyErr_Clear();
+
+  if (PyObject_GetBuffer(data, view, PyBUF_SIMPLE) < 0) {
+    return NULL;
+  }
+  copy = PyByteArray_FromStringAndSize((const char *)view->buf, view->len);
+  PyBuffer_Release(view);
+  if (copy == NULL) {
+    return NULL;
+  }
+  if (PyObject_GetBuffer(copy, view, PyBUF_WRITABLE) < 0) {
+    Py_DECREF(copy);
+    return NULL;
+  }
+  return copy;
+}
+
+// A 16-byte IV or counter block; written back in place when writable
+static PyObject *chaining_block(PyObject *value, const char *name,
+                                Py_buffer *view) {
+  PyObject *result = writable_buffer(value, view);
+
+  if (result == NULL) {
+    return NULL;
+  }
+  if (view->len != BLOCK_SIZE) {
+    PyErr_Format(PyExc_ValueError, "%s must be %d bytes, got %zd", name,
+                 BLOCK_SIZE, view->len);
+    PyBuffer_Release(view);
+    Py_DECREF(result);
+    return NULL;
+  }
+  return result;
+}
+
+static int check_blocks(Py_buffer *view) {
+  if (view->len % BLOCK_SIZE != 0) {
+    PyErr_Format(PyExc_ValueError,
+                 "data length must be a multiple of %d, got %zd", BLOCK_SIZE,
+                 view->len);
+    return -1;
+  }
+  return 0;
+}
+
+static PyObject *AES_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  static char *kwlist[] = {"master_key", NULL};
+  Py_buffer key;
+  AESObject *self;
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "y*:AES", kwlist, &key)) {
+    return NULL;
+  }
+  if (key.len != KEY_SIZE) {
+    PyErr_Format(PyExc_ValueError, "AES-128 key must be %d bytes, got %zd",
+                 KEY_SIZE, key.len);
+    PyBuffer_Release(&key);
+    return NULL;
+  }
+
+  self = (AESObject *)type->tp_alloc(type, 0);
+  if (self != NULL) {
+    aes_context_init(&self->ctx, (const unsigned char *)key.buf);
+    self->closed = 0;
+    self->in_use = 0;
+  }
+  PyBuffer_Release(&key);
+  return (PyObject *)self;
+}
+
+static void AES_dealloc(AESObject *self) {
+  aes_context_clear(&self->ctx);
+  Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *crypt_block(AESObject *self, PyObject *arg, int encrypt) {
+  unsigned char block[BLOCK_SIZE];
+  Py_buffer view;
+
+  if (check_open(self) < 0 ||
+      PyObject_GetBuffer(arg, &view, PyBUF_SIMPLE) < 0) {
+    return NULL;
+  }
+  if (view.len != BLOCK_SIZE) {
+    PyErr_Format(PyExc_ValueError, "block must be %d bytes, got %zd",
+                 BLOCK_SIZE, view.len);
+    PyBuffer_Release(&view);
+    return NULL;
+  }
+  memcpy(block, view.buf, BLOCK_SIZE);
+  PyBuffer_Release(&view);
+
+  if (encrypt) {
+    aes_context_encrypt_block(&self->ctx, block);
+  } else {
+    aes_context_decrypt_block(&self->ctx, block);
+  }
+  return PyBytes_FromStringAndSize((const char *)block, BLOCK_SIZE);
+}
+
+static PyObject *AES_encrypt_block(AESObject *self, PyObject *arg) {
+  return crypt_block(self, arg, 1);
+}
+
+static PyObject *AES_decrypt_block(AESObject *self, PyObject *arg) {
+  return crypt_block(self, arg, 0);
+}
+
+/*
+ * (N, 16) uint8 NumPy array over a bytearray result, matching the
+ * pure-Python batch API; the bytearray itself when NumPy is missing.
+ */
+static PyObject *as_block_array(PyObject *result) {
+  PyObject *numpy = PyImport_ImportModule("numpy");
+  PyObject *flat, *shaped;
+
+  if (numpy == NULL) {
+    PyErr_Clear();
+    return result;
+  }
+  flat = PyObject_CallMethod(numpy, "frombuffer", "Os", result, "uint8");
+  Py_DECREF(numpy);
+  Py_DECREF(result);
+  if (flat == NULL) {
+    return NULL;
+  }
+  shaped = PyObject_CallMethod(flat, "reshape", "ii", -1, BLOCK_SIZE);
+  Py_DECREF(flat);
+  return shaped;
+}
+
+static PyObject *crypt_blocks(AESObject *self, PyObject *arg, int encrypt) {
+  Py_buffer view;
+  PyObject *result;
+  unsigned char *out;
+  size_t num_blocks;
+
+  if (check_open(self) < 0 ||
+      PyObject_GetBuffer(arg, &view, PyBUF_SIMPLE) < 0) {
+    return NULL;
+  }
+  if (check_blocks(&view) < 0) {
+    PyBuffer_Release(&view);
+    return NULL;
+  }
+  result = PyByteArray_FromStringAndSize((const char *)view.buf, view.len);
+  PyBuffer_Release(&view);
+  if (result == NULL) {
+    return NULL;
+  }
+
+  out = (unsigned char *)PyByteArray_AS_STRING(result);
+  num_blocks = (size_t)PyByteArray_GET_SIZE(result) / BLOCK_SIZE;
+  if (encrypt) {
+    CALL_MAYBE_WITHOUT_GIL(self, num_blocks * BLOCK_SIZE,
+                           aes_ecb_encrypt(&self->ctx, out, num_blocks));
+  } else {
+    CALL_MAYBE_WITHOUT_GIL(self, num_blocks * BLOCK_SIZE,
+                           aes_ecb_decrypt(&self->ctx, out, num_blocks));
+  }
+  return as_block_array(result);
+}
+
+static PyObject *AES_encrypt_blocks(AESObject *self, PyObject *arg) {
+  return crypt_blocks(self, arg, 1);
+}
+
+static PyObject *AES_decrypt_blocks(AESObject *self, PyObject *arg) {
+  return crypt_blocks(self, arg, 0);
+}
+
+static PyObject *ecb(AESObject *self, PyObject *arg, int encrypt) {
+  Py_buffer view;
+  PyObject *result;
+
+  if (check_open(self) < 0 ||
+      (result = writable_buffer(arg, &view)) == NULL) {
+    return NULL;
+  }
+  if (check_blocks(&view) < 0) {
+    PyBuffer_Release(&view);
+    Py_DECREF(result);
+    return NULL;
+  }
+
+  if (encrypt) {
+    CALL_MAYBE_WITHOUT_GIL(self, view.len,
+                           aes_ecb_encrypt(&self->ctx, view.buf,
+                                           (size_t)view.len / BLOCK_SIZE));
+  } else {
+    CALL_MAYBE_WITHOUT_GIL(self, view.len,
+                           aes_ecb_decrypt(&self->ctx, view.buf,
+                                           (size_t)view.len / BLOCK_SIZE));
+  }
+  PyBuffer_Release(&view);
+  return result;
+}
+
+static PyObject *AES_encrypt_ecb(AESObject *self, PyObject *arg) {
+  return ecb(self, arg, 1);
+}
+
+static PyObject *AES_decrypt_ecb(AESObject *self, PyObject *arg) {
+  return ecb(self, arg, 0);
+}
+
+static PyObject *cbc(AESObject *self, PyObject *args, int encrypt) {
+  PyObject *data, *iv, *result, *iv_obj;
+  Py_buffer view, iv_view;
+
+  if (!PyArg_ParseTuple(args, encrypt ? "OO:encrypt_cbc" : "OO:decrypt_cbc",
+                        &data, &iv) ||
+      check_open(self) < 0) {
+    return NULL;
+  }
+  if ((iv_obj = chaining_block(iv, "iv", &iv_view)) == NULL) {
+    return NULL;
+  }
+  if ((result = writable_buffer(data, &view)) == NULL) {
+    goto release_iv;
+  }
+  if (check_blocks(&view) < 0) {
+    Py_CLEAR(result);
+    goto release;
+  }
+
+  if (encrypt) {
+    CALL_MAYBE_WITHOUT_GIL(self, view.len,
+                           aes_cbc_encrypt(&self->ctx, iv_view.buf, view.buf,
+                                           (size_t)view.len / BLOCK_SIZE));
+  } else {
+    CALL_MAYBE_WITHOUT_GIL(self, view.len,
+                           aes_cbc_decrypt(&self->ctx, iv_view.buf, view.buf,
+                                           (size_t)view.len / BLOCK_SIZE));
+  }
+
+release:
+  PyBuffer_Release(&view);
+release_iv:
+  PyBuffer_Release(&iv_view);
+  Py_DECREF(iv_obj);
+  return result;
+}
+
+static PyObject *AES_encrypt_cbc(AESObject *self, PyObject *args) {
+  return cbc(self, args, 1);
+}
+
+static PyObject *AES_decrypt_cbc(AESObject *self, PyObject *args) {
+  return cbc(self, args, 0);
+}
+
+static PyObject *AES_encrypt_ctr(AESObject *self, PyObject *args) {
+  PyObject *data, *nonce, *result, *counter_obj;
+  Py_buffer view, counter;
+
+  if (!PyArg_ParseTuple(args, "OO:encrypt_ctr", &data, &nonce) ||
+      check_open(self) < 0) {
+    return NULL;
+  }
+  if ((counter_obj = chaining_block(nonce, "nonce", &counter)) == NULL) {
+    return NULL;
+  }
+  if ((result = writable_buffer(data, &view)) != NULL) {
+    CALL_MAYBE_WITHOUT_GIL(self, view.len,
+                           aes_ctr_crypt(&self->ctx, counter.buf, view.buf,
+                                         (size_t)view.len));
+    PyBuffer_Release(&view);
+  }
+  PyBuffer_Release(&counter);
+  Py_DECREF(counter_obj);
+  return result;
+}
+
+static PyObject *AES_close(AESObject *self, PyObject *Py_UNUSED(ignored)) {
+  self->closed = 1;
+  // Calls already running without the GIL keep the schedule until they end
+  if (self->in_use == 0) {
+    aes_context_clear(&self->ctx);
+  }
+  Py_RETURN_NONE;
+}
+
+static PyObject *AES_enter(AESObject *self, PyObject *Py_UNUSED(ignored)) {
+  Py_INCREF(self);
+  return (PyObject *)self;
+}
+
+static PyObject *AES_exit(AESObject *self, PyObject *Py_UNUSED(args)) {
+  return AES_close(self, NULL);
+}
+
+static PyMethodDef AES_methods[] = {
+    {"encrypt_block", (PyCFunction)AES_encrypt_block, METH_O,
+     "Encrypt one 16-byte block; returns bytes."},
+    {"decrypt_block", (PyCFunction)AES_decrypt_block, METH_O,
+     "Decrypt one 16-byte block; returns bytes."},
+    {"encrypt_blocks", (PyCFunction)AES_encrypt_blocks, METH_O,
+     "Encrypt a multiple of 16 bytes into a new (N, 16) uint8 array\n"
+     "(a bytearray when NumPy is not installed)."},
+    {"decrypt_blocks", (PyCFunction)AES_decrypt_blocks, METH_O,
+     "Inverse of encrypt_blocks."},
+    {"encrypt_ecb", (PyCFunction)AES_encrypt_ecb, METH_O,
+     "Encrypt a multiple of 16 bytes in ECB mode; returns the buffer."},
+    {"decrypt_ecb", (PyCFunction)AES_decrypt_ecb, METH_O,
+     "Decrypt a multiple of 16 bytes in ECB mode; returns the buffer."},
+    {"encrypt_cbc", (PyCFunction)AES_encrypt_cbc, METH_VARARGS,
+     "encrypt_cbc(data, iv): CBC without padding. A writable iv is updated\n"
+     "to the last ciphertext block."},
+    {"decrypt_cbc", (PyCFunction)AES_decrypt_cbc, METH_VARARGS,
+     "decrypt_cbc(data, iv): inverse of encrypt_cbc."},
+    {"encrypt_ctr", (PyCFunction)AES_encrypt_ctr, METH_VARARGS,
+     "encrypt_ctr(data, nonce): CTR over data of any length. A writable\n"
+     "nonce (the initial counter block) is advanced in place."},
+    {"decrypt_ctr", (PyCFunction)AES_encrypt_ctr, METH_VARARGS,
+     "decrypt_ctr(data, nonce): same as encrypt_ctr."},
+    {"close", (PyCFunction)AES_close, METH_NOARGS,
+     "Zero the key schedule; the object is unusable afterwards. Calls\n"
+     "already running in other threads finish first."},
+    {"__enter__", (PyCFunction)AES_enter, METH_NOARGS, NULL},
+    {"__exit__", (PyCFunction)AES_exit, METH_VARARGS, NULL},
+    {NULL, NULL, 0, NULL},
+};
+
+static PyTypeObject AESType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "_rijndael.AES",
+    .tp_basicsize = sizeof(AESObject),
+    .tp_dealloc = (destructor)AES_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "AES(master_key)\n--\n\n"
+              "AES-128 key schedule, expanded once from a 16-byte key.",
+    .tp_methods = AES_methods,
+    .tp_new = AES_new,
+};
+
+/*
+ * Engine selection for the copy of rijndael.c linked into this module. It
+ * is independent of the selection made through rijndael.so / aes_ctypes.
+ */
+static PyObject *engine_list(int only_available) {
+  PyObject *names = PyList_New(0);
+
+  if (names == NULL) {
+    return NULL;
+  }
+  for (int i = 0; i < AES_NUM_ENGINES; i++) {
+    PyObject *name;
+
+    if (only_available && !aes_engine_available(i)) {
+      continue;
+    }
+    name = PyUnicode_FromString(aes_engine_name(i));
+    if (name == NULL || PyList_Append(names, name) < 0) {
+      Py_XDECREF(name);
+      Py_DECREF(names);
+      return NULL;
+    }
+    Py_DECREF(name);
+  }
+  return names;
+}
+
+static PyObject *rijndael_engines(PyObject *Py_UNUSED(module),
+                                  PyObject *Py_UNUSED(x)) {
+  return engine_list(0);
+}
+
+static PyObject *rijndael_available_engines(PyObject *Py_UNUSED(module),
+                                            PyObject *Py_UNUSED(x)) {
+  return engine_list(1);
+}
+
+static PyObject *rijndael_get_engine(PyObject *Py_UNUSED(module),
+                                     PyObject *Py_UNUSED(x)) {
+  return PyUnicode_FromString(aes_engine_name(aes_get_engine()));
+}
+
+static PyObject *rijndael_set_engine(PyObject *Py_UNUSED(module),
+                                     PyObject *arg) {
+  const char *name = PyUnicode_AsUTF8(arg);
+
+  if (name == NULL) {
+    return NULL;
+  }
+  for (int i = 0; i < AES_NUM_ENGINES; i++) {
+    if (strcmp(name, aes_engine_name(i)) == 0) {
+      if (aes_set_engine(i) != 0) {
+        PyErr_Format(PyExc_ValueError,
+                     "engine '%s' is not usable on this machine", name);
+        return NULL;
+      }
+      Py_RETURN_NONE;
+    }
+  }
+  PyErr_Format(PyExc_ValueError, "unknown engine '%s'", name);
+  return NULL;
+}
+
+static PyMethodDef rijndael_methods[] = {
+    {"engines", rijndael_engines, METH_NOARGS,
+     "Names of the round engines compiled in, by number."},
+    {"available_engines", rijndael_available_engines, METH_NOARGS,
+     "Engines this CPU can run."},
+    {"get_engine", rijndael_get_engine, METH_NOARGS,
+     "Name of the active round engine."},
+    {"set_engine", rijndael_set_engine, METH_O,
+     "Select the round engine for this module, process-wide."},
+    {NULL, NULL, 0, NULL},
+};
+
+static struct PyModuleDef rijndael_module = {
+    PyModuleDef_HEAD_INIT,
+    "_rijndael",
+    "AES-128 (Rijndael) compiled from rijndael.c.",
+    -1,
+    rijndael_methods,
+    NULL, /* m_slots */
+    NULL, /* m_traverse */
+    NULL, /* m_clear */
+    NULL, /* m_free */
+};
+
+PyMODINIT_FUNC PyInit__rijndael(void) {
+  PyObject *module;
+
+  if (PyType_Ready(&AESType) < 0) {
+    return NULL;
+  }
+  module = PyModule_Create(&rijndael_module);
+  if (module == NULL) {
+    return NULL;
+  }
+
+  Py_INCREF(&AESType);
+  if (PyModule_AddObject(module, "AES", (PyObject *)&AESType) < 0) {
+    Py_DECREF(&AESType);
+    Py_DECREF(module);
+    return NULL;
+  }
+  if (PyModule_AddIntConstant(module, "BLOCK_SIZE", BLOCK_SIZE) < 0 ||
+      PyModule_AddIntConstant(module, "KEY_SIZE", KEY_SIZE) < 0 ||
+      PyModule_AddIntConstant(module, "GIL_THRESHOLD", GIL_THRESHOLD) < 0) {
+    Py_DECREF(module);
+    return NULL;
+  }
+  return module;
+}
@@ -0,0 +1,142 @@
+"""
+asyncio facade over the C AES-128 library.
+
+encrypt()/decrypt() run payloads below `inline_threshold` bytes directly on
+the event loop (an executor hop costs more than encrypting them) and hand
+anything larger to an executor, so a big blob never stalls other
+coroutines. ctypes releases the GIL during the native call, so the default
+thread pool executor is enough. Key schedules come from the shared
+aes_keycache.CACHE, so repeated calls with the same key skip key expansion.
+
+AESStreamReader/AESStreamWriter wrap asyncio streams with CTR-mode
+decryption/encryption. The writer awaits drain() after every write, so a
+slow peer applies backpressure to the producer; the reader only pulls what
+the caller asks for. Each wrapper serializes its calls with an asyncio.Lock,
+so concurrent writes (or reads) are sent in the order they were made and
+line up with their keystream offsets.
+"""
+
+import asyncio
+import functools
+
+import aes_ctypes
+import aes_keycache
+from aes_ctypes import BLOCK_SIZE
+
+INLINE_THRESHOLD = 64 * 1024
+
+MODES = ('ecb', 'cbc', 'ctr')
+
+
+def _run(key, data, mode, iv, decrypt):
+    with aes_keycache.CACHE.acquire(key) as aes:
+        if mode == 'ecb':
+            return aes.decrypt_ecb(data) if decrypt else aes.encrypt_ecb(data)
+        if mode == 'cbc':
+            return aes.decrypt_cbc(data, iv) if decrypt else aes.encrypt_cbc(data, iv)
+        return aes.encrypt_ctr(data, iv)
+
+
+async def _dispatch(key, data, mode, iv, decrypt, executor, inline_threshold):
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}, expected one of {MODES}")
+    if mode != 'ecb' and iv is None:
+        raise ValueError(f"{mode} mode needs an iv/nonce")
+    if memoryview(data).nbytes < inline_threshold:
+        return _run(key, data, mode, iv, decrypt)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_run, key, data, mode, iv, decrypt))
+
+
+async def encrypt(data, key, mode='ctr', iv=None, *, executor=None, inline_threshold=INLINE_THRESHOLD):
+    """
+    Encrypt data with aes_ctypes semantics (no padding; iv is the CBC IV or
+    initial CTR counter block). Writable buffers are processed in place, so
+    don't touch them until the call completes. Returns the processed buffer.
+    """
+    return await _dispatch(key, data, mode, iv, False, executor, inline_threshold)
+
+
+async def decrypt(data, key, mode='ctr', iv=None, *, executor=None, inline_threshold=INLINE_THRESHOLD):
+    return await _dispatch(key, data, mode, iv, True, executor, inline_threshold)
+
+
+class _CTRStream:
+    """CTR keystream position shared by the reader and writer wrappers."""
+
+    def __init__(self, key, nonce, executor, inline_threshold):
+        if len(nonce) != BLOCK_SIZE:
+            raise ValueError(f"nonce must be {BLOCK_SIZE} bytes, got {len(nonce)}")
+        self._aes = aes_ctypes.AES(key)
+        self._nonce = int.from_bytes(nonce, 'big')
+        self._offset = 0
+        self._executor = executor
+        self._inline_threshold = inline_threshold
+
+    def _crypt(self, data, offset):
+        # Pad the front so the chunk starts on a block boundary of the stream
+        skip = offset % BLOCK_SIZE
+        buf = bytearray(skip) + data
+        counter = (self._nonce + offset // BLOCK_SIZE) % (1 << (8 * BLOCK_SIZE))
+        self._aes.encrypt_ctr(buf, counter.to_bytes(BLOCK_SIZE, 'big'))
+        return bytes(buf[skip:])
+
+    async def _process(self, data):
+        offset = self._offset
+        self._offset += len(data)
+        if len(data) < self._inline_threshold:
+            return self._crypt(data, offset)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._crypt, data, offset)
+
+    def close(self):
+        # An executor _crypt whose awaiting coroutine was cancelled may still
+        # be running; aes_ctypes defers the free until that call returns
+        self._aes.close()
+
+
+class AESStreamWriter:
+    """Encrypts everything written to an asyncio.StreamWriter (CTR mode)."""
+
+    def __init__(self, writer, key, nonce, *, executor=None, inline_threshold=INLINE_THRESHOLD):
+        self._writer = writer
+        self._stream = _CTRStream(key, nonce, executor, inline_threshold)
+        self._lock = asyncio.Lock()
+
+    async def write(self, data):
+        """Encrypt and send data, waiting for the transport to drain."""
+        data = bytes(data)
+        # Held across the executor hop so a later write can't overtake this one
+        async with self._lock:
+            self._writer.write(await self._stream._process(data))
+            await self._writer.drain()
+
+    async def close(self):
+        """Close the transport once pending writes have been sent."""
+        async with self._lock:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._stream.close()
+
+
+class AESStreamReader:
+    """Decrypts what is read from an asyncio.StreamReader (CTR mode)."""
+
+    def __init__(self, reader, key, nonce, *, executor=None, inline_threshold=INLINE_THRESHOLD):
+        self._reader = reader
+        self._stream = _CTRStream(key, nonce, executor, inline_threshold)
+        self._lock = asyncio.Lock()
+
+    async def read(self, n=-1):
+        async with self._lock:
+            return await self._stream._process(await self._reader.read(n))
+
+    async def readexactly(self, n):
+        async with self._lock:
+            return await self._stream._process(await self._reader.readexactly(n))
+
+    def at_eof(self):
+        return self._reader.at_eof()
+
+    def close(self):
+        self._stream.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Streaming AES-128 file encryption on top of rijndael.so.
+
+    python -m aes_cli encrypt --mode ctr --key-file key.bin --in backup.tar --out backup.tar.aes
+    python -m aes_cli decrypt --mode ctr --key-file key.bin < backup.tar.aes > backup.tar
+
+The input is read into one reusable buffer a chunk at a time and each chunk
+goes through the C library in a single call, so memory use stays constant
+whatever the size of the file. Output starts with the random 16-byte IV
+(CBC) or initial counter block (CTR); CBC uses PKCS#7 padding.
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+import aes_ctypes
+from aes_ctypes import BLOCK_SIZE, KEY_SIZE
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def pkcs7_pad(buf, length):
+    """Pad buf[:length] in place (buf needs 16 spare bytes); returns the new length."""
+    n = BLOCK_SIZE - length % BLOCK_SIZE
+    buf[length:length + n] = bytes([n]) * n
+    return length + n
+
+
+def pkcs7_unpad_length(block):
+    """Number of plaintext bytes in the final decrypted block."""
+    n = block[-1]
+    if not 1 <= n <= BLOCK_SIZE or block[-n:] != bytes([n]) * n:
+        raise ValueError("bad padding")
+    return BLOCK_SIZE - n
+
+
+def _read_full(stream, view):
+    """Fill view from stream, stopping short only at end of input."""
+    total = 0
+    while total < len(view):
+        n = stream.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def _read_header(stream):
+    header = stream.read(BLOCK_SIZE)
+    if len(header) != BLOCK_SIZE:
+        raise ValueError("input is too short to hold the IV/counter header")
+    return bytearray(header)
+
+
+def encrypt_stream(aes, mode, src, dst, chunk_size=CHUNK_SIZE):
+    """Encrypt src into dst; returns the number of input bytes processed."""
+    chaining = bytearray(os.urandom(BLOCK_SIZE))
+    dst.write(chaining)
+
+    buf = bytearray(chunk_size + BLOCK_SIZE)  # room for the padding block
+    view = memoryview(buf)
+    total = 0
+    while True:
+        n = _read_full(src, view[:chunk_size])
+        total += n
+        last = n < chunk_size
+        if mode == 'cbc':
+            if last:
+                n = pkcs7_pad(buf, n)
+            aes.encrypt_cbc(view[:n], chaining)
+        else:
+            aes.encrypt_ctr(view[:n], chaining)
+        dst.write(view[:n])
+        if last:
+            return total
+
+
+def decrypt_stream(aes, mode, src, dst, chunk_size=CHUNK_SIZE):
+    """Decrypt src into dst; returns the number of input bytes processed."""
+    chaining = _read_header(src)
+
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    # CBC: the final block is held back until we know it carries the padding
+    pending = b''
+    total = BLOCK_SIZE
+    while True:
+        n = _read_full(src, view)
+        total += n
+        if mode == 'ctr':
+            aes.decrypt_ctr(view[:n], chaining)
+            dst.write(view[:n])
+        elif n:
+            if n % BLOCK_SIZE:
+                raise ValueError("CBC ciphertext is not a multiple of the block size")
+            aes.decrypt_cbc(view[:n], chaining)
+            dst.write(pending)
+            dst.write(view[:n - BLOCK_SIZE])
+            pending = bytes(view[n - BLOCK_SIZE:n])
+        if n < chunk_size:
+            break
+
+    if mode == 'cbc':
+        if not pending:
+            raise ValueError("CBC ciphertext is empty")
+        dst.write(pending[:pkcs7_unpad_length(pending)])
+    return total
+
+
+def _load_key(args):
+    if args.key is not None:
+        key = bytes.fromhex(args.key)
+    else:
+        with open(args.key_file, 'rb') as f:
+            key = f.read()
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"key must be {KEY_SIZE} bytes, got {len(key)}")
+    return key
+
+
+def _chunk_size(value):
+    size = int(value)
+    if size <= 0 or size % BLOCK_SIZE:
+        raise argparse.ArgumentTypeError(f"chunk size must be a positive multiple of {BLOCK_SIZE}")
+    return size
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m aes_cli', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('command', choices=('encrypt', 'decrypt'))
+    parser.add_argument('--mode', choices=('cbc', 'ctr'), default='ctr')
+    key = parser.add_mutually_exclusive_group(required=True)
+    key.add_argument('--key', help='key as 32 hex digits')
+    key.add_argument('--key-file', help='file holding the raw 16-byte key')
+    parser.add_argument('--in', dest='input', default='-', help='input file (default: stdin)')
+    parser.add_argument('--out', dest='output', default='-', help='output file (default: stdout)')
+    parser.add_argument('--chunk-size', type=_chunk_size, default=CHUNK_SIZE,
+                        help=f'bytes per native call (default: {CHUNK_SIZE})')
+    parser.add_argument('--engine', help='round engine to use (see aes_ctypes.available_engines())')
+    parser.add_argument('--bench', action='store_true', help='report throughput in MB/s on stderr')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    process = encrypt_stream if args.command == 'encrypt' else decrypt_stream
+    try:
+        with contextlib.ExitStack() as stack:
+            key = _load_key(args)
+            if args.engine:
+                aes_ctypes.set_engine(args.engine)
+            # stdin/stdout are left open for the caller
+            if args.input == '-':
+                src = sys.stdin.buffer
+            else:
+                src = stack.enter_context(open(args.input, 'rb'))
+            if args.output == '-':
+                dst = sys.stdout.buffer
+            else:
+                dst = stack.enter_context(open(args.output, 'wb'))
+            aes = stack.enter_context(aes_ctypes.AES(key))
+
+            start = time.perf_counter()
+            total = process(aes, args.mode, src, dst, args.chunk_size)
+            dst.flush()
+            elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if args.bench:
+        rate = total / elapsed / 1e6 if elapsed > 0 else float('inf')
+        print(f"{args.command} {args.mode} [{aes_ctypes.get_engine()}]: "
+              f"{total} bytes in {elapsed:.3f} s, {rate:.1f} MB/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
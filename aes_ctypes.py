@@ -0,0 +1,462 @@
+"""
+ctypes binding for the C AES-128 implementation (rijndael.so).
+
+The AES class mirrors the pure-Python AES in test_aes.py, but holds a single
+native key-schedule context so the key is only expanded once per instance.
+ctypes releases the GIL around each call and the context is read-only after
+construction, so one instance can be shared between threads. close() from
+one thread while others are still inside a call only marks the instance
+closed; the last running call frees the context.
+
+The bulk mode methods hand whole buffers to the C library in a single call.
+Writable buffers (bytearray, writable memoryview, mmap, ...) are processed in
+place without copying; read-only ones such as bytes are copied first.
+
+AESGCM adds authenticated encryption (AES-128-GCM) over the same buffers,
+and AESXTS sector-addressed storage encryption (AES-128-XTS).
+"""
+
+import ctypes
+import os
+import threading
+
+BLOCK_SIZE = 16
+KEY_SIZE = 16
+TAG_SIZE = 16
+GCM_TAG_SIZES = (4, 8, 12, 13, 14, 15, 16)
+XTS_KEY_SIZE = 2 * KEY_SIZE
+
+# RIJNDAEL_LIBRARY points at another build, e.g. one made with `make PROFILE=1`
+LIBRARY_PATH = os.environ.get('RIJNDAEL_LIBRARY') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rijndael.so')
+
+_lib = None
+
+_buf_p = ctypes.POINTER(ctypes.c_char)
+
+
+class _ProfileCounter(ctypes.Structure):
+    _fields_ = [('calls', ctypes.c_uint64),
+                ('bytes', ctypes.c_uint64),
+                ('nanoseconds', ctypes.c_uint64)]
+
+
+def load_library(path=None):
+    """Load rijndael.so once and declare the signatures we call."""
+    global _lib
+    if _lib is not None:
+        return _lib
+
+    lib = ctypes.CDLL(path or LIBRARY_PATH)
+
+    lib.aes_context_new.argtypes = [ctypes.c_char_p]
+    lib.aes_context_new.restype = ctypes.c_void_p
+    lib.aes_context_free.argtypes = [ctypes.c_void_p]
+    lib.aes_context_free.restype = None
+    lib.aes_context_encrypt_block.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.aes_context_encrypt_block.restype = None
+    lib.aes_context_decrypt_block.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.aes_context_decrypt_block.restype = None
+    for name in ('aes_context_encrypt_block_into', 'aes_context_decrypt_block_into'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_char_p, _buf_p]
+        getattr(lib, name).restype = None
+    for name in ('aes_encrypt_block_into', 'aes_decrypt_block_into'):
+        getattr(lib, name).argtypes = [ctypes.c_char_p, ctypes.c_char_p, _buf_p]
+        getattr(lib, name).restype = None
+
+    lib.aes_set_engine.argtypes = [ctypes.c_int]
+    lib.aes_set_engine.restype = ctypes.c_int
+    lib.aes_get_engine.argtypes = []
+    lib.aes_get_engine.restype = ctypes.c_int
+    lib.aes_engine_name.argtypes = [ctypes.c_int]
+    lib.aes_engine_name.restype = ctypes.c_char_p
+    lib.aes_engine_available.argtypes = [ctypes.c_int]
+    lib.aes_engine_available.restype = ctypes.c_int
+
+    for name in ('aes_ecb_encrypt', 'aes_ecb_decrypt'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, _buf_p, ctypes.c_size_t]
+        getattr(lib, name).restype = None
+    for name in ('aes_cbc_encrypt', 'aes_cbc_decrypt', 'aes_ctr_crypt'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, _buf_p, _buf_p, ctypes.c_size_t]
+        getattr(lib, name).restype = None
+
+    lib.aes_gcm_new.argtypes = [ctypes.c_char_p]
+    lib.aes_gcm_new.restype = ctypes.c_void_p
+    lib.aes_gcm_free.argtypes = [ctypes.c_void_p]
+    lib.aes_gcm_free.restype = None
+    for name in ('aes_gcm_seal', 'aes_gcm_open'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t,
+                                       ctypes.c_char_p, ctypes.c_size_t, _buf_p, ctypes.c_size_t,
+                                       _buf_p if name == 'aes_gcm_seal' else ctypes.c_char_p,
+                                       ctypes.c_size_t]
+        getattr(lib, name).restype = ctypes.c_int
+
+    lib.aes_xts_new.argtypes = [ctypes.c_char_p]
+    lib.aes_xts_new.restype = ctypes.c_void_p
+    lib.aes_xts_free.argtypes = [ctypes.c_void_p]
+    lib.aes_xts_free.restype = None
+    for name in ('aes_xts_encrypt_sector', 'aes_xts_decrypt_sector'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_uint64, _buf_p, ctypes.c_size_t]
+        getattr(lib, name).restype = ctypes.c_int
+    for name in ('aes_xts_encrypt_sectors', 'aes_xts_decrypt_sectors'):
+        getattr(lib, name).argtypes = [ctypes.c_void_p, ctypes.c_uint64, _buf_p,
+                                       ctypes.c_size_t, ctypes.c_size_t]
+        getattr(lib, name).restype = ctypes.c_int
+
+    lib.aes_profile_enabled.argtypes = []
+    lib.aes_profile_enabled.restype = ctypes.c_int
+    lib.aes_profile_name.argtypes = [ctypes.c_int]
+    lib.aes_profile_name.restype = ctypes.c_char_p
+    lib.aes_profile_snapshot.argtypes = [ctypes.POINTER(_ProfileCounter)]
+    lib.aes_profile_snapshot.restype = None
+    lib.aes_profile_reset.argtypes = []
+    lib.aes_profile_reset.restype = None
+
+    _lib = lib
+    return _lib
+
+
+def engines():
+    """Names of the round engines compiled into the library, by number."""
+    lib = load_library()
+    names = []
+    while True:
+        name = lib.aes_engine_name(len(names))
+        if name is None:
+            return names
+        names.append(name.decode())
+
+
+def available_engines():
+    """Engines this CPU can run (e.g. 'aesni' only with AES-NI)."""
+    lib = load_library()
+    return [name for i, name in enumerate(engines()) if lib.aes_engine_available(i)]
+
+
+def get_engine():
+    """
+    Name of the engine currently used by every context. Unless overridden,
+    this is 'aesni' on CPUs with AES-NI and 'bytewise' elsewhere.
+    """
+    lib = load_library()
+    return lib.aes_engine_name(lib.aes_get_engine()).decode()
+
+
+def set_engine(name):
+    """
+    Select the round engine process-wide. All engines give identical output;
+    switch before handing contexts to worker threads.
+    """
+    names = engines()
+    if name not in names:
+        raise ValueError(f"unknown engine {name!r}, expected one of {names}")
+    if load_library().aes_set_engine(names.index(name)) != 0:
+        raise ValueError(f"engine {name!r} is not usable on this machine")
+
+
+def profile_enabled():
+    """True if the library was built with the profiling counters."""
+    return bool(load_library().aes_profile_enabled())
+
+
+def profile_snapshot():
+    """
+    Current profiling counters as {name: {'calls', 'bytes', 'ns'}}, one
+    entry per stage and entry point (see rijndael.h). All zeros unless the
+    library was built with `make PROFILE=1`.
+    """
+    lib = load_library()
+    names = []
+    while lib.aes_profile_name(len(names)) is not None:
+        names.append(lib.aes_profile_name(len(names)).decode())
+    counters = (_ProfileCounter * len(names))()
+    lib.aes_profile_snapshot(counters)
+    return {name: {'calls': c.calls, 'bytes': c.bytes, 'ns': c.nanoseconds}
+            for name, c in zip(names, counters)}
+
+
+def profile_reset():
+    load_library().aes_profile_reset()
+
+
+class AuthenticationError(ValueError):
+    """An AES-GCM tag did not match the ciphertext, AAD and IV."""
+
+
+def _writable(data):
+    """Return a writable buffer over data, copying only if it is read-only."""
+    view = memoryview(data)
+    if view.readonly:
+        return bytearray(view)
+    return data
+
+
+def _pointer(buf):
+    """Zero-copy ctypes pointer into a writable buffer (NULL when empty)."""
+    n = memoryview(buf).nbytes
+    if n == 0:
+        return None
+    return (ctypes.c_char * n).from_buffer(buf)
+
+
+def _check_blocks(buf):
+    n = memoryview(buf).nbytes
+    if n % BLOCK_SIZE:
+        raise ValueError(f"data length must be a multiple of {BLOCK_SIZE}, got {n}")
+    return n // BLOCK_SIZE
+
+
+def _single_block(value, name):
+    """One 16-byte block as bytes, which ctypes passes without a copy."""
+    if len(value) != BLOCK_SIZE:
+        raise ValueError(f"{name} must be {BLOCK_SIZE} bytes, got {len(value)}")
+    return bytes(value)
+
+
+def _chaining_block(value, name):
+    """A 16-byte IV/counter; bytearrays are used (and updated) in place."""
+    if len(value) != BLOCK_SIZE:
+        raise ValueError(f"{name} must be {BLOCK_SIZE} bytes, got {len(value)}")
+    return _writable(value)
+
+
+class _NativeContext:
+    """
+    Owner of one native context. Calls into C go through _call(), which
+    counts them as users; close() frees the context right away only when
+    no call is running, otherwise the last one to finish frees it.
+    """
+
+    def __init__(self, ctx, free):
+        self._ctx = ctx
+        self._free = free
+        self._lock = threading.Lock()
+        self._users = 0
+        self._closed = False
+
+    def _call(self, fn, *args):
+        """fn(ctx, *args) with the context kept alive for the duration."""
+        with self._lock:
+            if self._closed:
+                raise ValueError("key schedule has been closed")
+            self._users += 1
+        try:
+            return fn(self._ctx, *args)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._users -= 1
+            if not self._closed or self._users:
+                return
+            ctx, self._ctx = self._ctx, None
+        self._free(ctx)
+
+    def close(self):
+        """Zero and release the native context (deferred while calls run)."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._users:
+                return
+            ctx, self._ctx = self._ctx, None
+        self._free(ctx)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # __init__ may have failed before the context existed; a running
+        # call holds a reference, so nothing can be using it here
+        if getattr(self, '_ctx', None):
+            self.close()
+
+
+class AES(_NativeContext):
+    """AES-128 under one key, backed by a native aes_context."""
+
+    def __init__(self, master_key):
+        if len(master_key) != KEY_SIZE:
+            raise ValueError(f"AES-128 key must be {KEY_SIZE} bytes, got {len(master_key)}")
+        self._lib = load_library()
+        ctx = self._lib.aes_context_new(bytes(master_key))
+        if not ctx:
+            raise MemoryError("aes_context_new failed")
+        super().__init__(ctx, self._lib.aes_context_free)
+
+    def encrypt_block(self, plaintext):
+        plaintext = _single_block(plaintext, 'plaintext')
+        # The input is read straight from the bytes object; only out is allocated
+        out = ctypes.create_string_buffer(BLOCK_SIZE)
+        self._call(self._lib.aes_context_encrypt_block_into, plaintext, out)
+        return out.raw
+
+    def decrypt_block(self, ciphertext):
+        ciphertext = _single_block(ciphertext, 'ciphertext')
+        out = ctypes.create_string_buffer(BLOCK_SIZE)
+        self._call(self._lib.aes_context_decrypt_block_into, ciphertext, out)
+        return out.raw
+
+    def encrypt_ecb(self, data):
+        """Encrypt a multiple of 16 bytes in ECB mode; returns the buffer."""
+        buf = _writable(data)
+        self._call(self._lib.aes_ecb_encrypt, _pointer(buf), _check_blocks(buf))
+        return buf
+
+    def decrypt_ecb(self, data):
+        buf = _writable(data)
+        self._call(self._lib.aes_ecb_decrypt, _pointer(buf), _check_blocks(buf))
+        return buf
+
+    def encrypt_cbc(self, data, iv):
+        """
+        Encrypt a multiple of 16 bytes in CBC mode (no padding). If iv is a
+        bytearray it is updated to the last ciphertext block, so the next
+        chunk of a stream can be passed with the same iv object.
+        """
+        buf = _writable(data)
+        iv = _chaining_block(iv, 'iv')
+        self._call(self._lib.aes_cbc_encrypt, _pointer(iv), _pointer(buf), _check_blocks(buf))
+        return buf
+
+    def decrypt_cbc(self, data, iv):
+        buf = _writable(data)
+        iv = _chaining_block(iv, 'iv')
+        self._call(self._lib.aes_cbc_decrypt, _pointer(iv), _pointer(buf), _check_blocks(buf))
+        return buf
+
+    def encrypt_ctr(self, data, nonce):
+        """
+        Encrypt data of any length in CTR mode. nonce is the initial 16-byte
+        counter block, incremented as a 128-bit big-endian integer; if it is
+        a bytearray it is advanced in place past the blocks used.
+        """
+        buf = _writable(data)
+        counter = _chaining_block(nonce, 'nonce')
+        self._call(self._lib.aes_ctr_crypt, _pointer(counter), _pointer(buf), memoryview(buf).nbytes)
+        return buf
+
+    decrypt_ctr = encrypt_ctr
+
+
+
+class AESGCM(_NativeContext):
+    """AES-128-GCM authenticated encryption, backed by a native aes_gcm_context."""
+
+    def __init__(self, master_key):
+        if len(master_key) != KEY_SIZE:
+            raise ValueError(f"AES-128 key must be {KEY_SIZE} bytes, got {len(master_key)}")
+        self._lib = load_library()
+        ctx = self._lib.aes_gcm_new(bytes(master_key))
+        if not ctx:
+            raise MemoryError("aes_gcm_new failed")
+        super().__init__(ctx, self._lib.aes_gcm_free)
+
+    @staticmethod
+    def _check(iv, tag_length):
+        if len(iv) == 0:
+            raise ValueError("iv must not be empty")
+        if tag_length not in GCM_TAG_SIZES:
+            raise ValueError(f"tag length must be one of {GCM_TAG_SIZES}, got {tag_length}")
+
+    def seal(self, data, iv, aad=b'', tag_length=TAG_SIZE):
+        """
+        Encrypt data of any length and authenticate it together with aad.
+        iv should be 12 random or unique bytes and must never repeat under
+        one key. Returns (ciphertext buffer, tag).
+        """
+        self._check(iv, tag_length)
+        buf = _writable(data)
+        tag = bytearray(tag_length)
+        aad = bytes(aad)
+        if self._call(self._lib.aes_gcm_seal, bytes(iv), len(iv), aad, len(aad),
+                                  _pointer(buf), memoryview(buf).nbytes,
+                                  _pointer(tag), tag_length) != 0:
+            raise ValueError("data too long for GCM")
+        return buf, bytes(tag)
+
+    def open(self, data, iv, tag, aad=b''):
+        """
+        Verify tag and decrypt data; returns the plaintext buffer. Raises
+        AuthenticationError (leaving a writable data buffer zeroed) when the
+        ciphertext, aad, iv or tag were tampered with.
+        """
+        self._check(iv, len(tag))
+        buf = _writable(data)
+        aad = bytes(aad)
+        if self._call(self._lib.aes_gcm_open, bytes(iv), len(iv), aad, len(aad),
+                                  _pointer(buf), memoryview(buf).nbytes,
+                                  bytes(tag), len(tag)) != 0:
+            raise AuthenticationError("GCM tag mismatch")
+        return buf
+
+
+
+class AESXTS(_NativeContext):
+    """
+    AES-128-XTS under a 32-byte key (data key, then tweak key), backed by a
+    native aes_xts_context. Sectors are encrypted independently, so any
+    sector can be decrypted on its own given its number.
+    """
+
+    def __init__(self, key):
+        if len(key) != XTS_KEY_SIZE:
+            raise ValueError(f"AES-128-XTS key must be {XTS_KEY_SIZE} bytes, got {len(key)}")
+        key = bytes(key)
+        if key[:KEY_SIZE] == key[KEY_SIZE:]:
+            raise ValueError("XTS data and tweak keys must differ")
+        self._lib = load_library()
+        ctx = self._lib.aes_xts_new(key)
+        if not ctx:
+            raise MemoryError("aes_xts_new failed")
+        super().__init__(ctx, self._lib.aes_xts_free)
+
+    @staticmethod
+    def _check_sector(sector):
+        if not 0 <= sector < 1 << 64:
+            raise ValueError(f"sector number must fit in 64 bits, got {sector}")
+
+    def _sector(self, fn, data, sector):
+        self._check_sector(sector)
+        buf = _writable(data)
+        n = memoryview(buf).nbytes
+        if n < BLOCK_SIZE:
+            raise ValueError(f"an XTS sector must be at least {BLOCK_SIZE} bytes, got {n}")
+        self._call(fn, sector, _pointer(buf), n)
+        return buf
+
+    def _sectors(self, fn, data, first_sector, sector_size):
+        buf = _writable(data)
+        n = memoryview(buf).nbytes
+        if sector_size < BLOCK_SIZE:
+            raise ValueError(f"sector size must be at least {BLOCK_SIZE} bytes, got {sector_size}")
+        if n % sector_size:
+            raise ValueError(f"data length {n} is not a multiple of the sector size {sector_size}")
+        num_sectors = n // sector_size
+        self._check_sector(first_sector)
+        self._check_sector(first_sector + max(num_sectors - 1, 0))
+        self._call(fn, first_sector, _pointer(buf), sector_size, num_sectors)
+        return buf
+
+    def encrypt_sector(self, data, sector):
+        """Encrypt one sector (16 bytes or more, any length); returns the buffer."""
+        return self._sector(self._lib.aes_xts_encrypt_sector, data, sector)
+
+    def decrypt_sector(self, data, sector):
+        return self._sector(self._lib.aes_xts_decrypt_sector, data, sector)
+
+    def encrypt_sectors(self, data, first_sector, sector_size):
+        """
+        Encrypt consecutive sectors of sector_size bytes, numbered from
+        first_sector, in one native call; returns the buffer.
+        """
+        return self._sectors(self._lib.aes_xts_encrypt_sectors, data, first_sector, sector_size)
+
+    def decrypt_sectors(self, data, first_sector, sector_size):
+        return self._sectors(self._lib.aes_xts_decrypt_sectors, data, first_sector, sector_size)
+
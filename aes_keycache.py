@@ -0,0 +1,148 @@
+"""
+Process-wide LRU cache of expanded AES-128 key schedules.
+
+Expanding a key costs about as much as encrypting a short message, so
+services that reuse a few thousand keys across many small messages keep
+the schedules here instead of rebuilding them per call. An entry holds both
+the encryption and decryption schedules (an aes_ctypes.AES wraps one native
+aes_context with both; a test_aes.AES derives both from its key matrices).
+
+Entries are borrowed with acquire(), which keeps them alive while in use:
+
+    with aes_keycache.CACHE.acquire(key) as aes:
+        aes.encrypt_ctr(buf, nonce)
+
+Evicted schedules are zeroed through their close() method as soon as the
+last borrower releases them. The cache is safe to share between threads;
+keys are expanded outside its lock, so a miss doesn't stall other lookups.
+Entries are indexed by an HMAC of the master key under a per-process
+random key, so the map itself never holds raw key material.
+"""
+
+import contextlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+
+import aes_ctypes
+import test_aes
+
+DEFAULT_CAPACITY = 4096
+
+_INDEX_KEY = os.urandom(32)
+
+
+def _index(key):
+    return hmac.digest(_INDEX_KEY, key, 'sha256')
+
+
+class _Entry:
+    __slots__ = ('schedule', 'users', 'evicted')
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.users = 0
+        self.evicted = False
+
+
+class KeyScheduleCache:
+    """Bounded, thread-safe LRU map from master key to key schedule."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, factory=aes_ctypes.AES):
+        if capacity < 1:
+            raise ValueError("cache capacity must be at least 1")
+        self._capacity = capacity
+        self._factory = factory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        """Borrow the schedule for key, expanding it on a miss."""
+        key = bytes(key)
+        index = _index(key)
+        with self._lock:
+            entry = self._entries.get(index)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(index)
+                entry.users += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            entry = self._insert(index, self._factory(key))
+        try:
+            yield entry.schedule
+        finally:
+            with self._lock:
+                entry.users -= 1
+                if entry.evicted and entry.users == 0:
+                    entry.schedule.close()
+
+    def _insert(self, index, schedule):
+        with self._lock:
+            entry = self._entries.get(index)
+            if entry is None:
+                entry = self._entries[index] = _Entry(schedule)
+                schedule = None
+            else:
+                # Another thread expanded the same key first; use its entry
+                self._entries.move_to_end(index)
+            entry.users += 1
+            self._shrink()
+        if schedule is not None:
+            schedule.close()
+        return entry
+
+    def _shrink(self):
+        # Caller holds the lock
+        while len(self._entries) > self._capacity:
+            _, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._retire(entry)
+
+    def _retire(self, entry):
+        entry.evicted = True
+        if entry.users == 0:
+            entry.schedule.close()
+
+    def resize(self, capacity):
+        if capacity < 1:
+            raise ValueError("cache capacity must be at least 1")
+        with self._lock:
+            self._capacity = capacity
+            self._shrink()
+
+    def clear(self):
+        """Drop (and zero) every entry; counters are kept."""
+        with self._lock:
+            while self._entries:
+                self._retire(self._entries.popitem()[1])
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'capacity': self._capacity,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# Shared caches for the C library and for the pure-Python fallback. Nothing
+# is loaded until the first miss.
+CACHE = KeyScheduleCache()
+PYTHON_CACHE = KeyScheduleCache(factory=test_aes.AES)
@@ -0,0 +1,152 @@
+"""
+Parallel AES-128 CTR and XTS modes.
+
+CTR keystream blocks only depend on the counter, so a buffer can be cut into
+chunks whose starting counters are known up front and the chunks encrypted
+concurrently. With the C library (backend='c') the chunks run on a thread
+pool: ctypes releases the GIL for each call and one read-only key-schedule
+context is shared by all threads. The pure-Python AES (backend='python')
+holds the GIL, so it runs on a process pool instead.
+
+Either way the output is byte-identical to aes_ctypes.AES.encrypt_ctr over
+the whole buffer with the same initial counter block.
+
+XTS sectors are independent by construction, so encrypt_xts/decrypt_xts
+hand runs of whole sectors to a thread pool sharing one AESXTS context.
+"""
+
+import concurrent.futures
+import os
+
+import aes_ctypes
+import test_aes
+from aes_ctypes import BLOCK_SIZE, KEY_SIZE
+
+CHUNK_SIZE = 1024 * 1024
+
+SECTOR_SIZE = 4096
+
+_COUNTER_MODULUS = 1 << (8 * BLOCK_SIZE)
+
+
+def _counter_at(nonce, block_index):
+    """Counter block for the given block offset from the initial counter."""
+    value = (int.from_bytes(nonce, 'big') + block_index) % _COUNTER_MODULUS
+    return value.to_bytes(BLOCK_SIZE, 'big')
+
+
+def _chunks(length, chunk_size):
+    for start in range(0, length, chunk_size):
+        yield start, min(start + chunk_size, length)
+
+
+def _python_ctr_chunk(key, chunk, counter):
+    """Process-pool worker: CTR over one chunk with the pure-Python AES."""
+    aes = test_aes.AES(key)
+    n_blocks = (len(chunk) + BLOCK_SIZE - 1) // BLOCK_SIZE
+    start = int.from_bytes(counter, 'big')
+    counters = b''.join(((start + i) % _COUNTER_MODULUS).to_bytes(BLOCK_SIZE, 'big')
+                        for i in range(n_blocks))
+    if test_aes.np is not None:
+        keystream = aes.encrypt_blocks(counters).tobytes()
+    else:
+        keystream = b''.join(aes.encrypt_block(counters[i:i + BLOCK_SIZE])
+                             for i in range(0, len(counters), BLOCK_SIZE))
+    return test_aes.xor_bytes(chunk, keystream)
+
+
+def encrypt_ctr(key, data, nonce, workers=None, chunk_size=CHUNK_SIZE, backend='c'):
+    """
+    Encrypt (or decrypt) data in CTR mode using up to `workers` threads or
+    processes, each handling `chunk_size` bytes at a time. nonce is the
+    initial 16-byte counter block. With backend='c', writable buffers are
+    processed in place; the processed buffer is returned.
+    """
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"AES-128 key must be {KEY_SIZE} bytes, got {len(key)}")
+    if len(nonce) != BLOCK_SIZE:
+        raise ValueError(f"nonce must be {BLOCK_SIZE} bytes, got {len(nonce)}")
+    if chunk_size <= 0 or chunk_size % BLOCK_SIZE:
+        raise ValueError(f"chunk size must be a positive multiple of {BLOCK_SIZE}")
+    if backend not in ('c', 'python'):
+        raise ValueError(f"unknown backend {backend!r}, expected 'c' or 'python'")
+    workers = workers or os.cpu_count() or 1
+
+    buf = aes_ctypes._writable(data)
+    view = memoryview(buf).cast('B')
+    nonce = bytes(nonce)
+    chunks = list(_chunks(len(view), chunk_size))
+
+    if backend == 'c':
+        with aes_ctypes.AES(key) as aes:
+            def work(bounds):
+                start, end = bounds
+                aes.encrypt_ctr(view[start:end], _counter_at(nonce, start // BLOCK_SIZE))
+
+            if workers == 1 or len(chunks) <= 1:
+                for bounds in chunks:
+                    work(bounds)
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                    # list() re-raises the first worker exception, if any
+                    list(pool.map(work, chunks))
+        return buf
+
+    key = bytes(key)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_python_ctr_chunk, key, bytes(view[start:end]),
+                               _counter_at(nonce, start // BLOCK_SIZE))
+                   for start, end in chunks]
+        for (start, end), future in zip(chunks, futures):
+            view[start:end] = future.result()
+    return buf
+
+
+decrypt_ctr = encrypt_ctr
+
+
+def _xts(key, data, first_sector, sector_size, workers, chunk_size, decrypt):
+    if sector_size < BLOCK_SIZE:
+        raise ValueError(f"sector size must be at least {BLOCK_SIZE} bytes, got {sector_size}")
+    if chunk_size <= 0:
+        raise ValueError("chunk size must be positive")
+    workers = workers or os.cpu_count() or 1
+
+    buf = aes_ctypes._writable(data)
+    view = memoryview(buf).cast('B')
+    if len(view) % sector_size:
+        raise ValueError(f"data length {len(view)} is not a multiple of the sector size {sector_size}")
+    # Whole sectors per task, at least one
+    step = max(1, chunk_size // sector_size) * sector_size
+    chunks = list(_chunks(len(view), step))
+
+    with aes_ctypes.AESXTS(key) as xts:
+        fn = xts.decrypt_sectors if decrypt else xts.encrypt_sectors
+
+        def work(bounds):
+            start, end = bounds
+            fn(view[start:end], first_sector + start // sector_size, sector_size)
+
+        if workers == 1 or len(chunks) <= 1:
+            for bounds in chunks:
+                work(bounds)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(work, chunks))
+    return buf
+
+
+def encrypt_xts(key, data, first_sector=0, sector_size=SECTOR_SIZE, workers=None,
+                chunk_size=CHUNK_SIZE):
+    """
+    Encrypt consecutive XTS sectors numbered from first_sector, spreading
+    runs of about chunk_size bytes over up to `workers` threads. key is the
+    32-byte XTS key. Writable buffers are processed in place; the processed
+    buffer is returned.
+    """
+    return _xts(key, data, first_sector, sector_size, workers, chunk_size, False)
+
+
+def decrypt_xts(key, data, first_sector=0, sector_size=SECTOR_SIZE, workers=None,
+                chunk_size=CHUNK_SIZE):
+    return _xts(key, data, first_sector, sector_size, workers, chunk_size, True)
@@ -0,0 +1,182 @@
+"""
+Opt-in profiling counters for the AES implementations.
+
+Every counter holds calls, bytes processed and cumulative nanoseconds, per
+round stage and per API entry point, plus key expansions. The C library
+only has them when built with `make PROFILE=1` (see rijndael.h), where
+heap allocations and frees of its contexts are counted as well;
+aes_ctypes.profile_snapshot() reads them. The pure-Python AES in
+test_aes.py gets the COUNTERS below only while profiling is enabled.
+enable() wraps its round stages and AES methods with timing shims and
+disable() puts the originals back, so normal runs pay nothing.
+
+    with aes_profile.profiling():
+        run_workload()
+    metrics = aes_profile.metrics()    # {'aes.python.encrypt_block.calls': ...}
+
+The T-table ('words') engine fuses the stages into table lookups, so stage
+counters only move for AES(key, engine='matrix'), like the byte-wise engine
+on the C side.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+
+import aes_ctypes
+import test_aes
+
+# Module-level round stages of test_aes, looked up at call time by the
+# matrix engine, so replacing the module attribute instruments them
+STAGES = ('sub_bytes', 'shift_rows', 'mix_columns', 'add_round_key',
+          'inv_sub_bytes', 'inv_shift_rows', 'inv_mix_columns')
+
+# test_aes.AES method -> counter (same names as the C counters)
+METHODS = {
+    'encrypt_block': 'encrypt_block',
+    'decrypt_block': 'decrypt_block',
+    'encrypt_blocks': 'ecb_encrypt',
+    'decrypt_blocks': 'ecb_decrypt',
+}
+
+COUNTERS = STAGES + ('key_expansion',) + tuple(METHODS.values())
+
+
+class Counters:
+    """Thread-safe calls/bytes/ns counters, keyed by name."""
+
+    def __init__(self, names):
+        self._names = tuple(names)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, name, nbytes, ns):
+        with self._lock:
+            counter = self._counts[name]
+            counter[0] += 1
+            counter[1] += nbytes
+            counter[2] += ns
+
+    def reset(self):
+        with self._lock:
+            self._counts = {name: [0, 0, 0] for name in self._names}
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {'calls': c[0], 'bytes': c[1], 'ns': c[2]}
+                    for name, c in self._counts.items()}
+
+
+PYTHON = Counters(COUNTERS)
+
+_originals = {}
+_lock = threading.Lock()
+
+
+def _timed(name, fn, nbytes):
+    # nbytes(args, result) -> bytes processed by this call
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        result = fn(*args, **kwargs)
+        PYTHON.add(name, nbytes(args, result), time.perf_counter_ns() - start)
+        return result
+    return wrapper
+
+
+def _timed_init(init):
+    @functools.wraps(init)
+    def wrapper(self, master_key, *args, **kwargs):
+        start = time.perf_counter_ns()
+        init(self, master_key, *args, **kwargs)
+        PYTHON.add('key_expansion', len(master_key), time.perf_counter_ns() - start)
+    return wrapper
+
+
+def _block_bytes(args, result):
+    return 16
+
+
+def _batch_bytes(args, result):
+    return result.nbytes
+
+
+def enable():
+    """Instrument the pure-Python AES (idempotent)."""
+    with _lock:
+        if _originals:
+            return
+        for name in STAGES:
+            fn = getattr(test_aes, name)
+            _originals[(test_aes, name)] = fn
+            setattr(test_aes, name, _timed(name, fn, _block_bytes))
+        for method, counter in METHODS.items():
+            fn = getattr(test_aes.AES, method)
+            _originals[(test_aes.AES, method)] = fn
+            nbytes = _batch_bytes if method.endswith('blocks') else _block_bytes
+            setattr(test_aes.AES, method, _timed(counter, fn, nbytes))
+        _originals[(test_aes.AES, '__init__')] = test_aes.AES.__init__
+        test_aes.AES.__init__ = _timed_init(test_aes.AES.__init__)
+
+
+def disable():
+    """Restore the uninstrumented functions; the counts are kept."""
+    with _lock:
+        for (owner, name), fn in _originals.items():
+            setattr(owner, name, fn)
+        _originals.clear()
+
+
+def enabled():
+    return bool(_originals)
+
+
+@contextlib.contextmanager
+def profiling():
+    """Instrument the pure-Python AES for the duration of the block."""
+    was_enabled = enabled()
+    enable()
+    try:
+        yield PYTHON
+    finally:
+        if not was_enabled:
+            disable()
+
+
+def _c_snapshot():
+    try:
+        return aes_ctypes.profile_snapshot()
+    except OSError:  # rijndael.so not built or not loadable here
+        return None
+
+
+def snapshot():
+    """
+    Copy of every counter: {'python': {...}, 'c': {...}}, each mapping a
+    counter name to {'calls', 'bytes', 'ns'}. 'c' is left out when the C
+    library can't be loaded; its counters read zero unless it was built
+    with profiling.
+    """
+    result = {'python': PYTHON.snapshot()}
+    c_counters = _c_snapshot()
+    if c_counters is not None:
+        result['c'] = c_counters
+    return result
+
+
+def reset():
+    """Zero the Python counters and, if it is loadable, the C library's."""
+    PYTHON.reset()
+    try:
+        aes_ctypes.profile_reset()
+    except OSError:
+        pass
+
+
+def metrics(prefix='aes'):
+    """snapshot() flattened to {'<prefix>.<impl>.<counter>.<field>': value}."""
+    return {f"{prefix}.{impl}.{name}.{field}": value
+            for impl, counters in snapshot().items()
+            for name, fields in counters.items()
+            for field, value in fields.items()}
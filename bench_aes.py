@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the AES-128 implementations in this repository.
+
+Measures key expansion, single-block encryption/decryption, the bulk modes,
+GCM sealing and XTS for the C library (every engine the CPU supports,
+through ctypes), for the _rijndael extension when it is built, and for the
+pure-Python AES, across a range of payload sizes. Each case is
+warmed up, then timed `--repeat` times; every sample runs enough iterations to
+last at least `--min-time` seconds. Results are written as JSON with
+per-operation percentiles and derived blocks/s and MB/s.
+
+    python3 bench_aes.py --output bench.json
+    python3 bench_aes.py --compare bench.json      # exit 1 on regressions
+    python3 bench_aes.py --compare bench.json --report-only
+
+--compare judges each case by its fastest sample: timing noise (other
+processes, frequency scaling, cache misses) only ever adds time, so the
+minimum is far steadier between runs than the median. On shared machines
+(CI runners, VMs) even that can swing by tens of percent, so --report-only
+prints the comparison without failing.
+
+`make bench` runs the default (CI-sized) suite; add --full for payloads up
+to 1 GiB.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import aes_ctypes
+import test_aes
+from aes_ctypes import BLOCK_SIZE
+
+try:
+    import _rijndael
+except ImportError:  # `make ext` builds it
+    _rijndael = None
+
+QUICK_SIZES = [16, 256, 4096, 65536]
+FULL_SIZES = QUICK_SIZES + [1 << 20, 16 << 20, 256 << 20, 1 << 30]
+PYTHON_MAX_SIZE = 64 * 1024
+REGRESSION_THRESHOLD = 0.10
+
+
+class Case:
+    """One benchmark: fn() processes `size` bytes (0 for key expansion)."""
+
+    def __init__(self, name, backend, engine, size, fn):
+        self.name = name
+        self.backend = backend
+        self.engine = engine
+        self.size = size
+        self.fn = fn
+
+    @property
+    def id(self):
+        return f"{self.name}/{self.backend}/{self.engine or '-'}/{self.size}"
+
+
+def percentile(samples, q):
+    """Linear-interpolated percentile of a list of numbers (q in 0..100)."""
+    ordered = sorted(samples)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _time_loops(fn, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - start
+
+
+def measure(fn, warmup, repeat, min_time):
+    """Per-call times (seconds) for `repeat` calibrated samples."""
+    for _ in range(warmup):
+        fn()
+    loops = 1
+    while True:
+        elapsed = _time_loops(fn, loops)
+        if elapsed >= min_time:
+            break
+        # Aim a little past min_time so the next try usually succeeds
+        loops = max(loops * 2, int(loops * min_time * 1.2 / max(elapsed, 1e-9)))
+    # The calibration run that reached min_time is a valid first sample
+    samples = [elapsed / loops]
+    samples += [_time_loops(fn, loops) / loops for _ in range(repeat - 1)]
+    return samples
+
+
+def summarize(case, samples):
+    median = percentile(samples, 50)
+    result = {
+        'id': case.id,
+        'name': case.name,
+        'backend': case.backend,
+        'engine': case.engine,
+        'size': case.size,
+        'repeat': len(samples),
+        'seconds': {
+            'min': min(samples),
+            'mean': sum(samples) / len(samples),
+            'p50': median,
+            'p90': percentile(samples, 90),
+            'p99': percentile(samples, 99),
+        },
+        'ops_per_s': 1 / median,
+    }
+    if case.size:
+        result['blocks_per_s'] = case.size / BLOCK_SIZE / median
+        result['mb_per_s'] = case.size / median / 1e6
+    return result
+
+
+def c_cases(sizes, key, engine, key_expansion=True):
+    # The contexts are closed once the caller has run every case
+    with aes_ctypes.AES(key) as aes, aes_ctypes.AESGCM(key) as gcm, \
+            aes_ctypes.AESXTS(key + bytes(reversed(key))) as xts:
+        block = bytes(BLOCK_SIZE)
+        if key_expansion:
+            yield Case('key_expansion', 'c', None, 0, lambda: aes_ctypes.AES(key).close())
+        yield Case('encrypt_block', 'c', engine, BLOCK_SIZE, lambda: aes.encrypt_block(block))
+        yield Case('decrypt_block', 'c', engine, BLOCK_SIZE, lambda: aes.decrypt_block(block))
+        for size in sizes:
+            buf = bytearray(size)
+            iv = bytes(BLOCK_SIZE)
+            yield Case('ecb_encrypt', 'c', engine, size, lambda buf=buf: aes.encrypt_ecb(buf))
+            yield Case('ecb_decrypt', 'c', engine, size, lambda buf=buf: aes.decrypt_ecb(buf))
+            yield Case('cbc_encrypt', 'c', engine, size, lambda buf=buf: aes.encrypt_cbc(buf, iv))
+            yield Case('cbc_decrypt', 'c', engine, size, lambda buf=buf: aes.decrypt_cbc(buf, iv))
+            yield Case('ctr', 'c', engine, size, lambda buf=buf: aes.encrypt_ctr(buf, iv))
+            yield Case('gcm_seal', 'c', engine, size, lambda buf=buf: gcm.seal(buf, iv[:12]))
+            sector_size = min(size, 4096)
+            yield Case('xts_encrypt', 'c', engine, size,
+                       lambda buf=buf, n=sector_size: xts.encrypt_sectors(buf, 0, n))
+
+
+def ext_cases(sizes, key):
+    """The _rijndael extension on its default engine (no ctypes marshalling)."""
+    aes = _rijndael.AES(key)
+    engine = _rijndael.get_engine()
+    block = bytes(BLOCK_SIZE)
+    yield Case('key_expansion', 'ext', None, 0, lambda: _rijndael.AES(key))
+    yield Case('encrypt_block', 'ext', engine, BLOCK_SIZE, lambda: aes.encrypt_block(block))
+    yield Case('decrypt_block', 'ext', engine, BLOCK_SIZE, lambda: aes.decrypt_block(block))
+    for size in sizes:
+        buf = bytearray(size)
+        iv = bytes(BLOCK_SIZE)
+        yield Case('ecb_encrypt', 'ext', engine, size, lambda buf=buf: aes.encrypt_ecb(buf))
+        yield Case('ctr', 'ext', engine, size, lambda buf=buf: aes.encrypt_ctr(buf, iv))
+
+
+def python_cases(sizes, key):
+    aes = test_aes.AES(key, engine='words')
+    block = bytes(BLOCK_SIZE)
+    yield Case('key_expansion', 'python', None, 0, lambda: test_aes.AES(key))
+    yield Case('encrypt_block', 'python', 'words', BLOCK_SIZE, lambda: aes.encrypt_block(block))
+    yield Case('decrypt_block', 'python', 'words', BLOCK_SIZE, lambda: aes.decrypt_block(block))
+    matrix = test_aes.AES(key, engine='matrix')
+    yield Case('encrypt_block', 'python', 'matrix', BLOCK_SIZE, lambda: matrix.encrypt_block(block))
+    yield Case('decrypt_block', 'python', 'matrix', BLOCK_SIZE, lambda: matrix.decrypt_block(block))
+    for size in sizes:
+        if size > PYTHON_MAX_SIZE:
+            continue
+        data = bytes(size)
+        if test_aes.np is not None:
+            yield Case('ecb_encrypt', 'python', 'numpy', size, lambda data=data: aes.encrypt_blocks(data))
+            yield Case('ecb_decrypt', 'python', 'numpy', size, lambda data=data: aes.decrypt_blocks(data))
+        if size <= 4096:
+            def words_ecb(data=data):
+                for i in range(0, len(data), BLOCK_SIZE):
+                    aes.encrypt_block(data[i:i + BLOCK_SIZE])
+            yield Case('ecb_encrypt', 'python', 'words', size, words_ecb)
+
+
+def run(args):
+    key = bytes(range(16))
+    results = []
+    saved_engine = aes_ctypes.get_engine()
+
+    def record(case):
+        if args.filter and args.filter not in case.id:
+            return
+        samples = measure(case.fn, args.warmup, args.repeat, args.min_time)
+        result = summarize(case, samples)
+        results.append(result)
+        rate = f"{result['mb_per_s']:10.2f} MB/s" if 'mb_per_s' in result else f"{result['ops_per_s']:10.0f} op/s"
+        print(f"{case.id:45s} {rate}", file=sys.stderr)
+
+    try:
+        for i, engine in enumerate(aes_ctypes.available_engines()):
+            aes_ctypes.set_engine(engine)
+            # Key expansion doesn't depend on the engine; time it once
+            for case in c_cases(args.sizes, key, engine, key_expansion=(i == 0)):
+                record(case)
+    finally:
+        aes_ctypes.set_engine(saved_engine)
+
+    if _rijndael is not None:
+        for case in ext_cases(args.sizes, key):
+            record(case)
+
+    if not args.no_python:
+        for case in python_cases(args.sizes, key):
+            record(case)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'engines': aes_ctypes.available_engines(),
+            'default_engine': saved_engine,
+            'extension': _rijndael is not None,
+            'warmup': args.warmup,
+            'repeat': args.repeat,
+            'min_time': args.min_time,
+        },
+        'results': results,
+    }
+
+
+def _best_rate(result):
+    # Throughput of the fastest sample (bytes/s, or calls/s for key expansion)
+    best = result['seconds']['min']
+    return result['size'] / best if result['size'] else 1 / best
+
+
+def compare(current, baseline, threshold):
+    """
+    Print the change in best-sample throughput per case; return the ids
+    that got slower than threshold.
+    """
+    base = {r['id']: r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = base.get(result['id'])
+        if old is None:
+            continue
+        change = _best_rate(result) / _best_rate(old) - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(result['id'])
+        print(f"{result['id']:45s} {change:+8.1%}{flag}")
+    return regressions
+
+
+def _sizes(value):
+    return [int(s) for s in value.split(',')]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the AES-128 implementations.')
+    parser.add_argument('--sizes', type=_sizes, default=QUICK_SIZES,
+                        help='comma-separated payload sizes in bytes')
+    parser.add_argument('--full', action='store_const', dest='sizes', const=FULL_SIZES,
+                        help='payloads from 16 B up to 1 GiB')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--min-time', type=float, default=0.02,
+                        help='minimum seconds per timed sample')
+    parser.add_argument('--filter', help='only run cases whose id contains this string')
+    parser.add_argument('--no-python', action='store_true', help='skip the pure-Python AES')
+    parser.add_argument('--output', help='write the JSON results here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown of the fastest sample counted as a regression (default: 0.10)')
+    parser.add_argument('--report-only', action='store_true',
+                        help='print the --compare results but exit 0 on regressions')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.repeat < 1 or args.warmup < 0:
+        print("Error: --repeat must be at least 1 and --warmup non-negative", file=sys.stderr)
+        return 2
+    for size in args.sizes:
+        if size <= 0 or size % BLOCK_SIZE:
+            print(f"Error: size {size} is not a positive multiple of {BLOCK_SIZE}", file=sys.stderr)
+            return 2
+
+    current = run(args)
+    text = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+            if not args.report_only:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
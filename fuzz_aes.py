@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Differential fuzzing of the C AES-128 core against a vectorized Python
+reference.
+
+Vectors come in groups: group g of a run with seed S holds GROUP_KEYS
+random keys, each with 1 to MAX_BLOCKS_PER_KEY random blocks, all drawn
+from numpy's generator seeded with (S, g), so any group can be regenerated
+on its own. Every group is pushed key by key through the bulk ECB path of
+the C library (once per engine the CPU supports, through ctypes) and of the
+_rijndael extension when it is built. The ciphertexts are compared in bulk
+with those of a NumPy implementation of the cipher, and decrypting those
+reference ciphertexts has to give back the original blocks. The short,
+uneven runs per key exercise the engines' partial batches and key setup as
+much as their pipelines. The byte-wise engine, far slower than the others,
+only gets the first --slow-groups groups. The known-answer vectors of
+FIPS-197 and NIST (SP 800-38A, AESAVS) are checked first, on the C engines,
+the extension and the pure-Python AES.
+
+    python3 fuzz_aes.py                         # ~1.1 M vectors per path, random seed
+    python3 fuzz_aes.py --groups 256            # ~9 M vectors per path
+    python3 fuzz_aes.py --seed 1234 --group 17  # replay one group
+
+The first mismatch is printed with the seed and group that reproduce it,
+and the exit status is 1.
+"""
+
+import argparse
+import ctypes
+import functools
+import os
+import sys
+import time
+
+import aes_ctypes
+import test_aes
+from aes_ctypes import BLOCK_SIZE, KEY_SIZE
+
+np = test_aes.np
+
+try:
+    import _rijndael
+except ImportError:  # `make ext` builds it
+    _rijndael = None
+
+GROUP_KEYS = 4096
+MAX_BLOCKS_PER_KEY = 16
+DEFAULT_GROUPS = 32
+DEFAULT_SLOW_GROUPS = 4
+
+# Paths too slow for the whole run; they get the first --slow-groups groups
+SLOW_IMPLEMENTATIONS = ('c/bytewise',)
+
+# aes_ecb_* taking a raw address, so a group is walked without slicing
+_ECB = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+
+# (source, key, plaintext, ciphertext)
+KAT_VECTORS = [
+    ("FIPS-197 C.1", "000102030405060708090a0b0c0d0e0f",
+     "00112233445566778899aabbccddeeff", "69c4e0d86a7b0430d8cdb78070b4c55a"),
+    ("FIPS-197 B", "2b7e151628aed2a6abf7158809cf4f3c",
+     "3243f6a8885a308d313198a2e0370734", "3925841d02dc09fbdc118597196a0b32"),
+    ("SP 800-38A F.1.1 #1", "2b7e151628aed2a6abf7158809cf4f3c",
+     "6bc1bee22e409f96e93d7e117393172a", "3ad77bb40d7a3660a89ecaf32466ef97"),
+    ("SP 800-38A F.1.1 #2", "2b7e151628aed2a6abf7158809cf4f3c",
+     "ae2d8a571e03ac9c9eb76fac45af8e51", "f5d3d58503b9699de785895a96fdbaaf"),
+    ("SP 800-38A F.1.1 #3", "2b7e151628aed2a6abf7158809cf4f3c",
+     "30c81c46a35ce411e5fbc1191a0a52ef", "43b1cd7f598ece23881b00e3ed030688"),
+    ("SP 800-38A F.1.1 #4", "2b7e151628aed2a6abf7158809cf4f3c",
+     "f69f2445df4f9b17ad2b417be66c3710", "7b0c785e27e8ad3f8223207104725dd4"),
+    ("AESAVS GFSbox #1", "00000000000000000000000000000000",
+     "f34481ec3cc627bacd5dc3fb08f273e6", "0336763e966d92595a567cc9ce537f5e"),
+    ("AESAVS GFSbox #2", "00000000000000000000000000000000",
+     "9798c4640bad75c7c3227db910174e72", "a9a1631bf4996954ebc093957b234589"),
+    ("AESAVS GFSbox #3", "00000000000000000000000000000000",
+     "96ab5c2ff612d9dfaae8c31f30c42168", "ff4f8391a6a40ca5b25d23bedd44a597"),
+    ("AESAVS GFSbox #4", "00000000000000000000000000000000",
+     "6a118a874519e64e9963798a503f1d35", "dc43be40be0e53712f7e2bf5ca707209"),
+    ("AESAVS KeySbox #1", "10a58869d74be5a374cf867cfb473859",
+     "00000000000000000000000000000000", "6d251e6944b051e04eaa6fb4dbf78465"),
+    ("AESAVS KeySbox #2", "caea65cdbb75e9169ecd22ebe6e54675",
+     "00000000000000000000000000000000", "6e29201190152df4ee058139def610bb"),
+    ("AESAVS VarTxt #1", "00000000000000000000000000000000",
+     "80000000000000000000000000000000", "3ad78e726c1ec02b7ebfe92b23d9ec34"),
+    ("AESAVS VarKey #1", "80000000000000000000000000000000",
+     "00000000000000000000000000000000", "0edd33d3c621e546455bd8ba1418bec8"),
+]
+
+
+class Mismatch:
+    """First disagreement found; str() says how to reproduce it."""
+
+    def __init__(self, impl, op, key, data, expected, got, seed=None, group=None,
+                 key_index=None, block=None, group_keys=GROUP_KEYS, source=None):
+        self.impl = impl
+        self.op = op
+        self.key = key
+        self.data = data
+        self.expected = expected
+        self.got = got
+        self.seed = seed
+        self.group = group
+        self.key_index = key_index
+        self.block = block
+        self.group_keys = group_keys
+        self.source = source
+
+    def replay(self):
+        """Command line that re-runs just the failing group."""
+        command = f"fuzz_aes.py --seed {self.seed} --group {self.group}"
+        if self.group_keys != GROUP_KEYS:
+            command += f" --group-keys {self.group_keys}"
+        return command
+
+    def __str__(self):
+        where = (f"KAT {self.source}" if self.source is not None else
+                 f"seed {self.seed} group {self.group} key {self.key_index} block {self.block} "
+                 f"(replay: {self.replay()})")
+        return (f"{self.impl} {self.op} mismatch, {where}\n"
+                f"  key      {self.key.hex()}\n"
+                f"  input    {self.data.hex()}\n"
+                f"  expected {self.expected.hex()}\n"
+                f"  got      {self.got.hex()}")
+
+
+class Group:
+    """
+    The vectors of one (seed, group): keys (K, 16), counts (K,) blocks per
+    key and blocks (sum(counts), 16), key k's blocks following key k-1's.
+    The per-key schedules of the C library and the extension are built on
+    first use and shared by every engine.
+    """
+
+    def __init__(self, seed, index, n_keys=GROUP_KEYS):
+        rng = np.random.default_rng([seed, index])
+        self.seed = seed
+        self.index = index
+        self.counts = rng.integers(1, MAX_BLOCKS_PER_KEY + 1, size=n_keys)
+        self.keys = np.frombuffer(rng.bytes(KEY_SIZE * n_keys), dtype=np.uint8).reshape(n_keys, KEY_SIZE)
+        n_blocks = int(self.counts.sum())
+        self.blocks = np.frombuffer(rng.bytes(BLOCK_SIZE * n_blocks), dtype=np.uint8).reshape(n_blocks, BLOCK_SIZE)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        self._native = None
+        self._extension = None
+
+    def key_bytes(self):
+        raw = self.keys.tobytes()
+        return [raw[i:i + KEY_SIZE] for i in range(0, len(raw), KEY_SIZE)]
+
+    def native_contexts(self):
+        if self._native is None:
+            lib = aes_ctypes.load_library()
+            self._native = [lib.aes_context_new(key) for key in self.key_bytes()]
+        return self._native
+
+    def extension_schedules(self):
+        if self._extension is None:
+            self._extension = [_rijndael.AES(key) for key in self.key_bytes()]
+        return self._extension
+
+    def locate(self, block_index):
+        """(key index, block within that key) of a flat block index."""
+        key_index = int(np.searchsorted(self.starts, block_index, side='right')) - 1
+        return key_index, block_index - int(self.starts[key_index])
+
+    def close(self):
+        if self._native is not None:
+            lib = aes_ctypes.load_library()
+            for ctx in self._native:
+                lib.aes_context_free(ctx)
+            self._native = None
+        self._extension = None
+
+
+def expand_keys(keys):
+    """(K, 16) keys -> (K, 11, 16) round keys, every key expanded at once."""
+    words = np.empty((len(keys), 44, 4), dtype=np.uint8)
+    words[:, :4] = keys.reshape(-1, 4, 4)
+    for i in range(4, 44):
+        temp = words[:, i - 1]
+        if i % 4 == 0:
+            temp = test_aes._S_BOX_NP[np.roll(temp, -1, axis=1)]
+            temp[:, 0] ^= test_aes.Rcon[i // 4]
+        words[:, i] = words[:, i - 4] ^ temp
+    return words.reshape(-1, 11, 16)
+
+
+def _rotr(words, n):
+    return (words >> np.uint32(n)) | (words << np.uint32(32 - n))
+
+
+def _mix_columns(state):
+    # Every column as one little-endian word, byte i = row i, so the rows
+    # below are rotations and xtime works on four bytes at once
+    w = state.view('<u4')
+    x = w ^ _rotr(w, 8)
+    xtime = (((x & np.uint32(0x7f7f7f7f)) << np.uint32(1)) ^
+             (((x >> np.uint32(7)) & np.uint32(0x01010101)) * np.uint32(0x1b)))
+    return (w ^ x ^ _rotr(x, 16) ^ xtime).view(np.uint8)
+
+
+def reference_encrypt(round_keys, counts, blocks):
+    """Encrypt (N, 16) blocks, the next counts[k] of them under round_keys[k]."""
+    # (11, N, 16): round r's key for every block, contiguous
+    schedules = np.repeat(round_keys.transpose(1, 0, 2), counts, axis=1)
+    state = blocks ^ schedules[0]
+    for r in range(1, 11):
+        state = np.take(test_aes._S_BOX_NP, state[:, test_aes._SHIFT_ROWS_NP])
+        if r < 10:
+            state = _mix_columns(state)
+        state ^= schedules[r]
+    return state
+
+
+def _run_c(group, inputs, decrypt):
+    lib = aes_ctypes.load_library()
+    ecb = _ECB(('aes_ecb_decrypt' if decrypt else 'aes_ecb_encrypt', lib))
+    out = np.array(inputs)
+    address = out.ctypes.data
+    for ctx, n in zip(group.native_contexts(), group.counts.tolist()):
+        ecb(ctx, address, n)
+        address += n * BLOCK_SIZE
+    return out
+
+
+def _run_extension(group, inputs, decrypt):
+    out = bytearray(inputs.tobytes())
+    view = memoryview(out)
+    start = 0
+    for aes, n in zip(group.extension_schedules(), group.counts.tolist()):
+        end = start + n * BLOCK_SIZE
+        if decrypt:
+            aes.decrypt_ecb(view[start:end])
+        else:
+            aes.encrypt_ecb(view[start:end])
+        start = end
+    return np.frombuffer(out, dtype=np.uint8).reshape(inputs.shape)
+
+
+def implementations():
+    """(name, engine to select or None, run(group, inputs, decrypt)) per bulk C path."""
+    impls = [(f"c/{engine}", engine, _run_c) for engine in aes_ctypes.available_engines()]
+    if _rijndael is not None:
+        impls.append((f"ext/{_rijndael.get_engine()}", None, _run_extension))
+    return impls
+
+
+def _block_apis():
+    # (name, engine or None, AES factory) for everything with encrypt_block
+    apis = [(f"python/{engine}", None, functools.partial(test_aes.AES, engine=engine))
+            for engine in test_aes.ENGINES]
+    apis += [(f"c/{engine}", engine, aes_ctypes.AES) for engine in aes_ctypes.available_engines()]
+    if _rijndael is not None:
+        apis.append((f"ext/{_rijndael.get_engine()}", None, _rijndael.AES))
+    return apis
+
+
+def check_kats():
+    """Known-answer vectors on both pure-Python engines, every C engine and the extension."""
+    saved = aes_ctypes.get_engine()
+    try:
+        for name, engine, factory in _block_apis():
+            if engine is not None:
+                aes_ctypes.set_engine(engine)
+            for source, key, plaintext, ciphertext in KAT_VECTORS:
+                mismatch = _kat_one(name, factory, bytes.fromhex(key), bytes.fromhex(plaintext),
+                                    bytes.fromhex(ciphertext), source)
+                if mismatch is not None:
+                    return mismatch
+    finally:
+        aes_ctypes.set_engine(saved)
+    return None
+
+
+def _kat_one(name, factory, key, plaintext, ciphertext, source):
+    aes = factory(key)
+    got = bytes(aes.encrypt_block(plaintext))
+    if got != ciphertext:
+        return Mismatch(name, 'encrypt', key, plaintext, ciphertext, got, source=source)
+    got = bytes(aes.decrypt_block(ciphertext))
+    if got != plaintext:
+        return Mismatch(name, 'decrypt', key, ciphertext, plaintext, got, source=source)
+    return None
+
+
+def _check_group(group, impls, checked):
+    ciphertexts = reference_encrypt(expand_keys(group.keys), group.counts, group.blocks)
+    # Decryption is checked on the reference ciphertexts, so it must give
+    # back the original blocks
+    cases = [('encrypt', group.blocks, ciphertexts), ('decrypt', ciphertexts, group.blocks)]
+    for name, engine, run in impls:
+        if engine is not None:
+            aes_ctypes.set_engine(engine)
+        for op, inputs, want in cases:
+            got = run(group, inputs, op == 'decrypt')
+            bad = np.flatnonzero(np.any(got != want, axis=1))
+            if bad.size:
+                i = int(bad[0])
+                key_index, block = group.locate(i)
+                return Mismatch(name, op, group.keys[key_index].tobytes(), inputs[i].tobytes(),
+                                want[i].tobytes(), got[i].tobytes(), seed=group.seed,
+                                group=group.index, key_index=key_index, block=block,
+                                group_keys=len(group.keys))
+        checked[name] = checked.get(name, 0) + len(group.blocks)
+    return None
+
+
+def fuzz(seed, n_groups=DEFAULT_GROUPS, first_group=0, slow_groups=DEFAULT_SLOW_GROUPS,
+         group_keys=GROUP_KEYS):
+    """
+    Check n_groups groups from first_group on; the slow paths only get the
+    first slow_groups of them. Returns (first Mismatch or None, vectors
+    checked in each direction per implementation).
+    """
+    impls = implementations()
+    checked = {}
+    saved = aes_ctypes.get_engine()
+    try:
+        for i in range(n_groups):
+            paths = [impl for impl in impls if i < slow_groups or impl[0] not in SLOW_IMPLEMENTATIONS]
+            group = Group(seed, first_group + i, group_keys)
+            try:
+                mismatch = _check_group(group, paths, checked)
+            finally:
+                group.close()
+            if mismatch is not None:
+                return mismatch, checked
+    finally:
+        aes_ctypes.set_engine(saved)
+    return None, checked
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Differential fuzzing of the C AES-128 core.')
+    parser.add_argument('--seed', type=int, help='run seed (default: random, printed)')
+    parser.add_argument('--groups', type=int, default=DEFAULT_GROUPS,
+                        help=f'number of groups of {GROUP_KEYS} keys (default: {DEFAULT_GROUPS})')
+    parser.add_argument('--slow-groups', type=int, default=DEFAULT_SLOW_GROUPS,
+                        help=f"groups also run through {', '.join(SLOW_IMPLEMENTATIONS)} "
+                             f"(default: {DEFAULT_SLOW_GROUPS})")
+    parser.add_argument('--group', type=int, help='replay only this group of the seed, on every path')
+    parser.add_argument('--group-keys', type=int, default=GROUP_KEYS, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if np is None:
+        print("Error: the fuzzer needs numpy", file=sys.stderr)
+        return 2
+    if args.groups < 1 or args.slow_groups < 0 or args.group_keys < 1:
+        print("Error: --groups must be at least 1 and --slow-groups non-negative", file=sys.stderr)
+        return 2
+    seed = args.seed if args.seed is not None else int.from_bytes(os.urandom(4), 'big')
+    if args.group is not None:
+        first_group, n_groups, slow_groups = args.group, 1, 1
+    else:
+        first_group, n_groups, slow_groups = 0, args.groups, args.slow_groups
+
+    start = time.perf_counter()
+    mismatch = check_kats()
+    checked = {}
+    if mismatch is None:
+        mismatch, checked = fuzz(seed, n_groups, first_group, slow_groups, args.group_keys)
+    elapsed = time.perf_counter() - start
+
+    if mismatch is not None:
+        print(mismatch, file=sys.stderr)
+        return 1
+    counts = ', '.join(f"{name} {n}" for name, n in checked.items())
+    print(f"seed {seed}: {len(KAT_VECTORS)} KATs pass; {n_groups * args.group_keys} keys, "
+          f"vectors encrypted and decrypted per path: {counts} ({elapsed:.1f} s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,4 @@
 #include <stdio.h>
-#include <stdlib.h>
 
 #include "rijndael.h"
 
@@ -24,9 +23,13 @@ int main() {
   unsigned char key[16] = {50, 20, 46, 86, 67, 9, 70, 27,
                            75, 17, 51, 17, 4,  8, 6,  99};
 
-  unsigned char *ciphertext = aes_encrypt_block(plaintext, key);
+  unsigned char ciphertext[16];
+  unsigned char recovered_plaintext[16];
+
+  // Caller-owned output buffers: nothing is allocated, so nothing to free
+  aes_encrypt_block_into(plaintext, key, ciphertext);
   //printf("\nSubBytes + ShiftRows + mix-columns + add round key step output (intermediate):\n");
-  unsigned char *recovered_plaintext = aes_decrypt_block(ciphertext, key);
+  aes_decrypt_block_into(ciphertext, key, recovered_plaintext);
 
   printf("############ ORIGINAL PLAINTEXT ###########\n");
   print_128bit_block(plaintext);
@@ -37,8 +40,5 @@ int main() {
   printf("\n\n########### RECOVERED PLAINTEXT ###########\n");
   print_128bit_block(recovered_plaintext);
 
-  free(ciphertext);
-  free(recovered_plaintext);
-
   return 0;
 }
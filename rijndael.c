@@ -8,6 +8,7 @@
  * The code is tested against a Python reference implementation using unit tests
  */
 
+#include <stdint.h>
 #include <stdlib.h>
 #include <string.h>
 // TODO: Any other files you need to include should go here
@@ -70,17 +71,121 @@ unsigned char INV_S_BOX[256] = {
 static const unsigned char Rcon[10] = {0x01, 0x02, 0x04, 0x08, 0x10,
                                        0x20, 0x40, 0x80, 0x1b, 0x36};
 
+/*
+ * Profiling hooks. With -DRIJNDAEL_PROFILE every instrumented function
+ * brackets its body with PROFILE_BEGIN/PROFILE_END, which add one call,
+ * the bytes processed and the elapsed CLOCK_MONOTONIC nanoseconds to its
+ * counter; PROFILE_COUNT records an event (an allocation) without timing.
+ * Counters are updated with relaxed atomics, so concurrent callers don't
+ * lose counts. Without the define the macros compile to nothing.
+ */
+#ifdef RIJNDAEL_PROFILE
+#include <time.h>
+
+static aes_profile_counter profile_counters[AES_PROFILE_NUM_COUNTERS];
+
+static uint64_t profile_now(void) {
+  struct timespec ts;
+
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
+
+static void profile_add(int counter, uint64_t bytes, uint64_t nanoseconds) {
+  aes_profile_counter *c = &profile_counters[counter];
+
+  __atomic_fetch_add(&c->calls, 1, __ATOMIC_RELAXED);
+  __atomic_fetch_add(&c->bytes, bytes, __ATOMIC_RELAXED);
+  __atomic_fetch_add(&c->nanoseconds, nanoseconds, __ATOMIC_RELAXED);
+}
+
+#define PROFILE_BEGIN() uint64_t profile_start_ = profile_now()
+#define PROFILE_END(counter, bytes) \
+  profile_add((counter), (bytes), profile_now() - profile_start_)
+#define PROFILE_COUNT(counter, bytes) profile_add((counter), (bytes), 0)
+#else
+#define PROFILE_BEGIN() (void)0
+#define PROFILE_END(counter, bytes) (void)(bytes)
+#define PROFILE_COUNT(counter, bytes) (void)(bytes)
+#endif
+
+static const char *const profile_names[AES_PROFILE_NUM_COUNTERS] = {
+    [AES_PROFILE_SUB_BYTES] = "sub_bytes",
+    [AES_PROFILE_SHIFT_ROWS] = "shift_rows",
+    [AES_PROFILE_MIX_COLUMNS] = "mix_columns",
+    [AES_PROFILE_ADD_ROUND_KEY] = "add_round_key",
+    [AES_PROFILE_INV_SUB_BYTES] = "inv_sub_bytes",
+    [AES_PROFILE_INV_SHIFT_ROWS] = "inv_shift_rows",
+    [AES_PROFILE_INV_MIX_COLUMNS] = "inv_mix_columns",
+    [AES_PROFILE_KEY_EXPANSION] = "key_expansion",
+    [AES_PROFILE_ENCRYPT_BLOCK] = "encrypt_block",
+    [AES_PROFILE_DECRYPT_BLOCK] = "decrypt_block",
+    [AES_PROFILE_ECB_ENCRYPT] = "ecb_encrypt",
+    [AES_PROFILE_ECB_DECRYPT] = "ecb_decrypt",
+    [AES_PROFILE_CBC_ENCRYPT] = "cbc_encrypt",
+    [AES_PROFILE_CBC_DECRYPT] = "cbc_decrypt",
+    [AES_PROFILE_CTR] = "ctr",
+    [AES_PROFILE_GCM_SEAL] = "gcm_seal",
+    [AES_PROFILE_GCM_OPEN] = "gcm_open",
+    [AES_PROFILE_GHASH] = "ghash",
+    [AES_PROFILE_XTS_ENCRYPT] = "xts_encrypt",
+    [AES_PROFILE_XTS_DECRYPT] = "xts_decrypt",
+    [AES_PROFILE_ALLOC] = "alloc",
+    [AES_PROFILE_FREE] = "free",
+};
+
+int aes_profile_enabled(void) {
+#ifdef RIJNDAEL_PROFILE
+  return 1;
+#else
+  return 0;
+#endif
+}
+
+const char *aes_profile_name(int counter) {
+  if (counter < 0 || counter >= AES_PROFILE_NUM_COUNTERS) {
+    return NULL;
+  }
+  return profile_names[counter];
+}
+
+void aes_profile_snapshot(aes_profile_counter *out) {
+#ifdef RIJNDAEL_PROFILE
+  for (int i = 0; i < AES_PROFILE_NUM_COUNTERS; i++) {
+    out[i].calls = __atomic_load_n(&profile_counters[i].calls, __ATOMIC_RELAXED);
+    out[i].bytes = __atomic_load_n(&profile_counters[i].bytes, __ATOMIC_RELAXED);
+    out[i].nanoseconds =
+        __atomic_load_n(&profile_counters[i].nanoseconds, __ATOMIC_RELAXED);
+  }
+#else
+  memset(out, 0, AES_PROFILE_NUM_COUNTERS * sizeof(*out));
+#endif
+}
+
+void aes_profile_reset(void) {
+#ifdef RIJNDAEL_PROFILE
+  for (int i = 0; i < AES_PROFILE_NUM_COUNTERS; i++) {
+    __atomic_store_n(&profile_counters[i].calls, 0, __ATOMIC_RELAXED);
+    __atomic_store_n(&profile_counters[i].bytes, 0, __ATOMIC_RELAXED);
+    __atomic_store_n(&profile_counters[i].nanoseconds, 0, __ATOMIC_RELAXED);
+  }
+#endif
+}
+
 /*
  * Operations used when encrypting a block
  */
 void sub_bytes(unsigned char *block) {
+  PROFILE_BEGIN();
   for (int i = 0; i < BLOCK_SIZE; i++) {
     block[i] = S_BOX[block[i]];
   }
+  PROFILE_END(AES_PROFILE_SUB_BYTES, BLOCK_SIZE);
 }
 
 void shift_rows(unsigned char *block) {
   unsigned char temp;
+  PROFILE_BEGIN();
 
   // Row 0: No shift (do nothing)
 
@@ -105,6 +210,7 @@ void shift_rows(unsigned char *block) {
   BLOCK_ACCESS(block, 3, 2) = BLOCK_ACCESS(block, 3, 1);
   BLOCK_ACCESS(block, 3, 1) = BLOCK_ACCESS(block, 3, 0);
   BLOCK_ACCESS(block, 3, 0) = temp;
+  PROFILE_END(AES_PROFILE_SHIFT_ROWS, BLOCK_SIZE);
 }
 
 unsigned char xtime(unsigned char a) {
@@ -126,6 +232,7 @@ void mix_single_column(unsigned char *a) {
 
 void mix_columns(unsigned char *state) {
   unsigned char col[4];
+  PROFILE_BEGIN();
   for (int i = 0; i < 4; i++) {
     // Get i-th column (column-major order)
     for (int j = 0; j < 4; j++) {
@@ -140,18 +247,22 @@ void mix_columns(unsigned char *state) {
       state[j + i * 4] = col[j]; 
     }
   }
+  PROFILE_END(AES_PROFILE_MIX_COLUMNS, BLOCK_SIZE);
 }
 /*
  * Operations used when decrypting a block
  */
 void invert_sub_bytes(unsigned char *block) {
+  PROFILE_BEGIN();
   for (int i = 0; i < BLOCK_SIZE; i++) {
     block[i] = INV_S_BOX[block[i]];
   }
+  PROFILE_END(AES_PROFILE_INV_SUB_BYTES, BLOCK_SIZE);
 }
 
 void invert_shift_rows(unsigned char *block) {
   unsigned char temp;
+  PROFILE_BEGIN();
 
   // Row 1: Shift right by 1
   temp = BLOCK_ACCESS(block, 1, 3);
@@ -175,6 +286,7 @@ void invert_shift_rows(unsigned char *block) {
   BLOCK_ACCESS(block, 3, 1) = BLOCK_ACCESS(block, 3, 2);
   BLOCK_ACCESS(block, 3, 2) = BLOCK_ACCESS(block, 3, 3);
   BLOCK_ACCESS(block, 3, 3) = temp;
+  PROFILE_END(AES_PROFILE_INV_SHIFT_ROWS, BLOCK_SIZE);
 }
 // helper function for Galois multiplication
 unsigned char gmul(unsigned char a, unsigned char b) {
@@ -186,7 +298,14 @@ unsigned char gmul(unsigned char a, unsigned char b) {
   }
   return result;
 }
-void invert_mix_columns(unsigned char *block) {
+/*
+ * InvMixColumns multiplies each column by c(x) * ({04}x^2 + {05}), where
+ * c(x) is the MixColumns polynomial (The Design of Rijndael, 4.1.3), so it
+ * is a cheap pre-step followed by MixColumns: four xtime per column instead
+ * of sixteen gmul calls. Key setup runs it nine times per key through the
+ * uncounted inverse_mix_state, so that work only shows up as key_expansion.
+ */
+static void inverse_mix_state(unsigned char *block) {
   unsigned char a[4];
   for (int i = 0; i < 4; i++) {
     // Extract the column
@@ -194,27 +313,37 @@ void invert_mix_columns(unsigned char *block) {
       a[j] = BLOCK_ACCESS(block, j, i);
     }
 
-    // Inverse MixColumns transformation
-    BLOCK_ACCESS(block, 0, i) = gmul(a[0], 0x0E) ^ gmul(a[1], 0x0B) ^
-                                gmul(a[2], 0x0D) ^ gmul(a[3], 0x09);
-    BLOCK_ACCESS(block, 1, i) = gmul(a[0], 0x09) ^ gmul(a[1], 0x0E) ^
-                                gmul(a[2], 0x0B) ^ gmul(a[3], 0x0D);
-    BLOCK_ACCESS(block, 2, i) = gmul(a[0], 0x0D) ^ gmul(a[1], 0x09) ^
-                                gmul(a[2], 0x0E) ^ gmul(a[3], 0x0B);
-    BLOCK_ACCESS(block, 3, i) = gmul(a[0], 0x0B) ^ gmul(a[1], 0x0D) ^
-                                gmul(a[2], 0x09) ^ gmul(a[3], 0x0E);
+    unsigned char u = xtime(xtime(a[0] ^ a[2]));
+    unsigned char v = xtime(xtime(a[1] ^ a[3]));
+    a[0] ^= u;
+    a[1] ^= v;
+    a[2] ^= u;
+    a[3] ^= v;
+    mix_single_column(a);
+
+    for (int j = 0; j < 4; j++) {
+      BLOCK_ACCESS(block, j, i) = a[j];
+    }
   }
 }
 
+void invert_mix_columns(unsigned char *block) {
+  PROFILE_BEGIN();
+  inverse_mix_state(block);
+  PROFILE_END(AES_PROFILE_INV_MIX_COLUMNS, BLOCK_SIZE);
+}
+
 /*
  * This operation is shared between encryption and decryption
  */
-void add_round_key(unsigned char *block, unsigned char *round_key) {
+void add_round_key(unsigned char *block, const unsigned char *round_key) {
+  PROFILE_BEGIN();
   for (int i = 0; i < 4; i++) {
     for (int j = 0; j < 4; j++) {
       block[i * 4 + j] ^= round_key[i * 4 + j];
     }
   }
+  PROFILE_END(AES_PROFILE_ADD_ROUND_KEY, BLOCK_SIZE);
 }
 
 // Function to rotate a 4-byte word (used in key expansion)
@@ -234,12 +363,11 @@ void sub_word(unsigned char *word) {
 }
 
 /*
- * This function should expand the round key. Given an input,
- * which is a single 128-bit key, it should return a 176-byte
- * vector, containing the 11 round keys one after the other
+ * Expand a single 128-bit key into the 176-byte schedule holding the 11
+ * round keys one after the other, writing into a caller-provided buffer.
  */
-unsigned char *expand_key(unsigned char *cipher_key) {
-  static unsigned char expanded_key[176];
+void expand_key_into(const unsigned char *cipher_key,
+                     unsigned char *expanded_key) {
   unsigned char temp[4];
   int i = 0;
 
@@ -265,96 +393,2007 @@ unsigned char *expand_key(unsigned char *cipher_key) {
       i++;
     }
   }
+}
+
+/*
+ * This function should expand the round key. Given an input,
+ * which is a single 128-bit key, it should return a 176-byte
+ * vector, containing the 11 round keys one after the other.
+ * The result lives in a per-thread static buffer, so it is only
+ * overwritten by the next call from the same thread; use
+ * expand_key_into or an aes_context to keep several schedules.
+ */
+unsigned char *expand_key(unsigned char *cipher_key) {
+  static _Thread_local unsigned char expanded_key[EXPANDED_KEY_SIZE];
+  PROFILE_BEGIN();
+
+  expand_key_into(cipher_key, expanded_key);
+  PROFILE_END(AES_PROFILE_KEY_EXPANSION, KEY_SIZE);
 
   return expanded_key;
 }
 
+// Overwrite key material in a way the compiler cannot optimise away
+static void secure_zero(void *buf, size_t len) {
+  volatile unsigned char *p = (volatile unsigned char *)buf;
+  while (len--) {
+    *p++ = 0;
+  }
+}
+
 /*
- * The implementations of the functions declared in the
- * header file should go here
+ * Run the AES-128 rounds over a single block in place, using an
+ * already expanded key schedule.
  */
-unsigned char *aes_encrypt_block(unsigned char *plaintext, unsigned char *key) {
-  unsigned char *output =
-      (unsigned char *)malloc(sizeof(unsigned char) * BLOCK_SIZE);
+static void encrypt_rounds(unsigned char *block,
+                           const unsigned char *round_keys) {
+  // Initial round key addition
+  add_round_key(block, round_keys);
 
-  if (output == NULL) {
-    return NULL;  // Handle allocation failure
+  // 9 main rounds
+  for (int round = 1; round < NUM_ROUNDS; round++) {
+    sub_bytes(block);
+    shift_rows(block);
+    mix_columns(block);
+    add_round_key(block, round_keys + round * BLOCK_SIZE);
   }
 
-  // Initialize output with the input block
-  for (int i = 0; i < BLOCK_SIZE; i++) {
-    output[i] = plaintext[i];
+  // Final round (no mix_columns)
+  sub_bytes(block);
+  shift_rows(block);
+  add_round_key(block, round_keys + NUM_ROUNDS * BLOCK_SIZE);
+}
+
+static void decrypt_rounds(unsigned char *block,
+                           const unsigned char *round_keys) {
+  // Initial AddRoundKey (with the last round key)
+  add_round_key(block, round_keys + NUM_ROUNDS * BLOCK_SIZE);
+
+  // 9 main rounds
+  for (int round = NUM_ROUNDS - 1; round > 0; round--) {
+    invert_shift_rows(block);
+    invert_sub_bytes(block);
+    add_round_key(block, round_keys + round * BLOCK_SIZE);
+    invert_mix_columns(block);
   }
 
-  // Expand the key
-  unsigned char *expanded_key = expand_key(key);
+  // Final round (no inverse MixColumns)
+  invert_shift_rows(block);
+  invert_sub_bytes(block);
+  add_round_key(block, round_keys);
+}
 
-  // Initial round key addition
-  add_round_key(output, expanded_key);
+/*
+ * T-table engine. Each 32-bit table entry holds one S-box output already
+ * multiplied by a MixColumns column, so SubBytes, ShiftRows and MixColumns
+ * collapse into four lookups and XORs per column. Words are packed with row
+ * 0 in the most significant byte. Decryption uses the equivalent inverse
+ * cipher, whose round keys (dec_round_keys) have InvMixColumns pre-applied.
+ */
+static uint32_t Te0[256], Te1[256], Te2[256], Te3[256];
+static uint32_t Td0[256], Td1[256], Td2[256], Td3[256];
+
+#define ROR8(w) (((w) >> 8) | ((w) << 24))
+#define GETU32(p)                                                     \
+  (((uint32_t)(p)[0] << 24) | ((uint32_t)(p)[1] << 16) |              \
+   ((uint32_t)(p)[2] << 8) | (uint32_t)(p)[3])
+#define PUTU32(p, w)                \
+  do {                              \
+    (p)[0] = (unsigned char)((w) >> 24); \
+    (p)[1] = (unsigned char)((w) >> 16); \
+    (p)[2] = (unsigned char)((w) >> 8);  \
+    (p)[3] = (unsigned char)(w);         \
+  } while (0)
+#define GETU64(p) (((uint64_t)GETU32(p) << 32) | GETU32((p) + 4))
+#define PUTU64(p, v)                      \
+  do {                                    \
+    PUTU32((p), (uint32_t)((v) >> 32));   \
+    PUTU32((p) + 4, (uint32_t)(v));       \
+  } while (0)
+
+// The tables are derived from S_BOX/INV_S_BOX once, when the library loads
+__attribute__((constructor)) static void init_ttables(void) {
+  for (int i = 0; i < 256; i++) {
+    unsigned char s = S_BOX[i];
+    unsigned char v = INV_S_BOX[i];
+    uint32_t te = ((uint32_t)xtime(s) << 24) | ((uint32_t)s << 16) |
+                  ((uint32_t)s << 8) | (uint32_t)(xtime(s) ^ s);
+    uint32_t td = ((uint32_t)gmul(v, 0x0E) << 24) |
+                  ((uint32_t)gmul(v, 0x09) << 16) |
+                  ((uint32_t)gmul(v, 0x0D) << 8) | (uint32_t)gmul(v, 0x0B);
+
+    Te0[i] = te;
+    Te1[i] = ROR8(te);
+    Te2[i] = ROR8(Te1[i]);
+    Te3[i] = ROR8(Te2[i]);
+    Td0[i] = td;
+    Td1[i] = ROR8(td);
+    Td2[i] = ROR8(Td1[i]);
+    Td3[i] = ROR8(Td2[i]);
+  }
+}
+
+static void ttable_encrypt(const aes_context *ctx, unsigned char *block) {
+  const unsigned char *rk = ctx->round_keys;
+  uint32_t s0 = GETU32(block) ^ GETU32(rk);
+  uint32_t s1 = GETU32(block + 4) ^ GETU32(rk + 4);
+  uint32_t s2 = GETU32(block + 8) ^ GETU32(rk + 8);
+  uint32_t s3 = GETU32(block + 12) ^ GETU32(rk + 12);
+  uint32_t t0, t1, t2, t3;
 
-  // 9 main rounds
   for (int round = 1; round < NUM_ROUNDS; round++) {
-    sub_bytes(output);
-    shift_rows(output);
-    mix_columns(output);
-    add_round_key(output, expanded_key + round * BLOCK_SIZE);
+    rk += BLOCK_SIZE;
+    t0 = Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xFF] ^ Te2[(s2 >> 8) & 0xFF] ^
+         Te3[s3 & 0xFF] ^ GETU32(rk);
+    t1 = Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xFF] ^ Te2[(s3 >> 8) & 0xFF] ^
+         Te3[s0 & 0xFF] ^ GETU32(rk + 4);
+    t2 = Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xFF] ^ Te2[(s0 >> 8) & 0xFF] ^
+         Te3[s1 & 0xFF] ^ GETU32(rk + 8);
+    t3 = Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xFF] ^ Te2[(s1 >> 8) & 0xFF] ^
+         Te3[s2 & 0xFF] ^ GETU32(rk + 12);
+    s0 = t0;
+    s1 = t1;
+    s2 = t2;
+    s3 = t3;
   }
 
-  // Final round (no mix_columns)
-  sub_bytes(output);
-  shift_rows(output);
-  add_round_key(output, expanded_key + NUM_ROUNDS * BLOCK_SIZE);
+  // Final round (SubBytes + ShiftRows only)
+  rk += BLOCK_SIZE;
+  t0 = ((uint32_t)S_BOX[s0 >> 24] << 24) |
+       ((uint32_t)S_BOX[(s1 >> 16) & 0xFF] << 16) |
+       ((uint32_t)S_BOX[(s2 >> 8) & 0xFF] << 8) | S_BOX[s3 & 0xFF];
+  t1 = ((uint32_t)S_BOX[s1 >> 24] << 24) |
+       ((uint32_t)S_BOX[(s2 >> 16) & 0xFF] << 16) |
+       ((uint32_t)S_BOX[(s3 >> 8) & 0xFF] << 8) | S_BOX[s0 & 0xFF];
+  t2 = ((uint32_t)S_BOX[s2 >> 24] << 24) |
+       ((uint32_t)S_BOX[(s3 >> 16) & 0xFF] << 16) |
+       ((uint32_t)S_BOX[(s0 >> 8) & 0xFF] << 8) | S_BOX[s1 & 0xFF];
+  t3 = ((uint32_t)S_BOX[s3 >> 24] << 24) |
+       ((uint32_t)S_BOX[(s0 >> 16) & 0xFF] << 16) |
+       ((uint32_t)S_BOX[(s1 >> 8) & 0xFF] << 8) | S_BOX[s2 & 0xFF];
+  PUTU32(block, t0 ^ GETU32(rk));
+  PUTU32(block + 4, t1 ^ GETU32(rk + 4));
+  PUTU32(block + 8, t2 ^ GETU32(rk + 8));
+  PUTU32(block + 12, t3 ^ GETU32(rk + 12));
+}
 
-  // Copy result back to plaintext to satisfy test's in-place expectation
-  memcpy(plaintext, output, BLOCK_SIZE);
+static void ttable_decrypt(const aes_context *ctx, unsigned char *block) {
+  const unsigned char *rk = ctx->dec_round_keys;
+  uint32_t s0 = GETU32(block) ^ GETU32(rk);
+  uint32_t s1 = GETU32(block + 4) ^ GETU32(rk + 4);
+  uint32_t s2 = GETU32(block + 8) ^ GETU32(rk + 8);
+  uint32_t s3 = GETU32(block + 12) ^ GETU32(rk + 12);
+  uint32_t t0, t1, t2, t3;
 
-  // Free the allocated memory
-  free(output);
+  for (int round = 1; round < NUM_ROUNDS; round++) {
+    rk += BLOCK_SIZE;
+    t0 = Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xFF] ^ Td2[(s2 >> 8) & 0xFF] ^
+         Td3[s1 & 0xFF] ^ GETU32(rk);
+    t1 = Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xFF] ^ Td2[(s3 >> 8) & 0xFF] ^
+         Td3[s2 & 0xFF] ^ GETU32(rk + 4);
+    t2 = Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xFF] ^ Td2[(s0 >> 8) & 0xFF] ^
+         Td3[s3 & 0xFF] ^ GETU32(rk + 8);
+    t3 = Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xFF] ^ Td2[(s1 >> 8) & 0xFF] ^
+         Td3[s0 & 0xFF] ^ GETU32(rk + 12);
+    s0 = t0;
+    s1 = t1;
+    s2 = t2;
+    s3 = t3;
+  }
 
-  // Return plaintext (test expects block to be modified in place)
-  return plaintext;
+  // Final round (InvShiftRows + InvSubBytes only)
+  rk += BLOCK_SIZE;
+  t0 = ((uint32_t)INV_S_BOX[s0 >> 24] << 24) |
+       ((uint32_t)INV_S_BOX[(s3 >> 16) & 0xFF] << 16) |
+       ((uint32_t)INV_S_BOX[(s2 >> 8) & 0xFF] << 8) | INV_S_BOX[s1 & 0xFF];
+  t1 = ((uint32_t)INV_S_BOX[s1 >> 24] << 24) |
+       ((uint32_t)INV_S_BOX[(s0 >> 16) & 0xFF] << 16) |
+       ((uint32_t)INV_S_BOX[(s3 >> 8) & 0xFF] << 8) | INV_S_BOX[s2 & 0xFF];
+  t2 = ((uint32_t)INV_S_BOX[s2 >> 24] << 24) |
+       ((uint32_t)INV_S_BOX[(s1 >> 16) & 0xFF] << 16) |
+       ((uint32_t)INV_S_BOX[(s0 >> 8) & 0xFF] << 8) | INV_S_BOX[s3 & 0xFF];
+  t3 = ((uint32_t)INV_S_BOX[s3 >> 24] << 24) |
+       ((uint32_t)INV_S_BOX[(s2 >> 16) & 0xFF] << 16) |
+       ((uint32_t)INV_S_BOX[(s1 >> 8) & 0xFF] << 8) | INV_S_BOX[s0 & 0xFF];
+  PUTU32(block, t0 ^ GETU32(rk));
+  PUTU32(block + 4, t1 ^ GETU32(rk + 4));
+  PUTU32(block + 8, t2 ^ GETU32(rk + 8));
+  PUTU32(block + 12, t3 ^ GETU32(rk + 12));
 }
 
-unsigned char *aes_decrypt_block(unsigned char *ciphertext,
-                                 unsigned char *key) {
-  // TODO: Implement me!
-  unsigned char *output =
-      (unsigned char *)malloc(sizeof(unsigned char) * BLOCK_SIZE);
-  unsigned char state[BLOCK_SIZE];
-  if (output == NULL) {
-    return NULL;  // Handle allocation failure
+static void bytewise_encrypt(const aes_context *ctx, unsigned char *block) {
+  encrypt_rounds(block, ctx->round_keys);
+}
+
+static void bytewise_decrypt(const aes_context *ctx, unsigned char *block) {
+  decrypt_rounds(block, ctx->round_keys);
+}
+
+/*
+ * Bitsliced engine (constant time). Blocks are processed in groups of four:
+ * the state is eight 64-bit words, word i holding bit i of every byte, with
+ * bit 16 * b + p of the word standing for byte p of block b. SubBytes is
+ * then a boolean circuit (Boyar-Peralta, 113 gates) applied to all 64
+ * bytes at once, ShiftRows and MixColumns are shifts and masks within each
+ * 16-bit lane, and no table is ever indexed by key or data. The bulk hooks
+ * run BITSLICE_BLOCKS blocks (two groups) per pass. Decryption uses the
+ * straight inverse cipher with the encryption schedule; the inverse S-box
+ * reuses the forward circuit between two inverse affine maps.
+ */
+#define BITSLICE_BLOCKS 8
+
+// Transpose an 8x8 bit matrix held one row per byte (bit 8r + c <-> 8c + r)
+static uint64_t transpose8x8(uint64_t x) {
+  uint64_t t;
+
+  t = (x ^ (x >> 7)) & 0x00AA00AA00AA00AAULL;
+  x ^= t ^ (t << 7);
+  t = (x ^ (x >> 14)) & 0x0000CCCC0000CCCCULL;
+  x ^= t ^ (t << 14);
+  t = (x ^ (x >> 28)) & 0x00000000F0F0F0F0ULL;
+  x ^= t ^ (t << 28);
+  return x;
+}
+
+static uint64_t load_bytes_le64(const unsigned char *p) {
+  uint64_t v = 0;
+
+  for (int i = 7; i >= 0; i--) {
+    v = (v << 8) | p[i];
   }
+  return v;
+}
 
-  // Initialize output with the input block
-  for (int i = 0; i < BLOCK_SIZE; i++) {
-    output[i] = ciphertext[i];
+static void store_bytes_le64(unsigned char *p, uint64_t v) {
+  for (int i = 0; i < 8; i++) {
+    p[i] = (unsigned char)(v >> (8 * i));
+  }
+}
+
+// Slice n <= 4 consecutive blocks into q[0..7]; missing blocks are zero
+static void bitslice_load(uint64_t *q, const unsigned char *in, size_t n) {
+  for (int i = 0; i < 8; i++) {
+    q[i] = 0;
   }
+  for (size_t b = 0; b < n; b++) {
+    // Row i of lo/hi: bit i of bytes 0-7 / 8-15 of the block
+    uint64_t lo = transpose8x8(load_bytes_le64(in + b * BLOCK_SIZE));
+    uint64_t hi = transpose8x8(load_bytes_le64(in + b * BLOCK_SIZE + 8));
 
-  // Expand the key
-  unsigned char *expanded_key = expand_key(key);
+    for (int i = 0; i < 8; i++) {
+      uint64_t lane = ((lo >> (8 * i)) & 0xFF) | (((hi >> (8 * i)) & 0xFF) << 8);
+      q[i] |= lane << (16 * b);
+    }
+  }
+}
 
-  // Initial AddRoundKey (with the last round key)
-  add_round_key(output, expanded_key + NUM_ROUNDS * BLOCK_SIZE);
+static void bitslice_store(unsigned char *out, const uint64_t *q, size_t n) {
+  for (size_t b = 0; b < n; b++) {
+    uint64_t lo = 0, hi = 0;
 
-  // 9 main rounds
-  for (int round = NUM_ROUNDS - 1; round > 0; round--) {
-    invert_shift_rows(output);
-    invert_sub_bytes(output);
-    add_round_key(output, expanded_key + round * BLOCK_SIZE);
-    invert_mix_columns(output);
+    for (int i = 0; i < 8; i++) {
+      uint64_t lane = q[i] >> (16 * b);
+      lo |= (lane & 0xFF) << (8 * i);
+      hi |= ((lane >> 8) & 0xFF) << (8 * i);
+    }
+    store_bytes_le64(out + b * BLOCK_SIZE, transpose8x8(lo));
+    store_bytes_le64(out + b * BLOCK_SIZE + 8, transpose8x8(hi));
   }
+}
 
-  // Final round (no inverse MixColumns)
-  invert_shift_rows(output);
-  invert_sub_bytes(output);
-  add_round_key(output, expanded_key);
+// All 11 round keys, each sliced into lane 0 and copied to the other three
+static void bitslice_key_schedule(uint64_t sk[NUM_ROUNDS + 1][8],
+                                  const unsigned char *round_keys) {
+  for (int round = 0; round <= NUM_ROUNDS; round++) {
+    bitslice_load(sk[round], round_keys + round * BLOCK_SIZE, 1);
+    for (int i = 0; i < 8; i++) {
+      sk[round][i] *= 0x0001000100010001ULL;
+    }
+  }
+}
 
-  // Copy result back to ciphertext to satisfy test's in-place expectation
-  memcpy(ciphertext, output, BLOCK_SIZE);
+static void bitslice_sbox(uint64_t *q) {
+  uint64_t x0, x1, x2, x3, x4, x5, x6, x7;
+  uint64_t y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11;
+  uint64_t y12, y13, y14, y15, y16, y17, y18, y19, y20, y21;
+  uint64_t z0, z1, z2, z3, z4, z5, z6, z7, z8, z9;
+  uint64_t z10, z11, z12, z13, z14, z15, z16, z17;
+  uint64_t t0, t1, t2, t3, t4, t5, t6, t7, t8, t9;
+  uint64_t t10, t11, t12, t13, t14, t15, t16, t17, t18, t19;
+  uint64_t t20, t21, t22, t23, t24, t25, t26, t27, t28, t29;
+  uint64_t t30, t31, t32, t33, t34, t35, t36, t37, t38, t39;
+  uint64_t t40, t41, t42, t43, t44, t45, t46, t47, t48, t49;
+  uint64_t t50, t51, t52, t53, t54, t55, t56, t57, t58, t59;
+  uint64_t t60, t61, t62, t63, t64, t65, t66, t67;
+  uint64_t s0, s1, s2, s3, s4, s5, s6, s7;
 
-  // Free the allocated memory
-  free(output);
+  // x0 is the most significant bit
+  x0 = q[7];
+  x1 = q[6];
+  x2 = q[5];
+  x3 = q[4];
+  x4 = q[3];
+  x5 = q[2];
+  x6 = q[1];
+  x7 = q[0];
 
-  // Return ciphertext (test expects block to be modified in place)
-  return ciphertext;
+  // Top linear transformation
+  y14 = x3 ^ x5;
+  y13 = x0 ^ x6;
+  y9 = x0 ^ x3;
+  y8 = x0 ^ x5;
+  t0 = x1 ^ x2;
+  y1 = t0 ^ x7;
+  y4 = y1 ^ x3;
+  y12 = y13 ^ y14;
+  y2 = y1 ^ x0;
+  y5 = y1 ^ x6;
+  y3 = y5 ^ y8;
+  t1 = x4 ^ y12;
+  y15 = t1 ^ x5;
+  y20 = t1 ^ x1;
+  y6 = y15 ^ x7;
+  y10 = y15 ^ t0;
+  y11 = y20 ^ y9;
+  y7 = x7 ^ y11;
+  y17 = y10 ^ y11;
+  y19 = y10 ^ y8;
+  y16 = t0 ^ y11;
+  y21 = y13 ^ y16;
+  y18 = x0 ^ y16;
+
+  // Non-linear section (inversion in GF(2^8) via GF(2^4))
+  t2 = y12 & y15;
+  t3 = y3 & y6;
+  t4 = t3 ^ t2;
+  t5 = y4 & x7;
+  t6 = t5 ^ t2;
+  t7 = y13 & y16;
+  t8 = y5 & y1;
+  t9 = t8 ^ t7;
+  t10 = y2 & y7;
+  t11 = t10 ^ t7;
+  t12 = y9 & y11;
+  t13 = y14 & y17;
+  t14 = t13 ^ t12;
+  t15 = y8 & y10;
+  t16 = t15 ^ t12;
+  t17 = t4 ^ t14;
+  t18 = t6 ^ t16;
+  t19 = t9 ^ t14;
+  t20 = t11 ^ t16;
+  t21 = t17 ^ y20;
+  t22 = t18 ^ y19;
+  t23 = t19 ^ y21;
+  t24 = t20 ^ y18;
+
+  t25 = t21 ^ t22;
+  t26 = t21 & t23;
+  t27 = t24 ^ t26;
+  t28 = t25 & t27;
+  t29 = t28 ^ t22;
+  t30 = t23 ^ t24;
+  t31 = t22 ^ t26;
+  t32 = t31 & t30;
+  t33 = t32 ^ t24;
+  t34 = t23 ^ t33;
+  t35 = t27 ^ t33;
+  t36 = t24 & t35;
+  t37 = t36 ^ t34;
+  t38 = t27 ^ t36;
+  t39 = t29 & t38;
+  t40 = t25 ^ t39;
+
+  t41 = t40 ^ t37;
+  t42 = t29 ^ t33;
+  t43 = t29 ^ t40;
+  t44 = t33 ^ t37;
+  t45 = t42 ^ t41;
+  z0 = t44 & y15;
+  z1 = t37 & y6;
+  z2 = t33 & x7;
+  z3 = t43 & y16;
+  z4 = t40 & y1;
+  z5 = t29 & y7;
+  z6 = t42 & y11;
+  z7 = t45 & y17;
+  z8 = t41 & y10;
+  z9 = t44 & y12;
+  z10 = t37 & y3;
+  z11 = t33 & y4;
+  z12 = t43 & y13;
+  z13 = t40 & y5;
+  z14 = t29 & y2;
+  z15 = t42 & y9;
+  z16 = t45 & y14;
+  z17 = t41 & y8;
+
+  // Bottom linear transformation (including the affine constant 0x63)
+  t46 = z15 ^ z16;
+  t47 = z10 ^ z11;
+  t48 = z5 ^ z13;
+  t49 = z9 ^ z10;
+  t50 = z2 ^ z12;
+  t51 = z2 ^ z5;
+  t52 = z7 ^ z8;
+  t53 = z0 ^ z3;
+  t54 = z6 ^ z7;
+  t55 = z16 ^ z17;
+  t56 = z12 ^ t48;
+  t57 = t50 ^ t53;
+  t58 = z4 ^ t46;
+  t59 = z3 ^ t54;
+  t60 = t46 ^ t57;
+  t61 = z14 ^ t57;
+  t62 = t52 ^ t58;
+  t63 = t49 ^ t58;
+  t64 = z4 ^ t59;
+  t65 = t61 ^ t62;
+  t66 = z1 ^ t63;
+  s0 = t59 ^ t63;
+  s6 = t56 ^ ~t62;
+  s7 = t48 ^ ~t60;
+  t67 = t64 ^ t65;
+  s3 = t53 ^ t66;
+  s4 = t51 ^ t66;
+  s5 = t47 ^ t65;
+  s1 = t64 ^ ~s3;
+  s2 = t55 ^ ~t67;
+
+  q[7] = s0;
+  q[6] = s1;
+  q[5] = s2;
+  q[4] = s3;
+  q[3] = s4;
+  q[2] = s5;
+  q[1] = s6;
+  q[0] = s7;
+}
+
+/*
+ * Inverse of the S-box affine step: B(x ^ 0x63). Since S(x) = A(x^-1) ^ 0x63,
+ * InvS(y) = B(S(B(y ^ 0x63)) ^ 0x63): the forward circuit between two Bs.
+ */
+static void bitslice_inv_affine(uint64_t *q) {
+  uint64_t q0 = ~q[0], q1 = ~q[1], q2 = q[2], q3 = q[3];
+  uint64_t q4 = q[4], q5 = ~q[5], q6 = ~q[6], q7 = q[7];
+
+  q[7] = q1 ^ q4 ^ q6;
+  q[6] = q0 ^ q3 ^ q5;
+  q[5] = q7 ^ q2 ^ q4;
+  q[4] = q6 ^ q1 ^ q3;
+  q[3] = q5 ^ q0 ^ q2;
+  q[2] = q4 ^ q7 ^ q1;
+  q[1] = q3 ^ q6 ^ q0;
+  q[0] = q2 ^ q5 ^ q7;
+}
+
+static void bitslice_inv_sbox(uint64_t *q) {
+  bitslice_inv_affine(q);
+  bitslice_sbox(q);
+  bitslice_inv_affine(q);
+}
+
+// Rows of a block: bit p = 4 * column + row, so row r is every 4th bit
+#define BS_ROW(r) (0x1111111111111111ULL << (r))
+#define BS_LANES(m) ((uint64_t)(m) * 0x0001000100010001ULL)
+
+// Rotate each 16-bit lane right by s (0 < s < 16), keeping only mask bits
+#define BS_ROTR16(x, s, mask)                                  \
+  ((((x) >> (s)) & BS_LANES(0xFFFFu >> (s)) & (mask)) |        \
+   (((x) << (16 - (s))) & BS_LANES((0xFFFFu << (16 - (s))) & 0xFFFFu) & (mask)))
+
+// ShiftRows: row r of column c comes from column c + r
+static void bitslice_shift_rows(uint64_t *q) {
+  for (int i = 0; i < 8; i++) {
+    uint64_t x = q[i];
+    q[i] = (x & BS_ROW(0)) | BS_ROTR16(x, 4, BS_ROW(1)) |
+           BS_ROTR16(x, 8, BS_ROW(2)) | BS_ROTR16(x, 12, BS_ROW(3));
+  }
+}
+
+static void bitslice_inv_shift_rows(uint64_t *q) {
+  for (int i = 0; i < 8; i++) {
+    uint64_t x = q[i];
+    q[i] = (x & BS_ROW(0)) | BS_ROTR16(x, 12, BS_ROW(1)) |
+           BS_ROTR16(x, 8, BS_ROW(2)) | BS_ROTR16(x, 4, BS_ROW(3));
+  }
+}
+
+// Within each column (4-bit group), row r takes row r + 1 / r + 2
+static uint64_t bs_next_row(uint64_t x) {
+  return ((x >> 1) & 0x7777777777777777ULL) |
+         ((x << 3) & 0x8888888888888888ULL);
+}
+
+static uint64_t bs_row_plus2(uint64_t x) {
+  return ((x >> 2) & 0x3333333333333333ULL) |
+         ((x << 2) & 0xCCCCCCCCCCCCCCCCULL);
+}
+
+// Multiply every byte by x in GF(2^8): a shift across the bit planes
+static void bitslice_xtime(uint64_t *out, const uint64_t *u) {
+  uint64_t hi = u[7];
+
+  out[7] = u[6];
+  out[6] = u[5];
+  out[5] = u[4];
+  out[4] = u[3] ^ hi;
+  out[3] = u[2] ^ hi;
+  out[2] = u[1];
+  out[1] = u[0] ^ hi;
+  out[0] = hi;
+}
+
+// out_r = 2 a_r ^ 3 a_{r+1} ^ a_{r+2} ^ a_{r+3} = 2 t ^ a_{r+1} ^ t_{r+2},
+// with t_r = a_r ^ a_{r+1}
+static void bitslice_mix_columns(uint64_t *q) {
+  uint64_t next[8], t[8], t2[8];
+
+  for (int i = 0; i < 8; i++) {
+    next[i] = bs_next_row(q[i]);
+    t[i] = q[i] ^ next[i];
+  }
+  bitslice_xtime(t2, t);
+  for (int i = 0; i < 8; i++) {
+    q[i] = t2[i] ^ next[i] ^ bs_row_plus2(t[i]);
+  }
+}
+
+// InvMixColumns = MixColumns after a_r ^= 4 (a_r ^ a_{r+2})
+static void bitslice_inv_mix_columns(uint64_t *q) {
+  uint64_t u[8], u2[8], u4[8];
+
+  for (int i = 0; i < 8; i++) {
+    u[i] = q[i] ^ bs_row_plus2(q[i]);
+  }
+  bitslice_xtime(u2, u);
+  bitslice_xtime(u4, u2);
+  for (int i = 0; i < 8; i++) {
+    q[i] ^= u4[i];
+  }
+  bitslice_mix_columns(q);
+}
+
+static void bitslice_add_round_key(uint64_t *q, const uint64_t *sk) {
+  for (int i = 0; i < 8; i++) {
+    q[i] ^= sk[i];
+  }
+}
+
+// One or two groups of four blocks, interleaved round by round
+static void bitslice_encrypt_groups(uint64_t q[2][8], int groups,
+                                    uint64_t sk[NUM_ROUNDS + 1][8]) {
+  for (int g = 0; g < groups; g++) {
+    bitslice_add_round_key(q[g], sk[0]);
+  }
+  for (int round = 1; round <= NUM_ROUNDS; round++) {
+    for (int g = 0; g < groups; g++) {
+      bitslice_sbox(q[g]);
+      bitslice_shift_rows(q[g]);
+      if (round < NUM_ROUNDS) {
+        bitslice_mix_columns(q[g]);
+      }
+      bitslice_add_round_key(q[g], sk[round]);
+    }
+  }
+}
+
+static void bitslice_decrypt_groups(uint64_t q[2][8], int groups,
+                                    uint64_t sk[NUM_ROUNDS + 1][8]) {
+  for (int g = 0; g < groups; g++) {
+    bitslice_add_round_key(q[g], sk[NUM_ROUNDS]);
+  }
+  for (int round = NUM_ROUNDS - 1; round >= 0; round--) {
+    for (int g = 0; g < groups; g++) {
+      bitslice_inv_shift_rows(q[g]);
+      bitslice_inv_sbox(q[g]);
+      bitslice_add_round_key(q[g], sk[round]);
+      if (round > 0) {
+        bitslice_inv_mix_columns(q[g]);
+      }
+    }
+  }
+}
+
+// Up to BITSLICE_BLOCKS blocks from in to out (which may be the same)
+static void bitslice_batch(uint64_t sk[NUM_ROUNDS + 1][8],
+                           const unsigned char *in, unsigned char *out,
+                           size_t n, int encrypt) {
+  uint64_t q[2][8];
+  size_t n0 = n < 4 ? n : 4;
+  size_t n1 = n - n0;
+  // The work depends only on the block count, never on the data
+  int groups = n1 > 0 ? 2 : 1;
+
+  bitslice_load(q[0], in, n0);
+  bitslice_load(q[1], in + 4 * BLOCK_SIZE, n1);
+  if (encrypt) {
+    bitslice_encrypt_groups(q, groups, sk);
+  } else {
+    bitslice_decrypt_groups(q, groups, sk);
+  }
+  bitslice_store(out, q[0], n0);
+  bitslice_store(out + 4 * BLOCK_SIZE, q[1], n1);
+  secure_zero(q, sizeof(q));
+}
+
+static void bitslice_blocks(const aes_context *ctx, unsigned char *buf,
+                            size_t num_blocks, int encrypt) {
+  uint64_t sk[NUM_ROUNDS + 1][8];
+
+  bitslice_key_schedule(sk, ctx->round_keys);
+  while (num_blocks > 0) {
+    size_t n = num_blocks < BITSLICE_BLOCKS ? num_blocks : BITSLICE_BLOCKS;
+
+    bitslice_batch(sk, buf, buf, n, encrypt);
+    buf += n * BLOCK_SIZE;
+    num_blocks -= n;
+  }
+  secure_zero(sk, sizeof(sk));
+}
+
+static void bitslice_encrypt(const aes_context *ctx, unsigned char *block) {
+  bitslice_blocks(ctx, block, 1, 1);
+}
+
+static void bitslice_decrypt(const aes_context *ctx, unsigned char *block) {
+  bitslice_blocks(ctx, block, 1, 0);
+}
+
+static void bitslice_encrypt_blocks(const aes_context *ctx, unsigned char *buf,
+                                    size_t num_blocks) {
+  bitslice_blocks(ctx, buf, num_blocks, 1);
+}
+
+static void bitslice_decrypt_blocks(const aes_context *ctx, unsigned char *buf,
+                                    size_t num_blocks) {
+  bitslice_blocks(ctx, buf, num_blocks, 0);
+}
+
+static void bitslice_ctr_blocks(const aes_context *ctx, unsigned char *counter,
+                                unsigned char *buf, size_t num_blocks) {
+  uint64_t sk[NUM_ROUNDS + 1][8];
+  unsigned char keystream[BITSLICE_BLOCKS * BLOCK_SIZE];
+  uint64_t hi = GETU64(counter), lo = GETU64(counter + 8);
+
+  bitslice_key_schedule(sk, ctx->round_keys);
+  while (num_blocks > 0) {
+    size_t n = num_blocks < BITSLICE_BLOCKS ? num_blocks : BITSLICE_BLOCKS;
+
+    for (size_t i = 0; i < n; i++) {
+      PUTU64(keystream + i * BLOCK_SIZE, hi);
+      PUTU64(keystream + i * BLOCK_SIZE + 8, lo);
+      hi += (++lo == 0);
+    }
+    bitslice_batch(sk, keystream, keystream, n, 1);
+    for (size_t i = 0; i < n * BLOCK_SIZE; i++) {
+      buf[i] ^= keystream[i];
+    }
+    buf += n * BLOCK_SIZE;
+    num_blocks -= n;
+  }
+
+  PUTU64(counter, hi);
+  PUTU64(counter + 8, lo);
+  secure_zero(keystream, sizeof(keystream));
+  secure_zero(sk, sizeof(sk));
+}
+
+/*
+ * AES-NI engine (x86 only). The functions are compiled for the aes target
+ * individually, so the rest of the file still builds for a baseline CPU;
+ * they are only ever called after CPUID has confirmed the instructions
+ * exist. Independent blocks (ECB, CTR) are pushed through the pipeline
+ * AESNI_LANES at a time so the aesenc latency is hidden.
+ */
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define RIJNDAEL_HAVE_AESNI 1
+
+#include <cpuid.h>
+#include <emmintrin.h>
+#include <wmmintrin.h>
+
+#define AESNI_TARGET __attribute__((target("aes,sse2")))
+#define AESNI_LANES 8
+
+static int cpu_has_aesni(void) {
+  unsigned int eax, ebx, ecx, edx;
+
+  if (!__get_cpuid(1, &eax, &ebx, &ecx, &edx)) {
+    return 0;
+  }
+  return (ecx & bit_AES) != 0;
+}
+
+AESNI_TARGET static void aesni_load_keys(const unsigned char *round_keys,
+                                         __m128i *k) {
+  for (int i = 0; i <= NUM_ROUNDS; i++) {
+    k[i] = _mm_loadu_si128((const __m128i *)(round_keys + i * BLOCK_SIZE));
+  }
+}
+
+AESNI_TARGET static void aesni_encrypt(const aes_context *ctx,
+                                       unsigned char *block) {
+  __m128i k[NUM_ROUNDS + 1];
+  aesni_load_keys(ctx->round_keys, k);
+
+  __m128i b = _mm_xor_si128(_mm_loadu_si128((__m128i *)block), k[0]);
+  for (int round = 1; round < NUM_ROUNDS; round++) {
+    b = _mm_aesenc_si128(b, k[round]);
+  }
+  b = _mm_aesenclast_si128(b, k[NUM_ROUNDS]);
+  _mm_storeu_si128((__m128i *)block, b);
+}
+
+AESNI_TARGET static void aesni_decrypt(const aes_context *ctx,
+                                       unsigned char *block) {
+  __m128i k[NUM_ROUNDS + 1];
+  aesni_load_keys(ctx->dec_round_keys, k);
+
+  __m128i b = _mm_xor_si128(_mm_loadu_si128((__m128i *)block), k[0]);
+  for (int round = 1; round < NUM_ROUNDS; round++) {
+    b = _mm_aesdec_si128(b, k[round]);
+  }
+  b = _mm_aesdeclast_si128(b, k[NUM_ROUNDS]);
+  _mm_storeu_si128((__m128i *)block, b);
+}
+
+AESNI_TARGET static void aesni_encrypt_blocks(const aes_context *ctx,
+                                              unsigned char *buf,
+                                              size_t num_blocks) {
+  __m128i k[NUM_ROUNDS + 1];
+  __m128i b[AESNI_LANES];
+  aesni_load_keys(ctx->round_keys, k);
+
+  while (num_blocks > 0) {
+    size_t lanes = num_blocks < AESNI_LANES ? num_blocks : AESNI_LANES;
+
+    for (size_t i = 0; i < lanes; i++) {
+      b[i] = _mm_xor_si128(
+          _mm_loadu_si128((__m128i *)(buf + i * BLOCK_SIZE)), k[0]);
+    }
+    for (int round = 1; round < NUM_ROUNDS; round++) {
+      for (size_t i = 0; i < lanes; i++) {
+        b[i] = _mm_aesenc_si128(b[i], k[round]);
+      }
+    }
+    for (size_t i = 0; i < lanes; i++) {
+      b[i] = _mm_aesenclast_si128(b[i], k[NUM_ROUNDS]);
+      _mm_storeu_si128((__m128i *)(buf + i * BLOCK_SIZE), b[i]);
+    }
+
+    buf += lanes * BLOCK_SIZE;
+    num_blocks -= lanes;
+  }
+}
+
+AESNI_TARGET static void aesni_decrypt_blocks(const aes_context *ctx,
+                                              unsigned char *buf,
+                                              size_t num_blocks) {
+  __m128i k[NUM_ROUNDS + 1];
+  __m128i b[AESNI_LANES];
+  aesni_load_keys(ctx->dec_round_keys, k);
+
+  while (num_blocks > 0) {
+    size_t lanes = num_blocks < AESNI_LANES ? num_blocks : AESNI_LANES;
+
+    for (size_t i = 0; i < lanes; i++) {
+      b[i] = _mm_xor_si128(
+          _mm_loadu_si128((__m128i *)(buf + i * BLOCK_SIZE)), k[0]);
+    }
+    for (int round = 1; round < NUM_ROUNDS; round++) {
+      for (size_t i = 0; i < lanes; i++) {
+        b[i] = _mm_aesdec_si128(b[i], k[round]);
+      }
+    }
+    for (size_t i = 0; i < lanes; i++) {
+      b[i] = _mm_aesdeclast_si128(b[i], k[NUM_ROUNDS]);
+      _mm_storeu_si128((__m128i *)(buf + i * BLOCK_SIZE), b[i]);
+    }
+
+    buf += lanes * BLOCK_SIZE;
+    num_blocks -= lanes;
+  }
+}
+
+// CTR over whole blocks; the 128-bit big-endian counter is kept as two words
+AESNI_TARGET static void aesni_ctr_blocks(const aes_context *ctx,
+                                          unsigned char *counter,
+                                          unsigned char *buf,
+                                          size_t num_blocks) {
+  __m128i k[NUM_ROUNDS + 1];
+  __m128i b[AESNI_LANES];
+  uint64_t hi = GETU64(counter);
+  uint64_t lo = GETU64(counter + 8);
+  aesni_load_keys(ctx->round_keys, k);
+
+  while (num_blocks > 0) {
+    size_t lanes = num_blocks < AESNI_LANES ? num_blocks : AESNI_LANES;
+
+    for (size_t i = 0; i < lanes; i++) {
+      // Byte-swapped so the block holds the counter in big-endian order
+      b[i] = _mm_xor_si128(_mm_set_epi64x((long long)__builtin_bswap64(lo),
+                                          (long long)__builtin_bswap64(hi)),
+                           k[0]);
+      if (++lo == 0) {
+        hi++;
+      }
+    }
+    for (int round = 1; round < NUM_ROUNDS; round++) {
+      for (size_t i = 0; i < lanes; i++) {
+        b[i] = _mm_aesenc_si128(b[i], k[round]);
+      }
+    }
+    for (size_t i = 0; i < lanes; i++) {
+      __m128i *p = (__m128i *)(buf + i * BLOCK_SIZE);
+      b[i] = _mm_aesenclast_si128(b[i], k[NUM_ROUNDS]);
+      _mm_storeu_si128(p, _mm_xor_si128(_mm_loadu_si128(p), b[i]));
+    }
+
+    buf += lanes * BLOCK_SIZE;
+    num_blocks -= lanes;
+  }
+
+  PUTU64(counter, hi);
+  PUTU64(counter + 8, lo);
+}
+
+// Multiply an XTS tweak (little-endian 128-bit integer) by x
+AESNI_TARGET static inline __m128i aesni_xts_double(__m128i t) {
+  // Masks from bit 127 (into dword 0) and bit 63 (into dword 2)
+  const __m128i poly = _mm_set_epi32(0, 1, 0, 0x87);
+  __m128i carries = _mm_srai_epi32(_mm_shuffle_epi32(t, 0x13), 31);
+  return _mm_xor_si128(_mm_add_epi64(t, t), _mm_and_si128(carries, poly));
+}
+
+// XTS over whole blocks; tweak holds the low and high 64-bit halves
+AESNI_TARGET static void aesni_xts_blocks(const aes_context *ctx,
+                                          uint64_t *tweak, unsigned char *buf,
+                                          size_t num_blocks, int encrypt) {
+  __m128i k[NUM_ROUNDS + 1];
+  __m128i b[AESNI_LANES];
+  __m128i tw[AESNI_LANES];
+  __m128i t = _mm_loadu_si128((const __m128i *)tweak);
+  aesni_load_keys(encrypt ? ctx->round_keys : ctx->dec_round_keys, k);
+
+  while (num_blocks > 0) {
+    size_t lanes = num_blocks < AESNI_LANES ? num_blocks : AESNI_LANES;
+
+    for (size_t i = 0; i < lanes; i++) {
+      tw[i] = t;
+      t = aesni_xts_double(t);
+      b[i] = _mm_xor_si128(
+          _mm_xor_si128(_mm_loadu_si128((__m128i *)(buf + i * BLOCK_SIZE)),
+                        tw[i]),
+          k[0]);
+    }
+    for (int round = 1; round < NUM_ROUNDS; round++) {
+      for (size_t i = 0; i < lanes; i++) {
+        b[i] = encrypt ? _mm_aesenc_si128(b[i], k[round])
+                       : _mm_aesdec_si128(b[i], k[round]);
+      }
+    }
+    for (size_t i = 0; i < lanes; i++) {
+      b[i] = encrypt ? _mm_aesenclast_si128(b[i], k[NUM_ROUNDS])
+                     : _mm_aesdeclast_si128(b[i], k[NUM_ROUNDS]);
+      _mm_storeu_si128((__m128i *)(buf + i * BLOCK_SIZE),
+                       _mm_xor_si128(b[i], tw[i]));
+    }
+
+    buf += lanes * BLOCK_SIZE;
+    num_blocks -= lanes;
+  }
+
+  _mm_storeu_si128((__m128i *)tweak, t);
+}
+#endif /* x86 AES-NI */
+
+/*
+ * Engine selection. Every engine produces identical output; they differ
+ * only in speed. The active engine is process-wide and should be chosen
+ * before any worker threads start using the library. The bulk hooks are
+ * optional: an engine without them is driven one block at a time.
+ */
+typedef struct {
+  const char *name;
+  void (*encrypt)(const aes_context *ctx, unsigned char *block);
+  void (*decrypt)(const aes_context *ctx, unsigned char *block);
+  void (*encrypt_blocks)(const aes_context *ctx, unsigned char *buf,
+                         size_t num_blocks);
+  void (*decrypt_blocks)(const aes_context *ctx, unsigned char *buf,
+                         size_t num_blocks);
+  void (*ctr_blocks)(const aes_context *ctx, unsigned char *counter,
+                     unsigned char *buf, size_t num_blocks);
+  void (*xts_blocks)(const aes_context *ctx, uint64_t *tweak,
+                     unsigned char *buf, size_t num_blocks, int encrypt);
+} aes_engine;
+
+static const aes_engine engines[AES_NUM_ENGINES] = {
+    [AES_ENGINE_BYTEWISE] = {"bytewise", bytewise_encrypt, bytewise_decrypt,
+                             NULL, NULL, NULL, NULL},
+    [AES_ENGINE_TTABLE] = {"ttable", ttable_encrypt, ttable_decrypt, NULL,
+                           NULL, NULL, NULL},
+    [AES_ENGINE_BITSLICE] = {"bitslice", bitslice_encrypt, bitslice_decrypt,
+                             bitslice_encrypt_blocks, bitslice_decrypt_blocks,
+                             bitslice_ctr_blocks, NULL},
+#ifdef RIJNDAEL_HAVE_AESNI
+    [AES_ENGINE_AESNI] = {"aesni", aesni_encrypt, aesni_decrypt,
+                          aesni_encrypt_blocks, aesni_decrypt_blocks,
+                          aesni_ctr_blocks, aesni_xts_blocks},
+#else
+    [AES_ENGINE_AESNI] = {"aesni", NULL, NULL, NULL, NULL, NULL, NULL},
+#endif
+};
+
+static const aes_engine *active_engine = &engines[AES_ENGINE_BYTEWISE];
+
+int aes_engine_available(int engine) {
+  if (engine < 0 || engine >= AES_NUM_ENGINES) {
+    return 0;
+  }
+#ifdef RIJNDAEL_HAVE_AESNI
+  if (engine == AES_ENGINE_AESNI) {
+    return cpu_has_aesni();
+  }
+#endif
+  return engines[engine].encrypt != NULL;
+}
+
+/*
+ * Without -DRIJNDAEL_DEFAULT_ENGINE the library picks AES-NI when the CPU
+ * has it and the portable byte-wise rounds otherwise. An explicit default
+ * that the CPU can't run also falls back to the byte-wise engine.
+ */
+__attribute__((constructor)) static void select_default_engine(void) {
+#ifdef RIJNDAEL_DEFAULT_ENGINE
+  int engine = RIJNDAEL_DEFAULT_ENGINE;
+#else
+  int engine = AES_ENGINE_AESNI;
+#endif
+
+  if (!aes_engine_available(engine)) {
+    engine = AES_ENGINE_BYTEWISE;
+  }
+  active_engine = &engines[engine];
+}
+
+int aes_set_engine(int engine) {
+  if (!aes_engine_available(engine)) {
+    return -1;
+  }
+  active_engine = &engines[engine];
+  return 0;
+}
+
+int aes_get_engine(void) { return (int)(active_engine - engines); }
+
+const char *aes_engine_name(int engine) {
+  if (engine < 0 || engine >= AES_NUM_ENGINES) {
+    return NULL;
+  }
+  return engines[engine].name;
+}
+
+/*
+ * Key-schedule context API. The key is expanded once when the context is
+ * initialised; afterwards the context is only read, so a single context can
+ * be shared between threads.
+ */
+void aes_context_init(aes_context *ctx, const unsigned char *key) {
+  PROFILE_BEGIN();
+
+  expand_key_into(key, ctx->round_keys);
+
+  // Equivalent inverse cipher schedule: reversed, with InvMixColumns applied
+  // to every round key except the first and last
+  for (int round = 0; round <= NUM_ROUNDS; round++) {
+    memcpy(ctx->dec_round_keys + round * BLOCK_SIZE,
+           ctx->round_keys + (NUM_ROUNDS - round) * BLOCK_SIZE, BLOCK_SIZE);
+    if (round > 0 && round < NUM_ROUNDS) {
+      inverse_mix_state(ctx->dec_round_keys + round * BLOCK_SIZE);
+    }
+  }
+  PROFILE_END(AES_PROFILE_KEY_EXPANSION, KEY_SIZE);
+}
+
+void aes_context_clear(aes_context *ctx) {
+  secure_zero(ctx, sizeof(*ctx));
+}
+
+aes_context *aes_context_new(const unsigned char *key) {
+  aes_context *ctx = (aes_context *)malloc(sizeof(aes_context));
+
+  PROFILE_COUNT(AES_PROFILE_ALLOC, sizeof(aes_context));
+  if (ctx == NULL) {
+    return NULL;  // Handle allocation failure
+  }
+
+  aes_context_init(ctx, key);
+  return ctx;
+}
+
+void aes_context_free(aes_context *ctx) {
+  if (ctx == NULL) {
+    return;
+  }
+
+  aes_context_clear(ctx);
+  free(ctx);
+  PROFILE_COUNT(AES_PROFILE_FREE, sizeof(*ctx));
+}
+
+void aes_context_encrypt_block(const aes_context *ctx, unsigned char *block) {
+  PROFILE_BEGIN();
+  active_engine->encrypt(ctx, block);
+  PROFILE_END(AES_PROFILE_ENCRYPT_BLOCK, BLOCK_SIZE);
+}
+
+void aes_context_decrypt_block(const aes_context *ctx, unsigned char *block) {
+  PROFILE_BEGIN();
+  active_engine->decrypt(ctx, block);
+  PROFILE_END(AES_PROFILE_DECRYPT_BLOCK, BLOCK_SIZE);
+}
+
+/*
+ * Allocation-free single-block API. The block is copied to out (unless it
+ * is already there) and transformed in place, so in and out may be the same
+ * buffer; memmove also copes with any other overlap. Nothing touches the
+ * heap, and the only key material outside the caller's buffers is the
+ * stack context of the one-shot variants, which is zeroed before return.
+ */
+void aes_context_encrypt_block_into(const aes_context *ctx,
+                                    const unsigned char *in,
+                                    unsigned char *out) {
+  if (out != in) {
+    memmove(out, in, BLOCK_SIZE);
+  }
+  aes_context_encrypt_block(ctx, out);
+}
+
+void aes_context_decrypt_block_into(const aes_context *ctx,
+                                    const unsigned char *in,
+                                    unsigned char *out) {
+  if (out != in) {
+    memmove(out, in, BLOCK_SIZE);
+  }
+  aes_context_decrypt_block(ctx, out);
+}
+
+void aes_encrypt_block_into(const unsigned char *plaintext,
+                            const unsigned char *key,
+                            unsigned char *ciphertext) {
+  aes_context ctx;
+
+  // Expand the key into a local context so concurrent callers don't collide.
+  // Only the encryption schedule is derived: every engine's encrypt path
+  // reads round_keys alone, so dec_round_keys is never written or zeroed.
+  PROFILE_BEGIN();
+  expand_key_into(key, ctx.round_keys);
+  PROFILE_END(AES_PROFILE_KEY_EXPANSION, KEY_SIZE);
+  aes_context_encrypt_block_into(&ctx, plaintext, ciphertext);
+  secure_zero(ctx.round_keys, sizeof(ctx.round_keys));
+}
+
+void aes_decrypt_block_into(const unsigned char *ciphertext,
+                            const unsigned char *key,
+                            unsigned char *plaintext) {
+  aes_context ctx;
+
+  aes_context_init(&ctx, key);
+  aes_context_decrypt_block_into(&ctx, ciphertext, plaintext);
+  aes_context_clear(&ctx);
+}
+
+/*
+ * The original entry points encrypt/decrypt the block in place and return
+ * the same pointer; they allocate nothing, so the result must not be freed.
+ */
+unsigned char *aes_encrypt_block(unsigned char *plaintext, unsigned char *key) {
+  aes_encrypt_block_into(plaintext, key, plaintext);
+  return plaintext;
+}
+
+unsigned char *aes_decrypt_block(unsigned char *ciphertext,
+                                 unsigned char *key) {
+  aes_decrypt_block_into(ciphertext, key, ciphertext);
+  return ciphertext;
+}
+
+/*
+ * Bulk modes. Each function processes a whole buffer in place under one
+ * context, so a caller going through an FFI pays the call overhead once per
+ * buffer rather than once per block.
+ */
+void aes_ecb_encrypt(const aes_context *ctx, unsigned char *buf,
+                     size_t num_blocks) {
+  PROFILE_BEGIN();
+  if (active_engine->encrypt_blocks != NULL) {
+    active_engine->encrypt_blocks(ctx, buf, num_blocks);
+  } else {
+    for (size_t i = 0; i < num_blocks; i++) {
+      aes_context_encrypt_block(ctx, buf + i * BLOCK_SIZE);
+    }
+  }
+  PROFILE_END(AES_PROFILE_ECB_ENCRYPT, num_blocks * BLOCK_SIZE);
+}
+
+void aes_ecb_decrypt(const aes_context *ctx, unsigned char *buf,
+                     size_t num_blocks) {
+  PROFILE_BEGIN();
+  if (active_engine->decrypt_blocks != NULL) {
+    active_engine->decrypt_blocks(ctx, buf, num_blocks);
+  } else {
+    for (size_t i = 0; i < num_blocks; i++) {
+      aes_context_decrypt_block(ctx, buf + i * BLOCK_SIZE);
+    }
+  }
+  PROFILE_END(AES_PROFILE_ECB_DECRYPT, num_blocks * BLOCK_SIZE);
+}
+
+// On return iv holds the last ciphertext block, ready for the next call
+void aes_cbc_encrypt(const aes_context *ctx, unsigned char *iv,
+                     unsigned char *buf, size_t num_blocks) {
+  const unsigned char *prev = iv;
+  PROFILE_BEGIN();
+
+  for (size_t i = 0; i < num_blocks; i++) {
+    unsigned char *block = buf + i * BLOCK_SIZE;
+    for (int j = 0; j < BLOCK_SIZE; j++) {
+      block[j] ^= prev[j];
+    }
+    aes_context_encrypt_block(ctx, block);
+    prev = block;
+  }
+
+  if (num_blocks > 0) {
+    memcpy(iv, prev, BLOCK_SIZE);
+  }
+  PROFILE_END(AES_PROFILE_CBC_ENCRYPT, num_blocks * BLOCK_SIZE);
+}
+
+/*
+ * Engines with a decrypt_blocks hook get the ciphertext in batches: a copy
+ * of each batch is kept for chaining, the batch is decrypted in one call and
+ * every block is XORed with the ciphertext block before it.
+ */
+#define CBC_BATCH_BLOCKS 64  // ciphertext kept on the stack per call (1 KiB)
+
+void aes_cbc_decrypt(const aes_context *ctx, unsigned char *iv,
+                     unsigned char *buf, size_t num_blocks) {
+  unsigned char saved[CBC_BATCH_BLOCKS * BLOCK_SIZE];
+  PROFILE_BEGIN();
+
+  if (active_engine->decrypt_blocks != NULL) {
+    for (size_t done = 0; done < num_blocks; done += CBC_BATCH_BLOCKS) {
+      size_t n = num_blocks - done;
+      unsigned char *batch = buf + done * BLOCK_SIZE;
+
+      if (n > CBC_BATCH_BLOCKS) {
+        n = CBC_BATCH_BLOCKS;
+      }
+      memcpy(saved, batch, n * BLOCK_SIZE);
+      active_engine->decrypt_blocks(ctx, batch, n);
+      for (int j = 0; j < BLOCK_SIZE; j++) {
+        batch[j] ^= iv[j];
+      }
+      for (size_t j = BLOCK_SIZE; j < n * BLOCK_SIZE; j++) {
+        batch[j] ^= saved[j - BLOCK_SIZE];
+      }
+      memcpy(iv, saved + (n - 1) * BLOCK_SIZE, BLOCK_SIZE);
+    }
+  } else {
+    for (size_t i = 0; i < num_blocks; i++) {
+      unsigned char *block = buf + i * BLOCK_SIZE;
+      // Keep the ciphertext, it is the chaining value for the next block
+      memcpy(saved, block, BLOCK_SIZE);
+      aes_context_decrypt_block(ctx, block);
+      for (int j = 0; j < BLOCK_SIZE; j++) {
+        block[j] ^= iv[j];
+      }
+      memcpy(iv, saved, BLOCK_SIZE);
+    }
+  }
+  PROFILE_END(AES_PROFILE_CBC_DECRYPT, num_blocks * BLOCK_SIZE);
+}
+
+// Increment a 128-bit big-endian counter block
+static void increment_counter(unsigned char *counter) {
+  for (int i = BLOCK_SIZE - 1; i >= 0; i--) {
+    if (++counter[i] != 0) {
+      break;
+    }
+  }
+}
+
+/*
+ * CTR mode works on any length; encryption and decryption are the same
+ * operation. The counter is advanced by one per block used, so a stream can
+ * be processed in several calls as long as every call but the last covers a
+ * whole number of blocks.
+ */
+void aes_ctr_crypt(const aes_context *ctx, unsigned char *counter,
+                   unsigned char *buf, size_t len) {
+  unsigned char keystream[BLOCK_SIZE];
+  const size_t total_len = len;
+  PROFILE_BEGIN();
+
+  // Whole blocks go through the engine's pipelined path when it has one
+  if (active_engine->ctr_blocks != NULL && len >= BLOCK_SIZE) {
+    size_t num_blocks = len / BLOCK_SIZE;
+    active_engine->ctr_blocks(ctx, counter, buf, num_blocks);
+    buf += num_blocks * BLOCK_SIZE;
+    len -= num_blocks * BLOCK_SIZE;
+  }
+
+  while (len > 0) {
+    size_t n = len < BLOCK_SIZE ? len : BLOCK_SIZE;
+
+    memcpy(keystream, counter, BLOCK_SIZE);
+    aes_context_encrypt_block(ctx, keystream);
+    for (size_t j = 0; j < n; j++) {
+      buf[j] ^= keystream[j];
+    }
+    increment_counter(counter);
+
+    buf += n;
+    len -= n;
+  }
+
+  secure_zero(keystream, sizeof(keystream));
+  PROFILE_END(AES_PROFILE_CTR, total_len);
+}
+
+/*
+ * AES-128-GCM. GHASH multiplies by the hash key H in GF(2^128) with the
+ * bit-reflected convention of SP 800-38D. The portable path uses Shoup's
+ * 4-bit method: a 16-entry table of multiples of H (256 bytes per key) and
+ * a 16-entry reduction table, consuming a nibble per step. With the AES-NI
+ * engine and a CPU with PCLMULQDQ, GHASH uses carry-less multiplication
+ * instead, folding eight blocks against H^8..H^1 before a single reduction,
+ * and runs fused with the CTR keystream in one pass.
+ *
+ * The counter is GCM's inc32: only the low 32 bits of the counter block
+ * advance, wrapping without carrying into the IV part.
+ */
+#define GCM_STRIPE_BLOCKS 64  // CTR/GHASH interleave granularity (1 KiB)
+#define GCM_MAX_LEN (((uint64_t)1 << 36) - 32)  // 2^32 - 2 blocks
+
+// Reduction constants for the four bits shifted out of a 4-bit step
+static const uint16_t gcm_last4[16] = {
+    0x0000, 0x1c20, 0x3840, 0x2460, 0x7080, 0x6ca0, 0x48c0, 0x54e0,
+    0xe100, 0xfd20, 0xd940, 0xc560, 0x9180, 0x8da0, 0xa9c0, 0xb5e0};
+
+static void gcm_build_table(aes_gcm_context *ctx) {
+  uint64_t vh = GETU64(ctx->h);
+  uint64_t vl = GETU64(ctx->h + 8);
+
+  // Entry 8 is H itself (the nibble 1000 is x^0 in reflected order);
+  // 4, 2 and 1 are H times x, x^2 and x^3
+  ctx->hh[0] = ctx->hl[0] = 0;
+  ctx->hh[8] = vh;
+  ctx->hl[8] = vl;
+  for (int i = 4; i > 0; i >>= 1) {
+    uint64_t reduce = (vl & 1) ? (uint64_t)0xe1000000 << 32 : 0;
+    vl = (vh << 63) | (vl >> 1);
+    vh = (vh >> 1) ^ reduce;
+    ctx->hh[i] = vh;
+    ctx->hl[i] = vl;
+  }
+  // The remaining entries are XORs of those four
+  for (int i = 2; i <= 8; i *= 2) {
+    for (int j = 1; j < i; j++) {
+      ctx->hh[i + j] = ctx->hh[i] ^ ctx->hh[j];
+      ctx->hl[i + j] = ctx->hl[i] ^ ctx->hl[j];
+    }
+  }
+}
+
+// x = x * H using the 4-bit table
+static void gcm_mult_table(const aes_gcm_context *ctx, unsigned char *x) {
+  int nibble = x[15] & 0x0f;
+  uint64_t zh = ctx->hh[nibble];
+  uint64_t zl = ctx->hl[nibble];
+
+  for (int i = 15; i >= 0; i--) {
+    int lo = x[i] & 0x0f;
+    int hi = x[i] >> 4;
+    int rem;
+
+    if (i != 15) {
+      rem = (int)(zl & 0x0f);
+      zl = (zh << 60) | (zl >> 4);
+      zh = (zh >> 4) ^ ((uint64_t)gcm_last4[rem] << 48);
+      zh ^= ctx->hh[lo];
+      zl ^= ctx->hl[lo];
+    }
+    rem = (int)(zl & 0x0f);
+    zl = (zh << 60) | (zl >> 4);
+    zh = (zh >> 4) ^ ((uint64_t)gcm_last4[rem] << 48);
+    zh ^= ctx->hh[hi];
+    zl ^= ctx->hl[hi];
+  }
+
+  PUTU64(x, zh);
+  PUTU64(x + 8, zl);
+}
+
+#ifdef RIJNDAEL_HAVE_AESNI
+#include <tmmintrin.h>
+
+#define CLMUL_TARGET __attribute__((target("aes,pclmul,ssse3,sse2")))
+
+static int gcm_have_clmul;
+
+__attribute__((constructor)) static void detect_clmul(void) {
+  unsigned int eax, ebx, ecx, edx;
+
+  if (__get_cpuid(1, &eax, &ebx, &ecx, &edx)) {
+    gcm_have_clmul = (ecx & bit_PCLMUL) && (ecx & bit_SSSE3);
+  }
+}
+
+// The carry-less path needs PCLMULQDQ and follows the AES-NI engine choice
+static int gcm_use_clmul(void) {
+  return gcm_have_clmul && active_engine == &engines[AES_ENGINE_AESNI];
+}
+
+// 256-bit carry-less product of a and b as (lo, hi)
+CLMUL_TARGET static inline void clmul_wide(__m128i a, __m128i b, __m128i *lo,
+                                           __m128i *hi) {
+  __m128i t0 = _mm_clmulepi64_si128(a, b, 0x00);
+  __m128i t1 = _mm_xor_si128(_mm_clmulepi64_si128(a, b, 0x10),
+                             _mm_clmulepi64_si128(a, b, 0x01));
+  __m128i t2 = _mm_clmulepi64_si128(a, b, 0x11);
+
+  *lo = _mm_xor_si128(t0, _mm_slli_si128(t1, 8));
+  *hi = _mm_xor_si128(t2, _mm_srli_si128(t1, 8));
+}
+
+/*
+ * Reduce a 256-bit product of byte-reversed operands modulo the GCM
+ * polynomial: shift left one bit to undo the bit reflection, then fold the
+ * low half in with shifts by 1, 2 and 7 (x^128 = x^7 + x^2 + x + 1).
+ */
+CLMUL_TARGET static inline __m128i clmul_reduce(__m128i lo, __m128i hi) {
+  __m128i t7 = _mm_srli_epi32(lo, 31);
+  __m128i t8 = _mm_srli_epi32(hi, 31);
+  __m128i t9;
+
+  lo = _mm_slli_epi32(lo, 1);
+  hi = _mm_slli_epi32(hi, 1);
+  t9 = _mm_srli_si128(t7, 12);
+  t8 = _mm_slli_si128(t8, 4);
+  t7 = _mm_slli_si128(t7, 4);
+  lo = _mm_or_si128(lo, t7);
+  hi = _mm_or_si128(_mm_or_si128(hi, t8), t9);
+
+  t7 = _mm_xor_si128(_mm_xor_si128(_mm_slli_epi32(lo, 31),
+                                   _mm_slli_epi32(lo, 30)),
+                     _mm_slli_epi32(lo, 25));
+  t8 = _mm_srli_si128(t7, 4);
+  lo = _mm_xor_si128(lo, _mm_slli_si128(t7, 12));
+
+  t9 = _mm_xor_si128(_mm_xor_si128(_mm_srli_epi32(lo, 1),
+                                   _mm_srli_epi32(lo, 2)),
+                     _mm_srli_epi32(lo, 7));
+  lo = _mm_xor_si128(lo, _mm_xor_si128(t9, t8));
+  return _mm_xor_si128(hi, lo);
+}
+
+// acc = (acc ^ x[0]) * H^n ^ x[1] * H^(n-1) ^ ... ^ x[n-1] * H, one reduction
+CLMUL_TARGET static inline __m128i clmul_ghash_group(__m128i acc,
+                                                     const __m128i *x,
+                                                     const __m128i *h,
+                                                     size_t n) {
+  const __m128i bswap =
+      _mm_set_epi8(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+  __m128i lo, hi, tlo, thi;
+
+  clmul_wide(_mm_xor_si128(acc, _mm_shuffle_epi8(x[0], bswap)), h[n - 1], &lo,
+             &hi);
+  for (size_t i = 1; i < n; i++) {
+    clmul_wide(_mm_shuffle_epi8(x[i], bswap), h[n - 1 - i], &tlo, &thi);
+    lo = _mm_xor_si128(lo, tlo);
+    hi = _mm_xor_si128(hi, thi);
+  }
+  return clmul_reduce(lo, hi);
+}
+
+CLMUL_TARGET static void clmul_load_powers(const aes_gcm_context *ctx,
+                                           __m128i *h) {
+  for (int i = 0; i < AESNI_LANES; i++) {
+    h[i] = _mm_loadu_si128((const __m128i *)ctx->h_powers[i]);
+  }
+}
+
+CLMUL_TARGET static void clmul_ghash_blocks(const aes_gcm_context *ctx,
+                                            unsigned char *y,
+                                            const unsigned char *data,
+                                            size_t num_blocks) {
+  const __m128i bswap =
+      _mm_set_epi8(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+  __m128i h[AESNI_LANES];
+  __m128i x[AESNI_LANES];
+  __m128i acc = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)y), bswap);
+  clmul_load_powers(ctx, h);
+
+  while (num_blocks > 0) {
+    size_t lanes = num_blocks < AESNI_LANES ? num_blocks : AESNI_LANES;
+
+    for (size_t i = 0; i < lanes; i++) {
+      x[i] = _mm_loadu_si128((const __m128i *)(data + i * BLOCK_SIZE));
+    }
+    acc = clmul_ghash_group(acc, x, h, lanes);
+
+    data += lanes * BLOCK_SIZE;
+    num_blocks -= lanes;
+  }
+
+  _mm_storeu_si128((__m128i *)y, _mm_shuffle_epi8(acc, bswap));
+}
+
+// Counter block for GCM: IV words as stored, then the big-endian 32-bit count
+CLMUL_TARGET static inline __m128i gcm_counter_block(const uint32_t *prefix,
+                                                     uint32_t ctr) {
+  return _mm_set_epi32((int)__builtin_bswap32(ctr), (int)prefix[2],
+                       (int)prefix[1], (int)prefix[0]);
+}
+
+// inc32 CTR over fewer than AESNI_LANES blocks (the tail of a fused run)
+CLMUL_TARGET static void aesni_ctr32_tail(const __m128i *k,
+                                          const uint32_t *prefix,
+                                          uint32_t *ctr, unsigned char *buf,
+                                          size_t num_blocks) {
+  __m128i b[AESNI_LANES];
+
+  for (size_t i = 0; i < num_blocks; i++) {
+    b[i] = _mm_xor_si128(gcm_counter_block(prefix, (*ctr)++), k[0]);
+  }
+  for (int round = 1; round < NUM_ROUNDS; round++) {
+    for (size_t i = 0; i < num_blocks; i++) {
+      b[i] = _mm_aesenc_si128(b[i], k[round]);
+    }
+  }
+  for (size_t i = 0; i < num_blocks; i++) {
+    __m128i *p = (__m128i *)(buf + i * BLOCK_SIZE);
+    b[i] = _mm_aesenclast_si128(b[i], k[NUM_ROUNDS]);
+    _mm_storeu_si128(p, _mm_xor_si128(_mm_loadu_si128(p), b[i]));
+  }
+}
+
+/*
+ * Fused CTR + GHASH over whole blocks. Every iteration encrypts
+ * AESNI_LANES counter blocks and, between their aesenc rounds, multiplies
+ * one group of ciphertext blocks by H^8..H^1, so the AES and carry-less
+ * multiply units work side by side and each block is touched while it is
+ * still in L1. Decryption hashes the group it is about to overwrite;
+ * encryption hashes the group written by the previous iteration.
+ */
+CLMUL_TARGET static void aesni_gcm_blocks(const aes_gcm_context *ctx,
+                                          unsigned char *counter,
+                                          unsigned char *y,
+                                          unsigned char *buf,
+                                          size_t num_blocks, int encrypt) {
+  const __m128i bswap =
+      _mm_set_epi8(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+  __m128i k[NUM_ROUNDS + 1];
+  __m128i h[AESNI_LANES];
+  __m128i b[AESNI_LANES];
+  __m128i acc = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)y), bswap);
+  const unsigned char *pending = NULL;  // ciphertext group not hashed yet
+  uint32_t prefix[3];
+  uint32_t ctr = GETU32(counter + 12);
+
+  memcpy(prefix, counter, sizeof(prefix));
+  aesni_load_keys(ctx->aes.round_keys, k);
+  clmul_load_powers(ctx, h);
+
+  while (num_blocks >= AESNI_LANES) {
+    __m128i lo = _mm_setzero_si128();
+    __m128i hi = _mm_setzero_si128();
+    const unsigned char *hash = encrypt ? pending : buf;
+
+    for (int i = 0; i < AESNI_LANES; i++) {
+      b[i] = _mm_xor_si128(gcm_counter_block(prefix, ctr++), k[0]);
+    }
+    for (int round = 1; round < NUM_ROUNDS; round++) {
+      for (int i = 0; i < AESNI_LANES; i++) {
+        b[i] = _mm_aesenc_si128(b[i], k[round]);
+      }
+      if (hash != NULL && round <= AESNI_LANES) {
+        __m128i x = _mm_shuffle_epi8(
+            _mm_loadu_si128((const __m128i *)(hash + (round - 1) * BLOCK_SIZE)),
+            bswap);
+        __m128i tlo, thi;
+        if (round == 1) {
+          x = _mm_xor_si128(x, acc);
+        }
+        clmul_wide(x, h[AESNI_LANES - round], &tlo, &thi);
+        lo = _mm_xor_si128(lo, tlo);
+        hi = _mm_xor_si128(hi, thi);
+      }
+    }
+    for (int i = 0; i < AESNI_LANES; i++) {
+      __m128i *p = (__m128i *)(buf + i * BLOCK_SIZE);
+      b[i] = _mm_aesenclast_si128(b[i], k[NUM_ROUNDS]);
+      _mm_storeu_si128(p, _mm_xor_si128(_mm_loadu_si128(p), b[i]));
+    }
+    if (hash != NULL) {
+      acc = clmul_reduce(lo, hi);
+    }
+
+    pending = buf;
+    buf += AESNI_LANES * BLOCK_SIZE;
+    num_blocks -= AESNI_LANES;
+  }
+
+  _mm_storeu_si128((__m128i *)y, _mm_shuffle_epi8(acc, bswap));
+  if (encrypt && pending != NULL) {
+    clmul_ghash_blocks(ctx, y, pending, AESNI_LANES);
+  }
+  if (num_blocks > 0) {
+    if (!encrypt) {
+      clmul_ghash_blocks(ctx, y, buf, num_blocks);
+    }
+    aesni_ctr32_tail(k, prefix, &ctr, buf, num_blocks);
+    if (encrypt) {
+      clmul_ghash_blocks(ctx, y, buf, num_blocks);
+    }
+  }
+  PUTU32(counter + 12, ctr);
+}
+#endif /* x86 AES-NI */
+
+// y = (y ^ block) * H for each whole block of data
+static void ghash_blocks(const aes_gcm_context *ctx, unsigned char *y,
+                         const unsigned char *data, size_t num_blocks) {
+  PROFILE_BEGIN();
+#ifdef RIJNDAEL_HAVE_AESNI
+  if (gcm_use_clmul()) {
+    clmul_ghash_blocks(ctx, y, data, num_blocks);
+    PROFILE_END(AES_PROFILE_GHASH, num_blocks * BLOCK_SIZE);
+    return;
+  }
+#endif
+  for (size_t i = 0; i < num_blocks; i++) {
+    for (int j = 0; j < BLOCK_SIZE; j++) {
+      y[j] ^= data[i * BLOCK_SIZE + j];
+    }
+    gcm_mult_table(ctx, y);
+  }
+  PROFILE_END(AES_PROFILE_GHASH, num_blocks * BLOCK_SIZE);
+}
+
+// GHASH over data of any length; a trailing partial block is zero-padded
+static void gcm_ghash(const aes_gcm_context *ctx, unsigned char *y,
+                      const unsigned char *data, size_t len) {
+  size_t num_blocks = len / BLOCK_SIZE;
+  size_t rest = len % BLOCK_SIZE;
+
+  ghash_blocks(ctx, y, data, num_blocks);
+  if (rest > 0) {
+    unsigned char last[BLOCK_SIZE] = {0};
+    memcpy(last, data + num_blocks * BLOCK_SIZE, rest);
+    ghash_blocks(ctx, y, last, 1);
+  }
+}
+
+/*
+ * CTR with inc32. aes_ctr_crypt carries into the whole 128-bit block, so
+ * the run is split where the low word wraps and the IV part restored.
+ */
+static void gcm_ctr(const aes_context *aes, unsigned char *counter,
+                    unsigned char *buf, size_t len) {
+  unsigned char prefix[BLOCK_SIZE - 4];
+
+  memcpy(prefix, counter, sizeof(prefix));
+  while (len > 0) {
+    uint64_t until_wrap = ((uint64_t)1 << 32) - GETU32(counter + 12);
+    size_t n = len;
+
+    if ((len + BLOCK_SIZE - 1) / BLOCK_SIZE > until_wrap) {
+      n = (size_t)until_wrap * BLOCK_SIZE;
+    }
+    aes_ctr_crypt(aes, counter, buf, n);
+    memcpy(counter, prefix, sizeof(prefix));
+
+    buf += n;
+    len -= n;
+  }
+}
+
+// Encrypt (hash after) or decrypt (hash before) buf, stripe by stripe
+static void gcm_crypt(const aes_gcm_context *ctx, unsigned char *counter,
+                      unsigned char *y, unsigned char *buf, size_t len,
+                      int encrypt) {
+#ifdef RIJNDAEL_HAVE_AESNI
+  if (gcm_use_clmul()) {
+    size_t num_blocks = len / BLOCK_SIZE;
+    aesni_gcm_blocks(ctx, counter, y, buf, num_blocks, encrypt);
+    buf += num_blocks * BLOCK_SIZE;
+    len -= num_blocks * BLOCK_SIZE;
+  }
+#endif
+  while (len > 0) {
+    size_t stripe = GCM_STRIPE_BLOCKS * BLOCK_SIZE;
+    size_t n = len < stripe ? len : stripe;
+
+    if (encrypt) {
+      gcm_ctr(&ctx->aes, counter, buf, n);
+      gcm_ghash(ctx, y, buf, n);
+    } else {
+      gcm_ghash(ctx, y, buf, n);
+      gcm_ctr(&ctx->aes, counter, buf, n);
+    }
+
+    buf += n;
+    len -= n;
+  }
+}
+
+static int gcm_check_args(size_t iv_len, size_t aad_len, size_t len,
+                          size_t tag_len) {
+  if (iv_len == 0 || (uint64_t)len > GCM_MAX_LEN ||
+      (uint64_t)aad_len > ((uint64_t)1 << 61) - 1) {
+    return -1;
+  }
+  if (tag_len != 4 && tag_len != 8 && (tag_len < 12 || tag_len > BLOCK_SIZE)) {
+    return -1;
+  }
+  return 0;
+}
+
+/*
+ * Runs GCM over buf and leaves the full 16-byte tag in tag_out. J0 is the
+ * IV with a 32-bit counter of 1 for 12-byte IVs, and GHASH(IV) otherwise.
+ */
+static void gcm_process(const aes_gcm_context *ctx, const unsigned char *iv,
+                        size_t iv_len, const unsigned char *aad,
+                        size_t aad_len, unsigned char *buf, size_t len,
+                        int encrypt, unsigned char *tag_out) {
+  unsigned char j0[BLOCK_SIZE] = {0};
+  unsigned char counter[BLOCK_SIZE];
+  unsigned char y[BLOCK_SIZE] = {0};
+  unsigned char lengths[BLOCK_SIZE];
+  PROFILE_BEGIN();
+
+  if (iv_len == 12) {
+    memcpy(j0, iv, iv_len);
+    j0[15] = 1;
+  } else {
+    gcm_ghash(ctx, j0, iv, iv_len);
+    memset(lengths, 0, 8);
+    PUTU64(lengths + 8, (uint64_t)iv_len * 8);
+    ghash_blocks(ctx, j0, lengths, 1);
+  }
+
+  memcpy(counter, j0, BLOCK_SIZE);
+  PUTU32(counter + 12, GETU32(counter + 12) + 1);
+
+  gcm_ghash(ctx, y, aad, aad_len);
+  gcm_crypt(ctx, counter, y, buf, len, encrypt);
+
+  PUTU64(lengths, (uint64_t)aad_len * 8);
+  PUTU64(lengths + 8, (uint64_t)len * 8);
+  ghash_blocks(ctx, y, lengths, 1);
+
+  aes_context_encrypt_block(&ctx->aes, j0);
+  for (int i = 0; i < BLOCK_SIZE; i++) {
+    tag_out[i] = j0[i] ^ y[i];
+  }
+
+  secure_zero(j0, sizeof(j0));
+  secure_zero(counter, sizeof(counter));
+  secure_zero(y, sizeof(y));
+  PROFILE_END(encrypt ? AES_PROFILE_GCM_SEAL : AES_PROFILE_GCM_OPEN, len);
+}
+
+void aes_gcm_init(aes_gcm_context *ctx, const unsigned char *key) {
+  unsigned char power[BLOCK_SIZE];
+
+  aes_context_init(&ctx->aes, key);
+  memset(ctx->h, 0, BLOCK_SIZE);
+  aes_context_encrypt_block(&ctx->aes, ctx->h);
+  gcm_build_table(ctx);
+
+  // H^1..H^8 for the carry-less path, byte-reversed as it loads them
+  memcpy(power, ctx->h, BLOCK_SIZE);
+  for (int i = 0; i < 8; i++) {
+    if (i > 0) {
+      gcm_mult_table(ctx, power);
+    }
+    for (int j = 0; j < BLOCK_SIZE; j++) {
+      ctx->h_powers[i][j] = power[BLOCK_SIZE - 1 - j];
+    }
+  }
+  secure_zero(power, sizeof(power));
+}
+
+void aes_gcm_clear(aes_gcm_context *ctx) {
+  secure_zero(ctx, sizeof(*ctx));
+}
+
+aes_gcm_context *aes_gcm_new(const unsigned char *key) {
+  aes_gcm_context *ctx = (aes_gcm_context *)malloc(sizeof(aes_gcm_context));
+
+  PROFILE_COUNT(AES_PROFILE_ALLOC, sizeof(aes_gcm_context));
+  if (ctx == NULL) {
+    return NULL;
+  }
+
+  aes_gcm_init(ctx, key);
+  return ctx;
+}
+
+void aes_gcm_free(aes_gcm_context *ctx) {
+  if (ctx == NULL) {
+    return;
+  }
+
+  aes_gcm_clear(ctx);
+  free(ctx);
+  PROFILE_COUNT(AES_PROFILE_FREE, sizeof(*ctx));
+}
+
+int aes_gcm_seal(const aes_gcm_context *ctx, const unsigned char *iv,
+                 size_t iv_len, const unsigned char *aad, size_t aad_len,
+                 unsigned char *buf, size_t len, unsigned char *tag,
+                 size_t tag_len) {
+  unsigned char full_tag[BLOCK_SIZE];
+
+  if (gcm_check_args(iv_len, aad_len, len, tag_len) != 0) {
+    return -1;
+  }
+
+  gcm_process(ctx, iv, iv_len, aad, aad_len, buf, len, 1, full_tag);
+  memcpy(tag, full_tag, tag_len);
+  secure_zero(full_tag, sizeof(full_tag));
+  return 0;
+}
+
+int aes_gcm_open(const aes_gcm_context *ctx, const unsigned char *iv,
+                 size_t iv_len, const unsigned char *aad, size_t aad_len,
+                 unsigned char *buf, size_t len, const unsigned char *tag,
+                 size_t tag_len) {
+  unsigned char full_tag[BLOCK_SIZE];
+  unsigned char diff = 0;
+
+  if (gcm_check_args(iv_len, aad_len, len, tag_len) != 0) {
+    return -1;
+  }
+
+  gcm_process(ctx, iv, iv_len, aad, aad_len, buf, len, 0, full_tag);
+
+  // Constant-time comparison: don't reveal how many tag bytes matched
+  for (size_t i = 0; i < tag_len; i++) {
+    diff |= full_tag[i] ^ tag[i];
+  }
+  secure_zero(full_tag, sizeof(full_tag));
+
+  if (diff != 0) {
+    secure_zero(buf, len);
+    return -1;
+  }
+  return 0;
+}
+
+/*
+ * AES-128-XTS. Within a sector the tweak for block j is E_K2(sector) * x^j
+ * in GF(2^128), with the polynomial x^128 + x^7 + x^2 + x + 1 and bytes in
+ * little-endian order. Engines with an xts_blocks hook (AES-NI) run whole
+ * blocks in their own pipeline; otherwise blocks are XORed with their
+ * tweaks in batches, pushed through the engine's ECB path and XORed again.
+ */
+#define XTS_BATCH_BLOCKS 32  // tweaks kept on the stack per ECB call
+
+/*
+ * The running tweak is kept as two 64-bit halves of a little-endian
+ * integer; the byte-order helpers are written so compilers turn them into
+ * single loads and stores on little-endian targets.
+ */
+static uint64_t load_le64(const unsigned char *p) {
+  uint64_t v = 0;
+
+  for (int i = 7; i >= 0; i--) {
+    v = (v << 8) | p[i];
+  }
+  return v;
+}
+
+static void store_le64(unsigned char *p, uint64_t v) {
+  for (int i = 0; i < 8; i++) {
+    p[i] = (unsigned char)(v >> (8 * i));
+  }
+}
+
+// t = t * x
+static void xts_mul_alpha(uint64_t *t) {
+  uint64_t carry = t[1] >> 63;
+
+  t[1] = (t[1] << 1) | (t[0] >> 63);
+  t[0] = (t[0] << 1) ^ (carry * 0x87);
+}
+
+static void xts_store_tweak(unsigned char *p, const uint64_t *t) {
+  store_le64(p, t[0]);
+  store_le64(p + 8, t[1]);
+}
+
+static void xor_block(unsigned char *dst, const unsigned char *src) {
+  uint64_t d[2], s[2];
+
+  memcpy(d, dst, BLOCK_SIZE);
+  memcpy(s, src, BLOCK_SIZE);
+  d[0] ^= s[0];
+  d[1] ^= s[1];
+  memcpy(dst, d, BLOCK_SIZE);
+}
+
+// One block under an explicit tweak (used around ciphertext stealing)
+static void xts_block(const aes_context *key, const uint64_t *t,
+                      unsigned char *block, int encrypt) {
+  unsigned char tweak[BLOCK_SIZE];
+
+  xts_store_tweak(tweak, t);
+  xor_block(block, tweak);
+  if (encrypt) {
+    aes_context_encrypt_block(key, block);
+  } else {
+    aes_context_decrypt_block(key, block);
+  }
+  xor_block(block, tweak);
+  secure_zero(tweak, sizeof(tweak));
+}
+
+// Whole blocks, advancing the tweak past the blocks processed
+static void xts_blocks(const aes_context *key, uint64_t *t, unsigned char *buf,
+                       size_t num_blocks, int encrypt) {
+  unsigned char tweaks[XTS_BATCH_BLOCKS * BLOCK_SIZE];
+
+  if (active_engine->xts_blocks != NULL) {
+    active_engine->xts_blocks(key, t, buf, num_blocks, encrypt);
+    return;
+  }
+  while (num_blocks > 0) {
+    size_t n = num_blocks < XTS_BATCH_BLOCKS ? num_blocks : XTS_BATCH_BLOCKS;
+
+    for (size_t i = 0; i < n; i++) {
+      xts_store_tweak(tweaks + i * BLOCK_SIZE, t);
+      xor_block(buf + i * BLOCK_SIZE, tweaks + i * BLOCK_SIZE);
+      xts_mul_alpha(t);
+    }
+    if (encrypt) {
+      aes_ecb_encrypt(key, buf, n);
+    } else {
+      aes_ecb_decrypt(key, buf, n);
+    }
+    for (size_t i = 0; i < n; i++) {
+      xor_block(buf + i * BLOCK_SIZE, tweaks + i * BLOCK_SIZE);
+    }
+
+    buf += n * BLOCK_SIZE;
+    num_blocks -= n;
+  }
+
+  secure_zero(tweaks, sizeof(tweaks));
+}
+
+/*
+ * Ciphertext stealing: with a partial final block of r bytes, the last
+ * full ciphertext block is split. Its first r bytes become the short final
+ * block, and the remaining bytes pad the final plaintext to a whole block,
+ * which is encrypted with the next tweak into the last full position.
+ * Decryption undoes it in the opposite tweak order.
+ */
+static int xts_crypt_sector(const aes_xts_context *ctx, uint64_t sector,
+                            unsigned char *buf, size_t len, int encrypt) {
+  unsigned char block[BLOCK_SIZE] = {0};
+  uint64_t t[2], prev[2];
+  size_t num_blocks = len / BLOCK_SIZE;
+  size_t rest = len % BLOCK_SIZE;
+
+  if (len < BLOCK_SIZE) {
+    return -1;
+  }
+  PROFILE_BEGIN();
+
+  store_le64(block, sector);
+  aes_context_encrypt_block(&ctx->tweak_key, block);
+  t[0] = load_le64(block);
+  t[1] = load_le64(block + 8);
+
+  if (rest == 0) {
+    xts_blocks(&ctx->data_key, t, buf, num_blocks, encrypt);
+  } else {
+    unsigned char *last = buf + (num_blocks - 1) * BLOCK_SIZE;
+    unsigned char *tail = last + BLOCK_SIZE;
+
+    xts_blocks(&ctx->data_key, t, buf, num_blocks - 1, encrypt);
+    prev[0] = t[0];
+    prev[1] = t[1];
+    xts_mul_alpha(t);
+
+    // Encrypt: last full block with the earlier tweak, the stolen block
+    // with the later one; decryption swaps them
+    memcpy(block, last, BLOCK_SIZE);
+    xts_block(&ctx->data_key, encrypt ? prev : t, block, encrypt);
+    memcpy(last, tail, rest);
+    memcpy(tail, block, rest);
+    memcpy(last + rest, block + rest, BLOCK_SIZE - rest);
+    xts_block(&ctx->data_key, encrypt ? t : prev, last, encrypt);
+
+    secure_zero(prev, sizeof(prev));
+  }
+
+  secure_zero(t, sizeof(t));
+  secure_zero(block, sizeof(block));
+  PROFILE_END(encrypt ? AES_PROFILE_XTS_ENCRYPT : AES_PROFILE_XTS_DECRYPT, len);
+  return 0;
+}
+
+void aes_xts_init(aes_xts_context *ctx, const unsigned char *key) {
+  aes_context_init(&ctx->data_key, key);
+  aes_context_init(&ctx->tweak_key, key + KEY_SIZE);
+}
+
+void aes_xts_clear(aes_xts_context *ctx) {
+  secure_zero(ctx, sizeof(*ctx));
+}
+
+aes_xts_context *aes_xts_new(const unsigned char *key) {
+  aes_xts_context *ctx = (aes_xts_context *)malloc(sizeof(aes_xts_context));
+
+  PROFILE_COUNT(AES_PROFILE_ALLOC, sizeof(aes_xts_context));
+  if (ctx == NULL) {
+    return NULL;
+  }
+
+  aes_xts_init(ctx, key);
+  return ctx;
+}
+
+void aes_xts_free(aes_xts_context *ctx) {
+  if (ctx == NULL) {
+    return;
+  }
+
+  aes_xts_clear(ctx);
+  free(ctx);
+  PROFILE_COUNT(AES_PROFILE_FREE, sizeof(*ctx));
+}
+
+int aes_xts_encrypt_sector(const aes_xts_context *ctx, uint64_t sector,
+                           unsigned char *buf, size_t len) {
+  return xts_crypt_sector(ctx, sector, buf, len, 1);
+}
+
+int aes_xts_decrypt_sector(const aes_xts_context *ctx, uint64_t sector,
+                           unsigned char *buf, size_t len) {
+  return xts_crypt_sector(ctx, sector, buf, len, 0);
+}
+
+static int xts_crypt_sectors(const aes_xts_context *ctx, uint64_t first_sector,
+                             unsigned char *buf, size_t sector_size,
+                             size_t num_sectors, int encrypt) {
+  if (sector_size < BLOCK_SIZE) {
+    return -1;
+  }
+  for (size_t i = 0; i < num_sectors; i++) {
+    xts_crypt_sector(ctx, first_sector + i, buf + i * sector_size, sector_size,
+                     encrypt);
+  }
+  return 0;
+}
+
+int aes_xts_encrypt_sectors(const aes_xts_context *ctx, uint64_t first_sector,
+                            unsigned char *buf, size_t sector_size,
+                            size_t num_sectors) {
+  return xts_crypt_sectors(ctx, first_sector, buf, sector_size, num_sectors, 1);
+}
+
+int aes_xts_decrypt_sectors(const aes_xts_context *ctx, uint64_t first_sector,
+                            unsigned char *buf, size_t sector_size,
+                            size_t num_sectors) {
+  return xts_crypt_sectors(ctx, first_sector, buf, sector_size, num_sectors, 0);
 }
@@ -12,6 +12,9 @@
  #ifndef RIJNDAEL_H
  #define RIJNDAEL_H
  
+ #include <stddef.h>
+ #include <stdint.h>
+ 
  // Macro to access a 4x4 block as a matrix (column-major order)
  #define BLOCK_ACCESS(block, row, col) block[(col * 4) + row]
  
@@ -26,9 +29,217 @@
  /*
   * Main functions for AES-128 encryption and decryption.
   * These are the primary entry points for programs using the library.
+  *
+  * Ownership: the library never allocates for a single block. The caller
+  * owns every buffer passed in. aes_encrypt_block / aes_decrypt_block
+  * transform the block in place and return the same pointer, so the result
+  * must NOT be passed to free() (unless the caller allocated the block
+  * itself). The _into variants read 16 bytes from the input and write 16
+  * bytes to the output; the two may be the same buffer. They expand the key
+  * on every call, so use an aes_context (below) for more than one block.
   */
  unsigned char *aes_encrypt_block(unsigned char *plaintext, unsigned char *key);
  unsigned char *aes_decrypt_block(unsigned char *ciphertext, unsigned char *key);
+ void aes_encrypt_block_into(const unsigned char *plaintext,
+                             const unsigned char *key,
+                             unsigned char *ciphertext);
+ void aes_decrypt_block_into(const unsigned char *ciphertext,
+                             const unsigned char *key,
+                             unsigned char *plaintext);
+ 
+ /*
+  * Key-schedule context. The key is expanded once by aes_context_init (or
+  * aes_context_new) and only read afterwards, so a single context can be
+  * used to encrypt many blocks, from any number of threads, without
+  * re-expanding the key. aes_context_clear / aes_context_free zero the
+  * round keys before releasing them.
+  */
+ typedef struct {
+   unsigned char round_keys[EXPANDED_KEY_SIZE];      // encryption schedule
+   unsigned char dec_round_keys[EXPANDED_KEY_SIZE];  // equivalent inverse cipher
+ } aes_context;
+ 
+ void aes_context_init(aes_context *ctx, const unsigned char *key);
+ void aes_context_clear(aes_context *ctx);
+ aes_context *aes_context_new(const unsigned char *key);  // NULL on failure
+ void aes_context_free(aes_context *ctx);
+ void aes_context_encrypt_block(const aes_context *ctx, unsigned char *block);
+ void aes_context_decrypt_block(const aes_context *ctx, unsigned char *block);
+ // Out-of-place (or in-place, with in == out) block operations, no heap use
+ void aes_context_encrypt_block_into(const aes_context *ctx,
+                                     const unsigned char *in,
+                                     unsigned char *out);
+ void aes_context_decrypt_block_into(const aes_context *ctx,
+                                     const unsigned char *in,
+                                     unsigned char *out);
+ 
+ /*
+  * Round engines. The byte-wise engine follows FIPS-197 step by step; the
+  * T-table engine fuses SubBytes, ShiftRows and MixColumns into 32-bit table
+  * lookups; the AES-NI engine uses the x86 AES instructions and is only
+  * available when CPUID reports them. The bitsliced engine evaluates the
+  * S-box as a boolean circuit over 8 blocks at a time, with no table
+  * lookups indexed by key or data, so it runs in constant time on any CPU;
+  * it is meant for ECB/CTR batches and CBC decryption, which run through
+  * the engine many blocks per call (single blocks and CBC encryption, whose
+  * blocks chain, still pay for a whole batch). All give identical results.
+  *
+  * By default the library uses AES-NI when present and the byte-wise engine
+  * otherwise. Another default can be chosen at build time with
+  * -DRIJNDAEL_DEFAULT_ENGINE=<n>, and the engine changed at runtime with
+  * aes_set_engine (returns -1 for an unknown or unavailable engine). The
+  * selection is process-wide; set it before sharing the library between
+  * threads.
+  */
+ #define AES_ENGINE_BYTEWISE 0
+ #define AES_ENGINE_TTABLE 1
+ #define AES_ENGINE_AESNI 2
+ #define AES_ENGINE_BITSLICE 3
+ #define AES_NUM_ENGINES 4
+ 
+ int aes_engine_available(int engine);  // 1 if this CPU can run it
+ int aes_set_engine(int engine);
+ int aes_get_engine(void);
+ const char *aes_engine_name(int engine);  // NULL for an unknown engine
+ 
+ /*
+  * Bulk modes operating in place on whole buffers. ECB and CBC take a count
+  * of 16-byte blocks; CTR takes a length in bytes. The CBC iv and the CTR
+  * counter block are updated so that a long stream can be split over
+  * several calls.
+  */
+ void aes_ecb_encrypt(const aes_context *ctx, unsigned char *buf,
+                      size_t num_blocks);
+ void aes_ecb_decrypt(const aes_context *ctx, unsigned char *buf,
+                      size_t num_blocks);
+ void aes_cbc_encrypt(const aes_context *ctx, unsigned char *iv,
+                      unsigned char *buf, size_t num_blocks);
+ void aes_cbc_decrypt(const aes_context *ctx, unsigned char *iv,
+                      unsigned char *buf, size_t num_blocks);
+ void aes_ctr_crypt(const aes_context *ctx, unsigned char *counter,
+                    unsigned char *buf, size_t len);
+
+ /*
+  * Profiling counters (opt-in). When the library is built with
+  * -DRIJNDAEL_PROFILE (make PROFILE=1), each counter records calls, bytes
+  * processed and wall-clock nanoseconds. There is one counter per round
+  * stage of the byte-wise engine (the T-table and AES-NI engines fuse the
+  * stages, so they only show up under encrypt_block/decrypt_block and the
+  * bulk modes), one per API entry point, one for key expansions (which
+  * covers deriving the decryption schedule; its InvMixColumns passes are
+  * not counted as a stage), and one each for heap allocations and frees
+  * (bytes = allocation size, no time).
+  * Times are inclusive: a byte-wise ECB call is also counted under
+  * encrypt_block and the stages. Counters are process-wide and updated
+  * atomically; the timing calls make a profiled build several times slower.
+  *
+  * In a normal build the hooks compile to nothing, aes_profile_enabled
+  * returns 0 and snapshots read all zeros.
+  */
+ #define AES_PROFILE_SUB_BYTES 0
+ #define AES_PROFILE_SHIFT_ROWS 1
+ #define AES_PROFILE_MIX_COLUMNS 2
+ #define AES_PROFILE_ADD_ROUND_KEY 3
+ #define AES_PROFILE_INV_SUB_BYTES 4
+ #define AES_PROFILE_INV_SHIFT_ROWS 5
+ #define AES_PROFILE_INV_MIX_COLUMNS 6
+ #define AES_PROFILE_KEY_EXPANSION 7
+ #define AES_PROFILE_ENCRYPT_BLOCK 8
+ #define AES_PROFILE_DECRYPT_BLOCK 9
+ #define AES_PROFILE_ECB_ENCRYPT 10
+ #define AES_PROFILE_ECB_DECRYPT 11
+ #define AES_PROFILE_CBC_ENCRYPT 12
+ #define AES_PROFILE_CBC_DECRYPT 13
+ #define AES_PROFILE_CTR 14
+ #define AES_PROFILE_GCM_SEAL 15
+ #define AES_PROFILE_GCM_OPEN 16
+ #define AES_PROFILE_GHASH 17
+ #define AES_PROFILE_XTS_ENCRYPT 18
+ #define AES_PROFILE_XTS_DECRYPT 19
+ #define AES_PROFILE_ALLOC 20
+ #define AES_PROFILE_FREE 21
+ #define AES_PROFILE_NUM_COUNTERS 22
+
+ typedef struct {
+   uint64_t calls;
+   uint64_t bytes;
+   uint64_t nanoseconds;
+ } aes_profile_counter;
+
+ int aes_profile_enabled(void);  // 1 in a -DRIJNDAEL_PROFILE build
+ const char *aes_profile_name(int counter);  // NULL for an unknown counter
+ // Copies all AES_PROFILE_NUM_COUNTERS counters into out
+ void aes_profile_snapshot(aes_profile_counter *out);
+ void aes_profile_reset(void);
+
+ /*
+  * AES-128-GCM authenticated encryption (NIST SP 800-38D). The context holds
+  * the cipher key schedule and the per-key GHASH tables: a 4-bit (Shoup)
+  * multiplication table, and the powers H^1..H^8 used by the PCLMULQDQ
+  * path when the AES-NI engine is active.
+  *
+  * aes_gcm_seal encrypts buf in place and writes a tag_len-byte tag;
+  * aes_gcm_open checks the tag and decrypts buf in place. Tags may be 4, 8
+  * or 12-16 bytes; 12-byte IVs are the fast, recommended case, but any
+  * non-zero length is accepted. Both return 0 on success and -1 for
+  * invalid arguments; aes_gcm_open also returns -1 when the tag does not
+  * match, after zeroing buf, so unauthenticated plaintext is never
+  * released.
+  */
+ typedef struct {
+   aes_context aes;
+   unsigned char h[BLOCK_SIZE];                   // hash key E_K(0^128)
+   uint64_t hh[16], hl[16];                       // 4-bit table, high/low
+   unsigned char h_powers[8][BLOCK_SIZE];         // H^1..H^8, byte-reversed
+ } aes_gcm_context;
+ 
+ void aes_gcm_init(aes_gcm_context *ctx, const unsigned char *key);
+ void aes_gcm_clear(aes_gcm_context *ctx);
+ aes_gcm_context *aes_gcm_new(const unsigned char *key);  // NULL on failure
+ void aes_gcm_free(aes_gcm_context *ctx);
+ int aes_gcm_seal(const aes_gcm_context *ctx, const unsigned char *iv,
+                  size_t iv_len, const unsigned char *aad, size_t aad_len,
+                  unsigned char *buf, size_t len, unsigned char *tag,
+                  size_t tag_len);
+ int aes_gcm_open(const aes_gcm_context *ctx, const unsigned char *iv,
+                  size_t iv_len, const unsigned char *aad, size_t aad_len,
+                  unsigned char *buf, size_t len, const unsigned char *tag,
+                  size_t tag_len);
+
+ /*
+  * AES-128-XTS (IEEE 1619) for sector-addressed storage. Each sector is
+  * encrypted independently under two key schedules: the data key, and the
+  * tweak key that encrypts the sector number (as a 128-bit little-endian
+  * integer) into the initial tweak. Sectors need not be a multiple of 16
+  * bytes; a trailing partial block uses ciphertext stealing, so the
+  * ciphertext is exactly as long as the plaintext.
+  *
+  * The sector functions take one sector of at least 16 bytes; the _sectors
+  * functions process num_sectors consecutive sectors of sector_size bytes,
+  * numbered from first_sector. All return 0, or -1 for a sector shorter
+  * than one block. A context is read-only after aes_xts_init, so disjoint
+  * sector ranges can be processed from several threads at once.
+  */
+ typedef struct {
+   aes_context data_key;
+   aes_context tweak_key;
+ } aes_xts_context;
+ 
+ // key is 32 bytes: the data key followed by the tweak key
+ void aes_xts_init(aes_xts_context *ctx, const unsigned char *key);
+ void aes_xts_clear(aes_xts_context *ctx);
+ aes_xts_context *aes_xts_new(const unsigned char *key);  // NULL on failure
+ void aes_xts_free(aes_xts_context *ctx);
+ int aes_xts_encrypt_sector(const aes_xts_context *ctx, uint64_t sector,
+                            unsigned char *buf, size_t len);
+ int aes_xts_decrypt_sector(const aes_xts_context *ctx, uint64_t sector,
+                            unsigned char *buf, size_t len);
+ int aes_xts_encrypt_sectors(const aes_xts_context *ctx, uint64_t first_sector,
+                             unsigned char *buf, size_t sector_size,
+                             size_t num_sectors);
+ int aes_xts_decrypt_sectors(const aes_xts_context *ctx, uint64_t first_sector,
+                             unsigned char *buf, size_t sector_size,
+                             size_t num_sectors);
  
  /*
   * Internal functions for the AES-128 algorithm.
@@ -37,10 +248,12 @@
  void sub_bytes(unsigned char *block);           // Apply S-box substitution
  void shift_rows(unsigned char *block);          // Shift rows of the state matrix
  void mix_columns(unsigned char *block);         // Mix columns of the state matrix
- void add_round_key(unsigned char *block, unsigned char *round_key); // XOR with round key
+ void add_round_key(unsigned char *block, const unsigned char *round_key); // XOR with round key
  void invert_sub_bytes(unsigned char *block);    // Apply inverse S-box substitution
  void invert_shift_rows(unsigned char *block);   // Reverse shift rows
  void invert_mix_columns(unsigned char *block);  // Reverse mix columns
- unsigned char *expand_key(unsigned char *cipher_key); // Expand 16-byte key to 176 bytes
+ unsigned char *expand_key(unsigned char *cipher_key); // Expand 16-byte key to 176 bytes (per-thread buffer)
+ void expand_key_into(const unsigned char *cipher_key,
+                      unsigned char *expanded_key);  // Expand into caller's buffer
  
  #endif
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""
+Builds the _rijndael CPython extension from rijndael.c:
+
+    python3 setup.py build_ext --inplace     # or: make ext
+"""
+
+from setuptools import Extension, setup
+
+setup(
+    name='rijndael',
+    version='0.1.0',
+    description='AES-128 (Rijndael) in C with a native Python extension',
+    ext_modules=[
+        Extension('_rijndael',
+                  sources=['_rijndaelmodule.c', 'rijndael.c'],
+                  depends=['rijndael.h']),
+    ],
+)
@@ -1,3 +1,9 @@
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the batch API
+    np = None
 
 s_box = (
     0x63, 0x7C, 0x77, 0x7B, 0xF2, 0x6B, 0x6F, 0xC5, 0x30, 0x01, 0x67, 0x2B, 0xFE, 0xD7, 0xAB, 0x76,
@@ -60,29 +66,47 @@ def inv_sub_bytes(s):
 
 
 #AES Shift Row operation
+# The state is a list of columns (see bytes2matrix), so row r is s[0..3][r]
 def shift_rows(s):
-    s[1][0], s[1][1], s[1][2], s[1][3] = s[1][1], s[1][2], s[1][3], s[1][0]
-    s[2][0], s[2][1], s[2][2], s[2][3] = s[2][2], s[2][3], s[2][0], s[2][1]
-    s[3][0], s[3][1], s[3][2], s[3][3] = s[3][3], s[3][0], s[3][1], s[3][2]
+    s[0][1], s[1][1], s[2][1], s[3][1] = s[1][1], s[2][1], s[3][1], s[0][1]
+    s[0][2], s[1][2], s[2][2], s[3][2] = s[2][2], s[3][2], s[0][2], s[1][2]
+    s[0][3], s[1][3], s[2][3], s[3][3] = s[3][3], s[0][3], s[1][3], s[2][3]
     return s
 
 # AES Inverse Shift Row operation
 def inv_shift_rows(s):
-    s[1][0], s[1][1], s[1][2], s[1][3] = s[1][3], s[1][0], s[1][1], s[1][2]
-    s[2][0], s[2][1], s[2][2], s[2][3] = s[2][0], s[2][1], s[2][3], s[2][2]
-    s[3][0], s[3][1], s[3][2], s[3][3] = s[3][1], s[3][2], s[3][3], s[3][0]
+    s[0][1], s[1][1], s[2][1], s[3][1] = s[3][1], s[0][1], s[1][1], s[2][1]
+    s[0][2], s[1][2], s[2][2], s[3][2] = s[2][2], s[3][2], s[0][2], s[1][2]
+    s[0][3], s[1][3], s[2][3], s[3][3] = s[1][3], s[2][3], s[3][3], s[0][3]
     return s
 
 xtime = lambda a: (((a << 1) ^ 0x1B) & 0xFF) if (a & 0x80) else (a << 1) # XOR with 0x1B if the high bit is set
 
-def mix_single_column(a): 
-    # see Sec 4.1.2 in The Design of Rijndael
-    t = a[0] ^ a[1] ^ a[2] ^ a[3]
-    u = a[0]
-    a[0] ^= t ^ xtime(a[0] ^ a[1])
-    a[1] ^= t ^ xtime(a[1] ^ a[2])
-    a[2] ^= t ^ xtime(a[2] ^ a[3])
-    a[3] ^= t ^ xtime(a[3] ^ u)
+# GF(2^8) multiplication, bit by bit; only used to build the tables below
+def gf_mul(a, b):
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = xtime(a)
+        b >>= 1
+    return result
+
+# Precomputed products for the MixColumns (2, 3) and InvMixColumns
+# (9, 11, 13, 14) coefficients
+mul2 = tuple(gf_mul(i, 2) for i in range(256))
+mul3 = tuple(gf_mul(i, 3) for i in range(256))
+mul9 = tuple(gf_mul(i, 9) for i in range(256))
+mul11 = tuple(gf_mul(i, 11) for i in range(256))
+mul13 = tuple(gf_mul(i, 13) for i in range(256))
+mul14 = tuple(gf_mul(i, 14) for i in range(256))
+
+def mix_single_column(a):
+    a0, a1, a2, a3 = a
+    a[0] = mul2[a0] ^ mul3[a1] ^ a2 ^ a3
+    a[1] = a0 ^ mul2[a1] ^ mul3[a2] ^ a3
+    a[2] = a0 ^ a1 ^ mul2[a2] ^ mul3[a3]
+    a[3] = mul3[a0] ^ a1 ^ a2 ^ mul2[a3]
 
 
 def mix_columns(s):
@@ -90,6 +114,19 @@ def mix_columns(s):
         mix_single_column(s[i])
     return s
 
+def inv_mix_single_column(a):
+    a0, a1, a2, a3 = a
+    a[0] = mul14[a0] ^ mul11[a1] ^ mul13[a2] ^ mul9[a3]
+    a[1] = mul9[a0] ^ mul14[a1] ^ mul11[a2] ^ mul13[a3]
+    a[2] = mul13[a0] ^ mul9[a1] ^ mul14[a2] ^ mul11[a3]
+    a[3] = mul11[a0] ^ mul13[a1] ^ mul9[a2] ^ mul14[a3]
+
+# AES Inverse Mix Columns operation
+def inv_mix_columns(s):
+    for i in range(4):
+        inv_mix_single_column(s[i])
+    return s
+
 
 
 def bytes2matrix(text):
@@ -107,12 +144,160 @@ def add_round_key(s, k):
             s[i][j] ^= k[i][j]
 
 
+# Batch (NumPy) versions of the round operations. A batch is an (N, 16)
+# uint8 array with one block per row, bytes in the same column-major order
+# as bytes2matrix, so byte 4*c + r is row r of column c.
+if np is not None:
+    _S_BOX_NP = np.array(s_box, dtype=np.uint8)
+    _INV_S_BOX_NP = np.array(inv_s_box, dtype=np.uint8)
+    _XTIME_NP = np.array(mul2, dtype=np.uint8)
+    _MUL9_NP = np.array(mul9, dtype=np.uint8)
+    _MUL11_NP = np.array(mul11, dtype=np.uint8)
+    _MUL13_NP = np.array(mul13, dtype=np.uint8)
+    _MUL14_NP = np.array(mul14, dtype=np.uint8)
+    # ShiftRows as a gather: output byte (r, c) comes from (r, c + r mod 4)
+    _SHIFT_ROWS_NP = np.array([4 * ((c + r) % 4) + r for c in range(4) for r in range(4)])
+    _INV_SHIFT_ROWS_NP = np.array([4 * ((c - r) % 4) + r for c in range(4) for r in range(4)])
+
+
+def _as_block_array(blocks):
+    """Accept an (N, 16) uint8 array or a bytes-like multiple of 16 bytes."""
+    if np is None:
+        raise ImportError("the AES batch API needs numpy")
+    if isinstance(blocks, np.ndarray):
+        blocks = np.ascontiguousarray(blocks, dtype=np.uint8)
+    else:
+        blocks = np.frombuffer(bytes(blocks), dtype=np.uint8)
+    if blocks.size % 16:
+        raise ValueError(f"batch size must be a multiple of 16 bytes, got {blocks.size}")
+    return blocks.reshape(-1, 16)
+
+
+def mix_columns_batch(s):
+    # Same formula as mix_single_column, applied to every column of every block
+    c = s.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = c[:, :, 0], c[:, :, 1], c[:, :, 2], c[:, :, 3]
+    t = a0 ^ a1 ^ a2 ^ a3
+    out = np.empty_like(c)
+    out[:, :, 0] = a0 ^ t ^ _XTIME_NP[a0 ^ a1]
+    out[:, :, 1] = a1 ^ t ^ _XTIME_NP[a1 ^ a2]
+    out[:, :, 2] = a2 ^ t ^ _XTIME_NP[a2 ^ a3]
+    out[:, :, 3] = a3 ^ t ^ _XTIME_NP[a3 ^ a0]
+    return out.reshape(-1, 16)
+
+
+def inv_mix_columns_batch(s):
+    c = s.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = c[:, :, 0], c[:, :, 1], c[:, :, 2], c[:, :, 3]
+    out = np.empty_like(c)
+    out[:, :, 0] = _MUL14_NP[a0] ^ _MUL11_NP[a1] ^ _MUL13_NP[a2] ^ _MUL9_NP[a3]
+    out[:, :, 1] = _MUL9_NP[a0] ^ _MUL14_NP[a1] ^ _MUL11_NP[a2] ^ _MUL13_NP[a3]
+    out[:, :, 2] = _MUL13_NP[a0] ^ _MUL9_NP[a1] ^ _MUL14_NP[a2] ^ _MUL11_NP[a3]
+    out[:, :, 3] = _MUL11_NP[a0] ^ _MUL13_NP[a1] ^ _MUL9_NP[a2] ^ _MUL14_NP[a3]
+    return out.reshape(-1, 16)
+
+
+# Word-oriented ("T-table") engine. The state is four 32-bit ints, one per
+# column, packed big-endian (row 0 in the top byte) like GETU32 in rijndael.c.
+# Each table entry is SubBytes followed by one column of MixColumns, so a
+# full round is 16 lookups and XORs on ints with no per-block lists.
+_block_words = struct.Struct('>4I')
+
+def _ror8(w):
+    return ((w >> 8) | (w << 24)) & 0xFFFFFFFF
+
+def _word_table(box, c0, c1, c2, c3):
+    t0 = tuple((c0[s] << 24) | (c1[s] << 16) | (c2[s] << 8) | c3[s] for s in box)
+    t1 = tuple(_ror8(w) for w in t0)
+    t2 = tuple(_ror8(w) for w in t1)
+    t3 = tuple(_ror8(w) for w in t2)
+    return t0, t1, t2, t3
+
+_identity = tuple(range(256))
+Te0, Te1, Te2, Te3 = _word_table(s_box, mul2, _identity, _identity, mul3)
+Td0, Td1, Td2, Td3 = _word_table(inv_s_box, mul14, mul9, mul13, mul11)
+# Final round (no MixColumns): the S-box byte pre-shifted into each row
+_Te4 = tuple(tuple(s << shift for s in s_box) for shift in (24, 16, 8, 0))
+_Td4 = tuple(tuple(s << shift for s in inv_s_box) for shift in (24, 16, 8, 0))
+
+def _inv_mix_word(w):
+    # Td[s_box[x]] is InvMixColumns of x alone, so this is InvMixColumns of w
+    return (Td0[s_box[w >> 24]] ^ Td1[s_box[(w >> 16) & 0xFF]] ^
+            Td2[s_box[(w >> 8) & 0xFF]] ^ Td3[s_box[w & 0xFF]])
+
+def _pack_round_keys(key_matrices):
+    """Encryption and equivalent-inverse-cipher decryption keys as flat int lists."""
+    enc = [int.from_bytes(bytes(column), 'big') for matrix in key_matrices for column in matrix]
+    n_rounds = len(key_matrices) - 1
+    dec = []
+    for r in range(n_rounds, -1, -1):
+        words = enc[4 * r:4 * r + 4]
+        if 0 < r < n_rounds:
+            words = [_inv_mix_word(w) for w in words]
+        dec.extend(words)
+    return enc, dec
+
+def _encrypt_words(rk, n_rounds, block):
+    te0, te1, te2, te3 = Te0, Te1, Te2, Te3
+    s0, s1, s2, s3 = _block_words.unpack(block)
+    s0 ^= rk[0]
+    s1 ^= rk[1]
+    s2 ^= rk[2]
+    s3 ^= rk[3]
+    for k in range(4, 4 * n_rounds, 4):
+        s0, s1, s2, s3 = (
+            te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xFF] ^ te2[(s2 >> 8) & 0xFF] ^ te3[s3 & 0xFF] ^ rk[k],
+            te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xFF] ^ te2[(s3 >> 8) & 0xFF] ^ te3[s0 & 0xFF] ^ rk[k + 1],
+            te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xFF] ^ te2[(s0 >> 8) & 0xFF] ^ te3[s1 & 0xFF] ^ rk[k + 2],
+            te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xFF] ^ te2[(s1 >> 8) & 0xFF] ^ te3[s2 & 0xFF] ^ rk[k + 3])
+    f0, f1, f2, f3 = _Te4
+    k = 4 * n_rounds
+    return _block_words.pack(
+        (f0[s0 >> 24] | f1[(s1 >> 16) & 0xFF] | f2[(s2 >> 8) & 0xFF] | f3[s3 & 0xFF]) ^ rk[k],
+        (f0[s1 >> 24] | f1[(s2 >> 16) & 0xFF] | f2[(s3 >> 8) & 0xFF] | f3[s0 & 0xFF]) ^ rk[k + 1],
+        (f0[s2 >> 24] | f1[(s3 >> 16) & 0xFF] | f2[(s0 >> 8) & 0xFF] | f3[s1 & 0xFF]) ^ rk[k + 2],
+        (f0[s3 >> 24] | f1[(s0 >> 16) & 0xFF] | f2[(s1 >> 8) & 0xFF] | f3[s2 & 0xFF]) ^ rk[k + 3])
+
+def _decrypt_words(dk, n_rounds, block):
+    td0, td1, td2, td3 = Td0, Td1, Td2, Td3
+    s0, s1, s2, s3 = _block_words.unpack(block)
+    s0 ^= dk[0]
+    s1 ^= dk[1]
+    s2 ^= dk[2]
+    s3 ^= dk[3]
+    for k in range(4, 4 * n_rounds, 4):
+        s0, s1, s2, s3 = (
+            td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xFF] ^ td2[(s2 >> 8) & 0xFF] ^ td3[s1 & 0xFF] ^ dk[k],
+            td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xFF] ^ td2[(s3 >> 8) & 0xFF] ^ td3[s2 & 0xFF] ^ dk[k + 1],
+            td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xFF] ^ td2[(s0 >> 8) & 0xFF] ^ td3[s3 & 0xFF] ^ dk[k + 2],
+            td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xFF] ^ td2[(s1 >> 8) & 0xFF] ^ td3[s0 & 0xFF] ^ dk[k + 3])
+    f0, f1, f2, f3 = _Td4
+    k = 4 * n_rounds
+    return _block_words.pack(
+        (f0[s0 >> 24] | f1[(s3 >> 16) & 0xFF] | f2[(s2 >> 8) & 0xFF] | f3[s1 & 0xFF]) ^ dk[k],
+        (f0[s1 >> 24] | f1[(s0 >> 16) & 0xFF] | f2[(s3 >> 8) & 0xFF] | f3[s2 & 0xFF]) ^ dk[k + 1],
+        (f0[s2 >> 24] | f1[(s1 >> 16) & 0xFF] | f2[(s0 >> 8) & 0xFF] | f3[s3 & 0xFF]) ^ dk[k + 2],
+        (f0[s3 >> 24] | f1[(s2 >> 16) & 0xFF] | f2[(s1 >> 8) & 0xFF] | f3[s0 & 0xFF]) ^ dk[k + 3])
+
+
+# 'words' is the T-table engine above, 'matrix' the list-of-columns reference
+ENGINES = ('words', 'matrix')
+DEFAULT_ENGINE = 'words'
+
+
 class AES:
     rounds_by_key_size = {16: 10}
 
-    def __init__(self, master_key):
+    def __init__(self, master_key, engine=DEFAULT_ENGINE):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {ENGINES}")
         self.n_rounds = AES.rounds_by_key_size[len(master_key)]
+        self.engine = engine
         self._key_matrices = self._expand_key(master_key)
+        self._enc_words = self._dec_words = None
+        self._closed = False
+        if engine == 'words':
+            self._enc_words, self._dec_words = _pack_round_keys(self._key_matrices)
 
     def _expand_key(self, master_key):
         key_columns = bytes2matrix(master_key)
@@ -129,8 +314,15 @@ class AES:
             key_columns.append(word)
         return [key_columns[4*i:4*(i+1)] for i in range(len(key_columns) // 4)]
 
+    def _check_open(self):
+        if self._closed:
+            raise ValueError("key schedule has been closed")
+
     def encrypt_block(self, plaintext):
         assert len(plaintext) == 16
+        self._check_open()
+        if self._enc_words is not None:
+            return _encrypt_words(self._enc_words, self.n_rounds, plaintext)
         state = bytes2matrix(plaintext)
         add_round_key(state, self._key_matrices[0])
         for i in range(1, self.n_rounds):
@@ -143,6 +335,74 @@ class AES:
         add_round_key(state, self._key_matrices[-1])
         return matrix2bytes(state)
 
+    def decrypt_block(self, ciphertext):
+        assert len(ciphertext) == 16
+        self._check_open()
+        if self._dec_words is not None:
+            return _decrypt_words(self._dec_words, self.n_rounds, ciphertext)
+        state = bytes2matrix(ciphertext)
+        add_round_key(state, self._key_matrices[-1])
+        inv_shift_rows(state)
+        inv_sub_bytes(state)
+        for i in range(self.n_rounds - 1, 0, -1):
+            add_round_key(state, self._key_matrices[i])
+            inv_mix_columns(state)
+            inv_shift_rows(state)
+            inv_sub_bytes(state)
+        add_round_key(state, self._key_matrices[0])
+        return matrix2bytes(state)
+
+    def close(self):
+        """Overwrite the round keys in place; later calls raise ValueError."""
+        self._closed = True
+        for matrix in self._key_matrices:
+            for column in matrix:
+                column[:] = [0] * len(column)
+        for words in (self._enc_words, self._dec_words):
+            if words is not None:
+                words[:] = [0] * len(words)
+        if getattr(self, '_round_keys_np', None) is not None:
+            self._round_keys_np.fill(0)
+
+    def _round_keys_array(self):
+        # (n_rounds + 1, 16) uint8 copy of the schedule for the batch API
+        if getattr(self, '_round_keys_np', None) is None:
+            self._round_keys_np = np.array(
+                [sum(m, []) for m in self._key_matrices], dtype=np.uint8)
+        return self._round_keys_np
+
+    def encrypt_blocks(self, blocks):
+        """
+        Encrypt many blocks at once with NumPy. blocks is an (N, 16) uint8
+        array (or bytes-like, length a multiple of 16); returns an (N, 16)
+        uint8 array with the same result as encrypt_block on each row.
+        """
+        self._check_open()
+        state = _as_block_array(blocks)
+        round_keys = self._round_keys_array()
+        state = state ^ round_keys[0]
+        for i in range(1, self.n_rounds):
+            state = _S_BOX_NP[state][:, _SHIFT_ROWS_NP]
+            state = mix_columns_batch(state)
+            state ^= round_keys[i]
+        state = _S_BOX_NP[state][:, _SHIFT_ROWS_NP]
+        state ^= round_keys[-1]
+        return state
+
+    def decrypt_blocks(self, blocks):
+        """Inverse of encrypt_blocks, with the same array conventions."""
+        self._check_open()
+        state = _as_block_array(blocks)
+        round_keys = self._round_keys_array()
+        state = state ^ round_keys[-1]
+        state = _INV_S_BOX_NP[state][:, _INV_SHIFT_ROWS_NP]
+        for i in range(self.n_rounds - 1, 0, -1):
+            state ^= round_keys[i]
+            state = inv_mix_columns_batch(state)
+            state = _INV_S_BOX_NP[state][:, _INV_SHIFT_ROWS_NP]
+        state ^= round_keys[0]
+        return state
+
 
 
 # Main function
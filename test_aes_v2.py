@@ -3,9 +3,19 @@
 Test script for AES SubBytes transformation (C implementation vs Python reference).
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
 import ctypes
+import io
+import json
+import os
 import random
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
 import unittest
 
 # adding aes module in the path for Python implementation
@@ -18,8 +28,29 @@ try:
 
 
 except ImportError:
-    print("Error: Could not import the reference AES implementation.")
-    sys.exit(1)
+    # Fall back to the in-tree reference when the aes submodule isn't checked out
+    try:
+        from test_aes import sub_bytes, bytes2matrix, matrix2bytes,shift_rows, mix_columns, inv_sub_bytes
+        from test_aes import inv_shift_rows,inv_mix_columns,add_round_key
+        from test_aes import AES
+    except ImportError:
+        print("Error: Could not import the reference AES implementation.")
+        sys.exit(1)
+
+import aes_async
+import bench_aes
+import fuzz_aes
+import aes_cli
+import aes_ctypes
+import aes_keycache
+import aes_parallel
+import aes_profile
+import test_aes
+
+try:
+    import _rijndael
+except ImportError:  # built by `make ext` or `python3 setup.py build_ext --inplace`
+    _rijndael = None
 
 class TestAES(unittest.TestCase):
     @classmethod
@@ -212,6 +243,34 @@ class TestAES(unittest.TestCase):
                              f"Test {i+1}/3: InvMixColumns mismatch: Input={input_data.hex()}, "
                              f"C result={c_result.hex()}, Python result={py_result.hex()}")
             
+    def test_inv_mixcolumns_known_columns(self):
+        """InvMixColumns maps the FIPS-197 example columns back to their inputs"""
+        # (input, MixColumns(input)) pairs, one column each
+        columns = [
+            ("db135345", "8e4da1bc"),
+            ("f20a225c", "9fdc589d"),
+            ("01010101", "01010101"),
+            ("c6c6c6c6", "c6c6c6c6"),
+            ("d4d4d4d5", "d5d5d7d6"),
+            ("2d26314c", "4d7ebdf8"),
+        ]
+        for i in range(0, len(columns), 2):
+            pair = columns[i:i + 2] * 2
+            mixed = bytes.fromhex("".join(m for _, m in pair))
+            c_block = ctypes.create_string_buffer(mixed)
+            self.rijndael.invert_mix_columns(c_block)
+            self.assertEqual(bytes(c_block)[:16].hex(), "".join(c for c, _ in pair))
+
+    def test_inv_mixcolumns_round_trip(self):
+        """invert_mix_columns undoes mix_columns, including all-zero and all-0xff columns"""
+        blocks = [bytes(16), b"\xff" * 16, bytes(range(16))]
+        blocks += [bytes([random.randint(0, 255) for _ in range(16)]) for _ in range(200)]
+        for block in blocks:
+            c_block = ctypes.create_string_buffer(block)
+            self.rijndael.mix_columns(c_block)
+            self.rijndael.invert_mix_columns(c_block)
+            self.assertEqual(bytes(c_block)[:16], block)
+
     def test_addroundkey(self):
         """Test the AddRoundKey transformation"""
         for i in range(3):  # Test with 3 random inputs
@@ -311,6 +370,1583 @@ class TestAES(unittest.TestCase):
             self.assertEqual(c_result, py_result,
                             f"Test {i+1}/3: Decrypt mismatch: Ciphertext={ciphertext.hex()}, "
                             f"Key={key.hex()}, C result={c_result.hex()}, Python result={py_result.hex()}")
-            
+
+
+class TestAESContext(unittest.TestCase):
+    """Tests for the reusable key-schedule context and its Python wrapper"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.rijndael = aes_ctypes.load_library()
+        except OSError:
+            print("Error: Could not load rijndael.so. Make sure it's compiled and available.")
+            sys.exit(1)
+
+    def test_context_matches_single_block_api(self):
+        """One context must give the same result as re-expanding per block"""
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+        with aes_ctypes.AES(key) as ctx:
+            for i in range(3):
+                plaintext = bytes([random.randint(0, 255) for _ in range(16)])
+
+                c_block = ctypes.create_string_buffer(plaintext)
+                self.rijndael.aes_encrypt_block(c_block, ctypes.create_string_buffer(key))
+                expected = bytes(c_block)[:16]
+
+                self.assertEqual(ctx.encrypt_block(plaintext), expected,
+                                 f"Test {i+1}/3: context encrypt mismatch: Plaintext={plaintext.hex()}, "
+                                 f"Key={key.hex()}")
+
+    def test_into_api(self):
+        """The _into functions write out-of-place or in place and match aes_encrypt_block"""
+        rng = random.Random(17)
+        key = bytes(rng.getrandbits(8) for _ in range(16))
+        plaintext = bytes(rng.getrandbits(8) for _ in range(16))
+        expected = AES(key).encrypt_block(plaintext)
+
+        out = ctypes.create_string_buffer(16)
+        saved = aes_ctypes.get_engine()
+        try:
+            # The one-shot encrypt expands only round_keys; no engine may need more
+            for engine in aes_ctypes.available_engines():
+                aes_ctypes.set_engine(engine)
+                self.rijndael.aes_encrypt_block_into(plaintext, key, out)
+                self.assertEqual(out.raw, expected, engine)
+        finally:
+            aes_ctypes.set_engine(saved)
+        back = ctypes.create_string_buffer(16)
+        self.rijndael.aes_decrypt_block_into(out.raw, key, back)
+        self.assertEqual(back.raw, plaintext)
+
+        with aes_ctypes.AES(key) as ctx:
+            # in == out: the same buffer is transformed in place
+            buf = ctypes.create_string_buffer(plaintext, 16)
+            self.rijndael.aes_context_encrypt_block_into(ctx._ctx, ctypes.cast(buf, ctypes.c_char_p), buf)
+            self.assertEqual(buf.raw, expected)
+            self.rijndael.aes_context_decrypt_block_into(ctx._ctx, ctypes.cast(buf, ctypes.c_char_p), buf)
+            self.assertEqual(buf.raw, plaintext)
+            out = ctypes.create_string_buffer(16)
+            self.rijndael.aes_context_encrypt_block_into(ctx._ctx, plaintext, out)
+            self.assertEqual(out.raw, expected)
+
+    def test_single_block_api_returns_its_argument(self):
+        """aes_encrypt_block works in place and returns the caller's pointer (nothing to free)"""
+        key = ctypes.create_string_buffer(bytes(range(16)), 16)
+        block = ctypes.create_string_buffer(bytes.fromhex("00112233445566778899aabbccddeeff"), 16)
+        encrypt = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p)(
+            ('aes_encrypt_block', self.rijndael))
+        self.assertEqual(encrypt(ctypes.addressof(block), ctypes.addressof(key)), ctypes.addressof(block))
+        self.assertEqual(block.raw.hex(), "69c4e0d86a7b0430d8cdb78070b4c55a")
+
+    def test_context_matches_reference(self):
+        """Context encryption/decryption against the Python reference"""
+        for i in range(3):
+            plaintext = bytes([random.randint(0, 255) for _ in range(16)])
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+
+            ctx = aes_ctypes.AES(key)
+            ciphertext = ctx.encrypt_block(plaintext)
+
+            self.assertEqual(ciphertext, AES(key).encrypt_block(plaintext),
+                             f"Test {i+1}/3: Encrypt mismatch: Plaintext={plaintext.hex()}, Key={key.hex()}")
+            self.assertEqual(ctx.decrypt_block(ciphertext), plaintext,
+                             f"Test {i+1}/3: Round trip mismatch: Plaintext={plaintext.hex()}, Key={key.hex()}")
+
+    def test_context_shared_between_threads(self):
+        """Concurrent callers must not corrupt each other's round keys"""
+        keys = [bytes([random.randint(0, 255) for _ in range(16)]) for _ in range(4)]
+        blocks = [bytes([random.randint(0, 255) for _ in range(16)]) for _ in range(64)]
+        contexts = [aes_ctypes.AES(key) for key in keys]
+        expected = [[AES(key).encrypt_block(block) for block in blocks] for key in keys]
+        failures = []
+
+        def worker(index):
+            for _ in range(20):
+                for block, want in zip(blocks, expected[index]):
+                    if contexts[index].encrypt_block(block) != want:
+                        failures.append(index)
+                        return
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(keys))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+
+    def test_invalid_key_length(self):
+        """Only 16-byte keys are accepted"""
+        with self.assertRaises(ValueError):
+            aes_ctypes.AES(b"short key")
+
+    def test_block_length_checked(self):
+        aes = aes_ctypes.AES(bytes(16))
+        for bad in (b"", bytes(15), bytes(17)):
+            with self.assertRaisesRegex(ValueError, "16 bytes"):
+                aes.encrypt_block(bad)
+            with self.assertRaisesRegex(ValueError, "16 bytes"):
+                aes.decrypt_block(bad)
+
+    def test_closed_context_raises(self):
+        """Every method refuses a closed context instead of passing NULL to C"""
+        aes = aes_ctypes.AES(bytes(16))
+        aes.close()
+        aes.close()
+        calls = [
+            lambda: aes.encrypt_block(bytes(16)),
+            lambda: aes.decrypt_block(bytes(16)),
+            lambda: aes.encrypt_ecb(bytearray(16)),
+            lambda: aes.decrypt_ecb(bytearray(16)),
+            lambda: aes.encrypt_cbc(bytearray(16), bytes(16)),
+            lambda: aes.decrypt_cbc(bytearray(16), bytes(16)),
+            lambda: aes.encrypt_ctr(bytearray(16), bytes(16)),
+        ]
+        for call in calls:
+            with self.assertRaisesRegex(ValueError, "closed"):
+                call()
+
+    def test_close_during_call(self):
+        """close() from another thread leaves the context to the running call"""
+        buf = bytearray(32 << 20)
+        aes = aes_ctypes.AES(bytes(16))
+        expected = bytes(aes.encrypt_ecb(bytes(len(buf))))
+        started = threading.Event()
+
+        def work():
+            started.set()
+            try:
+                return bytes(aes.encrypt_ecb(buf))
+            except ValueError:  # close() won the race outright
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(work)
+            started.wait()
+            aes.close()
+            result = future.result()
+        self.assertIn(result, (expected, None))
+        self.assertIsNone(aes._ctx)
+        with self.assertRaisesRegex(ValueError, "closed"):
+            aes.encrypt_ecb(bytearray(16))
+
+
+
+# NIST SP 800-38A, appendix F (AES-128)
+SP800_38A_KEY = bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c")
+SP800_38A_PLAINTEXT = bytes.fromhex(
+    "6bc1bee22e409f96e93d7e117393172a" "ae2d8a571e03ac9c9eb76fac45af8e51"
+    "30c81c46a35ce411e5fbc1191a0a52ef" "f69f2445df4f9b17ad2b417be66c3710")
+SP800_38A_ECB = bytes.fromhex(
+    "3ad77bb40d7a3660a89ecaf32466ef97" "f5d3d58503b9699de785895a96fdbaaf"
+    "43b1cd7f598ece23881b00e3ed030688" "7b0c785e27e8ad3f8223207104725dd4")
+SP800_38A_CBC_IV = bytes.fromhex("000102030405060708090a0b0c0d0e0f")
+SP800_38A_CBC = bytes.fromhex(
+    "7649abac8119b246cee98e9b12e9197d" "5086cb9b507219ee95db113a917678b2"
+    "73bed6b8e3c1743b7116e69e22229516" "3ff1caa1681fac09120eca307586e1a7")
+SP800_38A_CTR_COUNTER = bytes.fromhex("f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff")
+SP800_38A_CTR = bytes.fromhex(
+    "874d6191b620e3261bef6864990db6ce" "9806f66b7970fdff8617187bb9fffdff"
+    "5ae4df3edbd5d35e5b4f09020db03eab" "1e031dda2fbe03d1792170a0f3009cee")
+
+
+class TestBulkModes(unittest.TestCase):
+    """Tests for the multi-block ECB/CBC/CTR entry points"""
+
+    def setUp(self):
+        self.aes = aes_ctypes.AES(SP800_38A_KEY)
+
+    def tearDown(self):
+        self.aes.close()
+
+    def test_ecb_vectors(self):
+        """ECB against NIST SP 800-38A F.1.1/F.1.2"""
+        self.assertEqual(bytes(self.aes.encrypt_ecb(SP800_38A_PLAINTEXT)), SP800_38A_ECB)
+        self.assertEqual(bytes(self.aes.decrypt_ecb(SP800_38A_ECB)), SP800_38A_PLAINTEXT)
+
+    def test_cbc_vectors(self):
+        """CBC against NIST SP 800-38A F.2.1/F.2.2"""
+        self.assertEqual(bytes(self.aes.encrypt_cbc(SP800_38A_PLAINTEXT, SP800_38A_CBC_IV)), SP800_38A_CBC)
+        self.assertEqual(bytes(self.aes.decrypt_cbc(SP800_38A_CBC, SP800_38A_CBC_IV)), SP800_38A_PLAINTEXT)
+
+    def test_ctr_vectors(self):
+        """CTR against NIST SP 800-38A F.5.1/F.5.2"""
+        self.assertEqual(bytes(self.aes.encrypt_ctr(SP800_38A_PLAINTEXT, SP800_38A_CTR_COUNTER)), SP800_38A_CTR)
+        self.assertEqual(bytes(self.aes.decrypt_ctr(SP800_38A_CTR, SP800_38A_CTR_COUNTER)), SP800_38A_PLAINTEXT)
+
+    def test_in_place_zero_copy(self):
+        """Writable buffers are processed in place and returned as-is"""
+        buf = bytearray(SP800_38A_PLAINTEXT)
+        self.assertIs(self.aes.encrypt_ecb(buf), buf)
+        self.assertEqual(bytes(buf), SP800_38A_ECB)
+
+        # A memoryview slice only touches its own window
+        buf = bytearray(16) + bytearray(SP800_38A_PLAINTEXT) + bytearray(16)
+        self.aes.encrypt_ecb(memoryview(buf)[16:-16])
+        self.assertEqual(bytes(buf), bytes(16) + SP800_38A_ECB + bytes(16))
+
+    def test_streaming_chunks(self):
+        """Splitting a stream over several calls gives the same output"""
+        iv = bytearray(SP800_38A_CBC_IV)
+        buf = bytearray(SP800_38A_PLAINTEXT)
+        self.aes.encrypt_cbc(memoryview(buf)[:16], iv)
+        self.aes.encrypt_cbc(memoryview(buf)[16:], iv)
+        self.assertEqual(bytes(buf), SP800_38A_CBC)
+        self.assertEqual(bytes(iv), SP800_38A_CBC[-16:])
+
+        counter = bytearray(SP800_38A_CTR_COUNTER)
+        buf = bytearray(SP800_38A_PLAINTEXT)
+        self.aes.encrypt_ctr(memoryview(buf)[:32], counter)
+        self.aes.encrypt_ctr(memoryview(buf)[32:], counter)
+        self.assertEqual(bytes(buf), SP800_38A_CTR)
+
+    def test_ctr_partial_block_and_wraparound(self):
+        """CTR handles odd lengths and carries across the full 128-bit counter"""
+        for i in range(3):
+            data = bytes([random.randint(0, 255) for _ in range(random.randint(1, 100))])
+            counter = b"\xff" * 16
+            expected = bytearray(data)
+            block_counter = 2 ** 128 - 1
+            for offset in range(0, len(data), 16):
+                keystream = self.aes.encrypt_block(block_counter.to_bytes(16, "big"))
+                for j, k in enumerate(keystream[:len(data) - offset]):
+                    expected[offset + j] ^= k
+                block_counter = (block_counter + 1) % 2 ** 128
+
+            self.assertEqual(bytes(self.aes.encrypt_ctr(data, counter)), bytes(expected),
+                             f"Test {i+1}/3: CTR mismatch: Data={data.hex()}")
+
+    def test_bulk_matches_single_block(self):
+        """ECB over many blocks equals block-by-block encryption"""
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+        data = bytes([random.randint(0, 255) for _ in range(16 * 64)])
+        with aes_ctypes.AES(key) as aes:
+            expected = b"".join(AES(key).encrypt_block(data[i:i + 16]) for i in range(0, len(data), 16))
+            self.assertEqual(bytes(aes.encrypt_ecb(data)), expected)
+
+    def test_rejects_partial_blocks(self):
+        """ECB and CBC need whole blocks"""
+        with self.assertRaises(ValueError):
+            self.aes.encrypt_ecb(b"x" * 17)
+        with self.assertRaises(ValueError):
+            self.aes.encrypt_cbc(b"x" * 16, b"short iv")
+
+
+
+class TestEngines(unittest.TestCase):
+    """Cross-check every round engine against the byte-wise reference path"""
+
+    def setUp(self):
+        self.saved_engine = aes_ctypes.get_engine()
+
+    def tearDown(self):
+        aes_ctypes.set_engine(self.saved_engine)
+
+    def test_engines_listed(self):
+        """The portable engines are always compiled in"""
+        self.assertIn("bytewise", aes_ctypes.available_engines())
+        self.assertIn("ttable", aes_ctypes.available_engines())
+        self.assertIn("aesni", aes_ctypes.engines())
+        with self.assertRaises(ValueError):
+            aes_ctypes.set_engine("no-such-engine")
+
+    def test_default_engine(self):
+        """The library starts on AES-NI when the CPU has it"""
+        self.assertIn(self.saved_engine, aes_ctypes.available_engines())
+        if "aesni" in aes_ctypes.available_engines():
+            self.assertEqual(self.saved_engine, "aesni")
+
+    def test_unavailable_engine_rejected(self):
+        """Selecting an engine the CPU can't run leaves the current one active"""
+        if "aesni" in aes_ctypes.available_engines():
+            self.skipTest("AES-NI is available on this machine")
+        before = aes_ctypes.get_engine()
+        with self.assertRaises(ValueError):
+            aes_ctypes.set_engine("aesni")
+        self.assertEqual(aes_ctypes.get_engine(), before)
+
+    def test_pipelined_ctr_counter_carry(self):
+        """Multi-block CTR carries from the low into the high counter word"""
+        counter = bytes(7) + b"\x01" + b"\xff" * 8
+        data = bytes([random.randint(0, 255) for _ in range(16 * 19 + 5)])
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+
+        with aes_ctypes.AES(key) as aes:
+            aes_ctypes.set_engine("bytewise")
+            expected_counter = bytearray(counter)
+            expected = bytes(aes.encrypt_ctr(data, expected_counter))
+            for engine in aes_ctypes.available_engines():
+                aes_ctypes.set_engine(engine)
+                got_counter = bytearray(counter)
+                self.assertEqual(bytes(aes.encrypt_ctr(data, got_counter)), expected, engine)
+                self.assertEqual(got_counter, expected_counter, engine)
+
+    def test_engines_agree(self):
+        """Every engine gives the byte-wise result for ECB, CBC and CTR"""
+        for i in range(3):
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+            iv = bytes([random.randint(0, 255) for _ in range(16)])
+            data = bytes([random.randint(0, 255) for _ in range(16 * 37)])
+
+            with aes_ctypes.AES(key) as aes:
+                aes_ctypes.set_engine("bytewise")
+                expected = [bytes(aes.encrypt_ecb(data)), bytes(aes.decrypt_ecb(data)),
+                            bytes(aes.encrypt_cbc(data, iv)), bytes(aes.decrypt_cbc(data, iv)),
+                            bytes(aes.encrypt_ctr(data[:-3], iv))]
+
+                for engine in aes_ctypes.available_engines():
+                    aes_ctypes.set_engine(engine)
+                    got = [bytes(aes.encrypt_ecb(data)), bytes(aes.decrypt_ecb(data)),
+                           bytes(aes.encrypt_cbc(data, iv)), bytes(aes.decrypt_cbc(data, iv)),
+                           bytes(aes.encrypt_ctr(data[:-3], iv))]
+                    self.assertEqual(got, expected,
+                                     f"Test {i+1}/3: engine {engine} mismatch: Key={key.hex()}")
+
+    def test_cbc_decrypt_batches(self):
+        """Batched CBC decryption chains across batches and streamed calls"""
+        rng = random.Random(181)
+        key = bytes(rng.getrandbits(8) for _ in range(16))
+        iv = bytes(rng.getrandbits(8) for _ in range(16))
+        data = bytes(rng.getrandbits(8) for _ in range(16 * 133))
+        with aes_ctypes.AES(key) as aes:
+            aes_ctypes.set_engine("bytewise")
+            ciphertext = bytes(aes.encrypt_cbc(data, iv))
+            for engine in aes_ctypes.available_engines():
+                aes_ctypes.set_engine(engine)
+                chain = bytearray(iv)
+                # Chunks ending inside, at and past the 64-block batches
+                got = b"".join(bytes(aes.decrypt_cbc(ciphertext[start:end], chain))
+                               for start, end in ((0, 16 * 3), (16 * 3, 16 * 67), (16 * 67, 16 * 133)))
+                self.assertEqual(got, data, engine)
+                self.assertEqual(bytes(chain), ciphertext[-16:], engine)
+
+    def test_bitslice_matches_bytewise(self):
+        """The bitsliced engine against the byte-wise path for every batch shape"""
+        rng = random.Random(18)
+        key = bytes(rng.getrandbits(8) for _ in range(16))
+        # Every byte value at every position, so each S-box input is exercised
+        sweep = bytes((j + p) % 256 for j in range(256) for p in range(16))
+        with aes_ctypes.AES(key) as aes:
+            for n_blocks in list(range(1, 18)) + [256]:
+                data = sweep if n_blocks == 256 else bytes(rng.getrandbits(8) for _ in range(16 * n_blocks))
+                counter = bytes(8) + b"\xff" * 7 + bytes([256 - n_blocks // 2 - 1])
+                results = {}
+                for engine in ("bytewise", "bitslice"):
+                    aes_ctypes.set_engine(engine)
+                    next_counter = bytearray(counter)
+                    results[engine] = [bytes(aes.encrypt_ecb(data)), bytes(aes.decrypt_ecb(data)),
+                                       bytes(aes.encrypt_ctr(data[:-1], next_counter)), bytes(next_counter)]
+                self.assertEqual(results["bitslice"], results["bytewise"], f"{n_blocks} blocks")
+
+    def test_engines_single_block_api(self):
+        """aes_encrypt_block/aes_decrypt_block honour the selected engine"""
+        key = bytes(range(16))
+        plaintext = bytes.fromhex("00112233445566778899aabbccddeeff")
+        ciphertext = bytes.fromhex("69c4e0d86a7b0430d8cdb78070b4c55a")  # FIPS-197 C.1
+        rijndael = aes_ctypes.load_library()
+
+        for engine in aes_ctypes.available_engines():
+            aes_ctypes.set_engine(engine)
+            c_block = ctypes.create_string_buffer(plaintext)
+            rijndael.aes_encrypt_block(c_block, ctypes.create_string_buffer(key))
+            self.assertEqual(bytes(c_block)[:16], ciphertext, f"{engine} encrypt")
+            rijndael.aes_decrypt_block(c_block, ctypes.create_string_buffer(key))
+            self.assertEqual(bytes(c_block)[:16], plaintext, f"{engine} decrypt")
+
+
+
+class TestPythonAES(unittest.TestCase):
+    """Tests for the in-tree pure-Python AES (test_aes.py)"""
+
+    def test_fips197_vector(self):
+        """FIPS-197 appendix C.1"""
+        aes = test_aes.AES(bytes(range(16)))
+        ciphertext = aes.encrypt_block(bytes.fromhex("00112233445566778899aabbccddeeff"))
+        self.assertEqual(ciphertext.hex(), "69c4e0d86a7b0430d8cdb78070b4c55a")
+
+    def test_gf_tables(self):
+        """The multiplication tables agree with repeated xtime"""
+        for x in range(256):
+            self.assertEqual(test_aes.mul2[x], test_aes.xtime(x))
+            self.assertEqual(test_aes.mul3[x], test_aes.xtime(x) ^ x)
+            x8 = test_aes.xtime(test_aes.xtime(test_aes.xtime(x)))
+            x4 = test_aes.xtime(test_aes.xtime(x))
+            x2 = test_aes.xtime(x)
+            self.assertEqual(test_aes.mul9[x], x8 ^ x)
+            self.assertEqual(test_aes.mul11[x], x8 ^ x2 ^ x)
+            self.assertEqual(test_aes.mul13[x], x8 ^ x4 ^ x)
+            self.assertEqual(test_aes.mul14[x], x8 ^ x4 ^ x2)
+
+    def test_inv_mix_columns_round_trip(self):
+        """inv_mix_columns undoes mix_columns"""
+        for i in range(3):
+            block = bytes([random.randint(0, 255) for _ in range(16)])
+            state = test_aes.bytes2matrix(block)
+            test_aes.inv_mix_columns(test_aes.mix_columns(state))
+            self.assertEqual(test_aes.matrix2bytes(state), block)
+
+    def test_round_trip(self):
+        """decrypt_block inverts encrypt_block"""
+        for i in range(3):
+            plaintext = bytes([random.randint(0, 255) for _ in range(16)])
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+            aes = test_aes.AES(key)
+            self.assertEqual(aes.decrypt_block(aes.encrypt_block(plaintext)), plaintext,
+                             f"Test {i+1}/3: Round trip mismatch: Plaintext={plaintext.hex()}, Key={key.hex()}")
+
+    def test_word_engine_matches_matrix(self):
+        """The T-table engine agrees with the list-of-columns engine"""
+        rng = random.Random(15)
+        for i in range(50):
+            key = bytes(rng.getrandbits(8) for _ in range(16))
+            block = bytes(rng.getrandbits(8) for _ in range(16))
+            words = test_aes.AES(key, engine='words')
+            matrix = test_aes.AES(key, engine='matrix')
+            self.assertEqual(words.encrypt_block(block), matrix.encrypt_block(block))
+            self.assertEqual(words.decrypt_block(block), matrix.decrypt_block(block))
+            self.assertEqual(words.decrypt_block(words.encrypt_block(block)), block)
+
+    def test_word_tables(self):
+        """Te0/Td0 entries are SubBytes (InvSubBytes) followed by one MixColumns column"""
+        for x in range(256):
+            s = test_aes.s_box[x]
+            self.assertEqual(test_aes.Te0[x].to_bytes(4, 'big'),
+                             bytes([test_aes.mul2[s], s, s, test_aes.mul3[s]]))
+            s = test_aes.inv_s_box[x]
+            self.assertEqual(test_aes.Td0[x].to_bytes(4, 'big'),
+                             bytes([test_aes.mul14[s], test_aes.mul9[s], test_aes.mul13[s], test_aes.mul11[s]]))
+
+    def test_engines(self):
+        """Both engines pass FIPS-197 C.1; unknown engines are rejected"""
+        for engine in test_aes.ENGINES:
+            aes = test_aes.AES(bytes(range(16)), engine=engine)
+            self.assertEqual(aes.engine, engine)
+            ciphertext = aes.encrypt_block(bytes.fromhex("00112233445566778899aabbccddeeff"))
+            self.assertEqual(ciphertext.hex(), "69c4e0d86a7b0430d8cdb78070b4c55a")
+            self.assertEqual(aes.decrypt_block(ciphertext).hex(), "00112233445566778899aabbccddeeff")
+        self.assertEqual(test_aes.AES(bytes(16)).engine, test_aes.DEFAULT_ENGINE)
+        with self.assertRaises(ValueError):
+            test_aes.AES(bytes(16), engine='bogus')
+
+    def test_close_zeroes_word_keys(self):
+        aes = test_aes.AES(bytes(range(16)), engine='words')
+        aes.close()
+        self.assertFalse(any(aes._enc_words))
+        self.assertFalse(any(aes._dec_words))
+
+    def test_closed_instance_raises(self):
+        """Like _rijndael.AES, a closed schedule refuses to encrypt"""
+        for engine in test_aes.ENGINES:
+            aes = test_aes.AES(bytes(16), engine=engine)
+            aes.close()
+            with self.assertRaisesRegex(ValueError, "closed"):
+                aes.encrypt_block(bytes(16))
+            with self.assertRaisesRegex(ValueError, "closed"):
+                aes.decrypt_block(bytes(16))
+            if test_aes.np is not None:
+                with self.assertRaisesRegex(ValueError, "closed"):
+                    aes.encrypt_blocks(bytes(16))
+
+    def test_matches_c(self):
+        """Pure-Python encryption against the C library"""
+        for i in range(3):
+            plaintext = bytes([random.randint(0, 255) for _ in range(16)])
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+            with aes_ctypes.AES(key) as c_aes:
+                self.assertEqual(test_aes.AES(key).encrypt_block(plaintext), c_aes.encrypt_block(plaintext),
+                                 f"Test {i+1}/3: Encrypt mismatch: Plaintext={plaintext.hex()}, Key={key.hex()}")
+                self.assertEqual(test_aes.AES(key).decrypt_block(plaintext), c_aes.decrypt_block(plaintext),
+                                 f"Test {i+1}/3: Decrypt mismatch: Ciphertext={plaintext.hex()}, Key={key.hex()}")
+
+
+@unittest.skipIf(test_aes.np is None, "numpy is not installed")
+class TestNumpyBatch(unittest.TestCase):
+    """Tests for the vectorized AES.encrypt_blocks batch API"""
+
+    def test_matches_encrypt_block(self):
+        """Every row equals the single-block result"""
+        for i in range(3):
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+            data = bytes([random.randint(0, 255) for _ in range(16 * 40)])
+            aes = test_aes.AES(key)
+
+            batch = aes.encrypt_blocks(data)
+            self.assertEqual(batch.shape, (40, 16))
+            for n in range(40):
+                block = data[16 * n:16 * (n + 1)]
+                self.assertEqual(batch[n].tobytes(), aes.encrypt_block(block),
+                                 f"Test {i+1}/3: batch row {n} mismatch: Key={key.hex()}")
+
+    def test_matches_c_ecb(self):
+        """A large batch against the C bulk ECB path"""
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+        blocks = test_aes.np.random.randint(0, 256, size=(4096, 16), dtype=test_aes.np.uint8)
+        with aes_ctypes.AES(key) as c_aes:
+            expected = bytes(c_aes.encrypt_ecb(blocks.tobytes()))
+        self.assertEqual(test_aes.AES(key).encrypt_blocks(blocks).tobytes(), expected)
+
+    def test_decrypt_blocks(self):
+        """decrypt_blocks inverts encrypt_blocks and matches decrypt_block"""
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+        data = bytes([random.randint(0, 255) for _ in range(16 * 40)])
+        aes = test_aes.AES(key)
+
+        self.assertEqual(aes.decrypt_blocks(aes.encrypt_blocks(data)).tobytes(), data)
+        batch = aes.decrypt_blocks(data)
+        for n in range(40):
+            self.assertEqual(batch[n].tobytes(), aes.decrypt_block(data[16 * n:16 * (n + 1)]))
+
+    def test_input_not_modified(self):
+        """The input array is left untouched"""
+        blocks = test_aes.np.zeros((3, 16), dtype=test_aes.np.uint8)
+        test_aes.AES(bytes(16)).encrypt_blocks(blocks)
+        self.assertFalse(blocks.any())
+
+    def test_rejects_partial_blocks(self):
+        with self.assertRaises(ValueError):
+            test_aes.AES(bytes(16)).encrypt_blocks(b"x" * 20)
+
+
+
+class TestCLI(unittest.TestCase):
+    """Tests for the streaming file encryption tool (python -m aes_cli)"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.key = bytes([random.randint(0, 255) for _ in range(16)])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def run_cli(self, command, mode, src, dst, *extra):
+        return aes_cli.main([command, "--mode", mode, "--key", self.key.hex(),
+                             "--in", src, "--out", dst, *extra])
+
+    def write(self, name, data):
+        with open(self.path(name), "wb") as f:
+            f.write(data)
+        return self.path(name)
+
+    def read(self, name):
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def test_round_trip(self):
+        """Encrypt then decrypt across chunk boundaries and odd sizes"""
+        for size in (0, 1, 15, 16, 17, 64, 100, 1000):
+            data = bytes([random.randint(0, 255) for _ in range(size)])
+            src = self.write("plain", data)
+            for mode in ("cbc", "ctr"):
+                self.assertEqual(self.run_cli("encrypt", mode, src, self.path("enc"), "--chunk-size", "32"), 0)
+                self.assertEqual(self.run_cli("decrypt", mode, self.path("enc"), self.path("dec"),
+                                              "--chunk-size", "48"), 0)
+                self.assertEqual(self.read("dec"), data, f"{mode} round trip failed for {size} bytes")
+
+    def test_output_format(self):
+        """Output is the IV/counter header followed by the standard mode output"""
+        data = bytes([random.randint(0, 255) for _ in range(50)])
+        src = self.write("plain", data)
+
+        self.assertEqual(self.run_cli("encrypt", "cbc", src, self.path("enc"), "--chunk-size", "16"), 0)
+        enc = self.read("enc")
+        padded = data + bytes([14]) * 14
+        with aes_ctypes.AES(self.key) as aes:
+            self.assertEqual(enc[16:], bytes(aes.encrypt_cbc(padded, enc[:16])))
+
+        self.assertEqual(self.run_cli("encrypt", "ctr", src, self.path("enc")), 0)
+        enc = self.read("enc")
+        with aes_ctypes.AES(self.key) as aes:
+            self.assertEqual(enc[16:], bytes(aes.encrypt_ctr(data, enc[:16])))
+
+    def test_bad_input_rejected(self):
+        """Bad padding and truncated ciphertext exit non-zero"""
+        iv = bytes(16)
+        with aes_ctypes.AES(self.key) as aes:
+            # The final block decrypts to a zero byte, which is never valid padding
+            bad_padding = self.write("bad", iv + bytes(aes.encrypt_cbc(bytes(16), iv)))
+        self.assertEqual(self.run_cli("decrypt", "cbc", bad_padding, self.path("dec")), 1)
+
+        src = self.write("plain", b"attack at dawn")
+        self.assertEqual(self.run_cli("encrypt", "cbc", src, self.path("enc")), 0)
+        truncated = self.write("truncated", self.read("enc")[:-1])
+        self.assertEqual(self.run_cli("decrypt", "cbc", truncated, self.path("dec")), 1)
+        self.assertEqual(self.run_cli("decrypt", "cbc", self.write("short", b"x"), self.path("dec")), 1)
+
+
+
+class TestParallelCTR(unittest.TestCase):
+    """Parallel CTR must be byte-identical to the serial path"""
+
+    def serial(self, key, data, nonce):
+        with aes_ctypes.AES(key) as aes:
+            return bytes(aes.encrypt_ctr(data, nonce))
+
+    def test_thread_pool_matches_serial(self):
+        """C backend over many small chunks, including counter wraparound"""
+        for i in range(3):
+            key = bytes([random.randint(0, 255) for _ in range(16)])
+            nonce = b"\xff" * 15 + bytes([random.randint(0, 255)])
+            data = bytes([random.randint(0, 255) for _ in range(random.randint(1, 5000))])
+            result = aes_parallel.encrypt_ctr(key, data, nonce, workers=4, chunk_size=64)
+            self.assertEqual(bytes(result), self.serial(key, data, nonce),
+                             f"Test {i+1}/3: parallel CTR mismatch: Key={key.hex()}, Nonce={nonce.hex()}")
+
+    def test_thread_pool_in_place(self):
+        """Writable buffers are encrypted in place"""
+        key = bytes(range(16))
+        buf = bytearray(4096)
+        self.assertIs(aes_parallel.encrypt_ctr(key, buf, bytes(16), workers=3, chunk_size=256), buf)
+        self.assertEqual(bytes(buf), self.serial(key, bytes(4096), bytes(16)))
+        aes_parallel.decrypt_ctr(key, buf, bytes(16), workers=3, chunk_size=256)
+        self.assertEqual(bytes(buf), bytes(4096))
+
+    def test_process_pool_matches_serial(self):
+        """Pure-Python backend on a process pool"""
+        key = bytes([random.randint(0, 255) for _ in range(16)])
+        nonce = bytes([random.randint(0, 255) for _ in range(16)])
+        data = bytes([random.randint(0, 255) for _ in range(1000)])
+        result = aes_parallel.encrypt_ctr(key, data, nonce, workers=2, chunk_size=320, backend="python")
+        self.assertEqual(bytes(result), self.serial(key, data, nonce))
+
+    def test_rejects_bad_parameters(self):
+        key = bytes(16)
+        with self.assertRaises(ValueError):
+            aes_parallel.encrypt_ctr(key, b"data", bytes(16), chunk_size=100)
+        with self.assertRaises(ValueError):
+            aes_parallel.encrypt_ctr(key, b"data", bytes(8))
+        with self.assertRaises(ValueError):
+            aes_parallel.encrypt_ctr(key, b"data", bytes(16), backend="gpu")
+
+
+
+class _CollectingWriter:
+    """Stand-in for asyncio.StreamWriter that records writes and drains"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class _CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+    """Tests for the asyncio facade"""
+
+    def setUp(self):
+        self.key = bytes([random.randint(0, 255) for _ in range(16)])
+        self.iv = bytes([random.randint(0, 255) for _ in range(16)])
+
+    async def test_matches_sync_api(self):
+        """Every mode gives the aes_ctypes result, inline or offloaded"""
+        data = bytes([random.randint(0, 255) for _ in range(16 * 20)])
+        with aes_ctypes.AES(self.key) as aes:
+            expected = {"ecb": bytes(aes.encrypt_ecb(data)),
+                        "cbc": bytes(aes.encrypt_cbc(data, self.iv)),
+                        "ctr": bytes(aes.encrypt_ctr(data, self.iv))}
+        for threshold in (0, 1 << 20):
+            for mode, want in expected.items():
+                iv = None if mode == "ecb" else self.iv
+                got = await aes_async.encrypt(data, self.key, mode, iv, inline_threshold=threshold)
+                self.assertEqual(bytes(got), want, f"{mode} threshold={threshold}")
+                back = await aes_async.decrypt(got, self.key, mode, iv, inline_threshold=threshold)
+                self.assertEqual(bytes(back), data, f"{mode} threshold={threshold}")
+
+    async def test_large_payloads_offloaded(self):
+        """Payloads at or above the threshold go to the executor, small ones don't"""
+        with _CountingExecutor() as executor:
+            await aes_async.encrypt(bytes(100), self.key, "ctr", self.iv, executor=executor, inline_threshold=1000)
+            self.assertEqual(executor.submitted, 0)
+            await aes_async.encrypt(bytes(1000), self.key, "ctr", self.iv, executor=executor, inline_threshold=1000)
+            self.assertEqual(executor.submitted, 1)
+
+    async def test_rejects_bad_mode(self):
+        with self.assertRaises(ValueError):
+            await aes_async.encrypt(bytes(16), self.key, "xts", self.iv)
+        with self.assertRaises(ValueError):
+            await aes_async.encrypt(bytes(16), self.key, "cbc")
+
+    async def test_stream_round_trip(self):
+        """Odd-sized writes and reads line up with one CTR pass over the stream"""
+        data = bytes([random.randint(0, 255) for _ in range(3000)])
+        sizes = [1, 15, 16, 17, 100, 33, 2000, 818]
+
+        sink = _CollectingWriter()
+        writer = aes_async.AESStreamWriter(sink, self.key, self.iv, inline_threshold=64)
+        offset = 0
+        for size in sizes:
+            await writer.write(data[offset:offset + size])
+            offset += size
+        await writer.close()
+
+        with aes_ctypes.AES(self.key) as aes:
+            self.assertEqual(bytes(sink.data), bytes(aes.encrypt_ctr(data, self.iv)))
+        self.assertEqual(sink.drains, len(sizes))
+
+        source = asyncio.StreamReader()
+        source.feed_data(bytes(sink.data))
+        source.feed_eof()
+        reader = aes_async.AESStreamReader(source, self.key, self.iv, inline_threshold=64)
+        plain = await reader.readexactly(7) + await reader.read(1000) + await reader.read()
+        reader.close()
+        self.assertEqual(plain, data)
+        self.assertTrue(reader.at_eof())
+
+    async def test_close_waits_for_pending_write(self):
+        """close() lets an offloaded write finish before freeing the key schedule"""
+        data = bytes(1 << 20)
+        sink = _CollectingWriter()
+        gate = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(gate.wait)  # holds the write back until close() is waiting
+            writer = aes_async.AESStreamWriter(sink, self.key, self.iv, executor=executor, inline_threshold=0)
+            pending = asyncio.ensure_future(writer.write(data))
+            await asyncio.sleep(0)
+            closing = asyncio.ensure_future(writer.close())
+            await asyncio.sleep(0)
+            gate.set()
+            await asyncio.gather(pending, closing)
+        with aes_ctypes.AES(self.key) as aes:
+            self.assertEqual(bytes(sink.data), bytes(aes.encrypt_ctr(data, self.iv)))
+
+    async def test_concurrent_writes_keep_order(self):
+        """Writes issued together are sent in call order, whatever finishes first"""
+        chunks = [bytes([i]) * size for i, size in enumerate([1 << 20, 16, 5, 1000, 3])]
+        sink = _CollectingWriter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            writer = aes_async.AESStreamWriter(sink, self.key, self.iv, executor=executor, inline_threshold=0)
+            await asyncio.gather(*(writer.write(chunk) for chunk in chunks))
+            await writer.close()
+        with aes_ctypes.AES(self.key) as aes:
+            self.assertEqual(bytes(sink.data), bytes(aes.encrypt_ctr(b"".join(chunks), self.iv)))
+
+
+
+class TestKeyScheduleCache(unittest.TestCase):
+    """Tests for the LRU cache of expanded key schedules"""
+
+    def keys(self, n):
+        return [bytes([i]) * 16 for i in range(n)]
+
+    def test_hits_misses_evictions(self):
+        """LRU order decides what is evicted, and the counters follow"""
+        cache = aes_keycache.KeyScheduleCache(capacity=2)
+        k0, k1, k2 = self.keys(3)
+        for key in (k0, k1, k0, k2):  # k1 is least recently used when k2 arrives
+            with cache.acquire(key):
+                pass
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 3, "evictions": 1, "size": 2, "capacity": 2})
+
+        with cache.acquire(k0):
+            pass
+        self.assertEqual(cache.stats()["hits"], 2)
+        with cache.acquire(k1):
+            pass
+        self.assertEqual(cache.stats()["misses"], 4)
+
+        cache.reset_stats()
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_cached_schedule_is_correct(self):
+        """Both encryption and decryption work through cached entries"""
+        for factory in (aes_ctypes.AES, test_aes.AES):
+            cache = aes_keycache.KeyScheduleCache(capacity=4, factory=factory)
+            key = bytes(range(16))
+            for _ in range(2):
+                with cache.acquire(key) as aes:
+                    ciphertext = aes.encrypt_block(bytes.fromhex("00112233445566778899aabbccddeeff"))
+                    self.assertEqual(ciphertext.hex(), "69c4e0d86a7b0430d8cdb78070b4c55a")
+                    self.assertEqual(aes.decrypt_block(ciphertext).hex(), "00112233445566778899aabbccddeeff")
+
+    def test_evicted_entries_zeroed(self):
+        """Eviction wipes the schedule, but only once nobody is using it"""
+        cache = aes_keycache.KeyScheduleCache(capacity=1, factory=test_aes.AES)
+        k0, k1 = bytes(range(1, 17)), bytes(16)
+
+        with cache.acquire(k0) as in_use:
+            with cache.acquire(k1):
+                pass  # evicts k0 while it is still borrowed
+            self.assertTrue(any(any(col) for m in in_use._key_matrices for col in m))
+        self.assertFalse(any(any(col) for m in in_use._key_matrices for col in m))
+
+        c_cache = aes_keycache.KeyScheduleCache(capacity=1)
+        with c_cache.acquire(k0) as native:
+            pass
+        with c_cache.acquire(k1):
+            pass
+        self.assertIsNone(native._ctx)  # aes_context_free zeroes and frees
+
+    def test_resize_and_clear(self):
+        cache = aes_keycache.KeyScheduleCache(capacity=8, factory=test_aes.AES)
+        for key in self.keys(8):
+            with cache.acquire(key):
+                pass
+        cache.resize(3)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.stats()["evictions"], 5)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        with self.assertRaises(ValueError):
+            cache.resize(0)
+
+    def test_expands_outside_lock(self):
+        """The factory runs unlocked, and a racing expansion of the same key is dropped"""
+        key = bytes(range(16))
+        built = []
+
+        def factory(k):
+            self.assertFalse(cache._lock.locked())
+            schedule = test_aes.AES(k)
+            built.append(schedule)
+            if len(built) == 1:  # another thread misses on the same key meanwhile
+                with cache.acquire(k):
+                    pass
+            return schedule
+
+        cache = aes_keycache.KeyScheduleCache(capacity=4, factory=factory)
+        with cache.acquire(key) as aes:
+            self.assertIs(aes, built[1])
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertFalse(any(any(col) for m in built[0]._key_matrices for col in m))
+
+    def test_raw_keys_not_stored(self):
+        cache = aes_keycache.KeyScheduleCache(capacity=4, factory=test_aes.AES)
+        key = bytes(range(16))
+        with cache.acquire(key):
+            pass
+        self.assertNotIn(key, cache._entries)
+        self.assertEqual(len(cache), 1)
+
+    def test_concurrent_use(self):
+        """Many threads churning a small cache never see a wiped schedule"""
+        cache = aes_keycache.KeyScheduleCache(capacity=3)
+        keys = self.keys(8)
+        block = bytes(16)
+        expected = {key: aes_ctypes.AES(key).encrypt_block(block) for key in keys}
+        failures = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            for _ in range(300):
+                key = rng.choice(keys)
+                with cache.acquire(key) as aes:
+                    if aes.encrypt_block(block) != expected[key]:
+                        failures.append(key)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+        stats = cache.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], 6 * 300)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Checks for the bench_aes harness plumbing, not for actual speed"""
+
+    def test_percentile(self):
+        samples = [4.0, 1.0, 3.0, 2.0, 5.0]
+        self.assertEqual(bench_aes.percentile(samples, 0), 1.0)
+        self.assertEqual(bench_aes.percentile(samples, 50), 3.0)
+        self.assertEqual(bench_aes.percentile(samples, 100), 5.0)
+        self.assertAlmostEqual(bench_aes.percentile(samples, 90), 4.6)
+
+    def run_bench(self, *args):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "bench.json")
+            with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+                rc = bench_aes.main(["--sizes", "32", "--repeat", "2", "--warmup", "0",
+                                     "--min-time", "0.0001", "--output", out, *args])
+            with open(out) as f:
+                return rc, json.load(f)
+
+    def test_json_output(self):
+        rc, data = self.run_bench("--filter", "ctr/c/", "--no-python")
+        self.assertEqual(rc, 0)
+        self.assertEqual(data["meta"]["engines"], aes_ctypes.available_engines())
+        ids = {r["id"] for r in data["results"]}
+        self.assertEqual(ids, {f"ctr/c/{e}/32" for e in aes_ctypes.available_engines()})
+        for result in data["results"]:
+            self.assertEqual(result["repeat"], 2)
+            self.assertLessEqual(result["seconds"]["min"], result["seconds"]["p99"])
+            self.assertAlmostEqual(result["blocks_per_s"] * 16 / 1e6, result["mb_per_s"])
+
+    def test_compare_flags_regressions(self):
+        def results(best, p50=None):
+            seconds = {"min": best, "p50": p50 or best}
+            return {"results": [{"id": "ctr/c/x/16", "size": 16, "seconds": seconds},
+                                {"id": "key_expansion/c/-/0", "size": 0, "seconds": {"min": 0.01, "p50": 0.01}}]}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(bench_aes.compare(results(1.05), results(1.0), 0.10), [])
+            self.assertEqual(bench_aes.compare(results(1.25), results(1.0), 0.10), ["ctr/c/x/16"])
+            # Only the fastest sample counts, so a noisy median alone is no regression
+            self.assertEqual(bench_aes.compare(results(1.0, p50=2.0), results(1.0), 0.10), [])
+            # Cases missing from the baseline are ignored
+            self.assertEqual(bench_aes.compare(results(1.0), {"results": []}, 0.10), [])
+
+    def test_report_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, "baseline.json")
+            rc, data = self.run_bench("--filter", "ctr/c/", "--no-python")
+            for result in data["results"]:
+                result["seconds"]["min"] /= 10  # the baseline was 10x faster
+            with open(baseline, "w") as f:
+                json.dump(data, f)
+            self.assertEqual(self.run_bench("--filter", "ctr/c/", "--no-python", "--compare", baseline)[0], 1)
+            self.assertEqual(self.run_bench("--filter", "ctr/c/", "--no-python", "--compare", baseline,
+                                            "--report-only")[0], 0)
+
+    def test_c_cases_close_their_contexts(self):
+        cases = list(bench_aes.c_cases([32], bytes(range(16)), aes_ctypes.get_engine()))
+        ecb = next(case for case in cases if case.name == "ecb_encrypt")
+        with self.assertRaisesRegex(ValueError, "closed"):
+            ecb.fn()
+
+    def test_rejects_bad_sizes(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(bench_aes.main(["--sizes", "17"]), 2)
+            self.assertEqual(bench_aes.main(["--repeat", "0"]), 2)
+
+
+# The AES-128 test cases from the GCM specification (McGrew & Viega), which
+# NIST's GCM validation suite reuses: (key, iv, plaintext, aad, ciphertext, tag)
+_GCM_K1 = "feffe9928665731c6d6a8f9467308308"
+_GCM_P = ("d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72"
+          "1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255")
+_GCM_AAD = "feedfacedeadbeeffeedfacedeadbeefabaddad2"
+GCM_VECTORS = [
+    ("00000000000000000000000000000000", "000000000000000000000000", "", "", "",
+     "58e2fccefa7e3061367f1d57a4e7455a"),
+    ("00000000000000000000000000000000", "000000000000000000000000",
+     "00000000000000000000000000000000", "", "0388dace60b6a392f328c2b971b2fe78",
+     "ab6e47d42cec13bdf53a67b21257bddf"),
+    (_GCM_K1, "cafebabefacedbaddecaf888", _GCM_P, "",
+     "42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e"
+     "21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091473f5985",
+     "4d5c2af327cd64a62cf35abd2ba6fab4"),
+    (_GCM_K1, "cafebabefacedbaddecaf888", _GCM_P[:120], _GCM_AAD,
+     "42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e"
+     "21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091",
+     "5bc94fbc3221a5db94fae95ae7121a47"),
+    (_GCM_K1, "cafebabefacedbad", _GCM_P[:120], _GCM_AAD,
+     "61353b4c2806934a777ff51fa22a4755699b2a714fcdc6f83766e5f97b6c7423"
+     "73806900e49f24b22b097544d4896b424989b5e1ebac0f07c23f4598",
+     "3612d2e79e3b0785561be14aaca2fccb"),
+    (_GCM_K1, "9313225df88406e555909c5aff5269aa6a7a9538534f7da1e4c303d2a318a728"
+     "c3c0c95156809539fcf0e2429a6b525416aedbf5a0de6a57a637b39b", _GCM_P[:120], _GCM_AAD,
+     "8ce24998625615b603a033aca13fb894be9112a5c3a211a8ba262a3cca7e2ca7"
+     "01e4a9a4fba43c90ccdcb281d48c7c6fd62875d2aca417034c34aee5",
+     "619cc5aefffe0bfa462af43c1699d050"),
+]
+
+
+def _gf128_mul(x, y):
+    """GF(2^128) product in GCM's bit order (bit 0 is the MSB of the int)."""
+    z = 0
+    for i in range(127, -1, -1):
+        if (x >> i) & 1:
+            z ^= y
+        y = (y >> 1) ^ (0xE1 << 120) if y & 1 else y >> 1
+    return z
+
+
+def _ghash(h, data):
+    y = 0
+    data += bytes(-len(data) % 16)
+    for i in range(0, len(data), 16):
+        y = _gf128_mul(y ^ int.from_bytes(data[i:i + 16], "big"), h)
+    return y
+
+
+def _reference_gcm(key, iv, plaintext, aad):
+    """Bit-by-bit GCM on top of single-block encryption: (ciphertext, tag)."""
+    aes = aes_ctypes.AES(key)
+    h = int.from_bytes(aes.encrypt_block(bytes(16)), "big")
+    if len(iv) == 12:
+        j0 = int.from_bytes(iv + b"\x00\x00\x00\x01", "big")
+    else:
+        j0 = _ghash(h, iv + bytes(-len(iv) % 16) + (len(iv) * 8).to_bytes(16, "big"))
+    keystream = b""
+    for i in range((len(plaintext) + 15) // 16):
+        ctr = (j0 & ~0xFFFFFFFF) | ((j0 + 1 + i) & 0xFFFFFFFF)
+        keystream += aes.encrypt_block(ctr.to_bytes(16, "big"))
+    ciphertext = bytes(a ^ b for a, b in zip(plaintext, keystream))
+    lengths = (len(aad) * 8).to_bytes(8, "big") + (len(ciphertext) * 8).to_bytes(8, "big")
+    s = _ghash(h, aad + bytes(-len(aad) % 16) + ciphertext + bytes(-len(ciphertext) % 16) + lengths)
+    tag = (s ^ int.from_bytes(aes.encrypt_block(j0.to_bytes(16, "big")), "big")).to_bytes(16, "big")
+    return ciphertext, tag
+
+
+class TestGCM(unittest.TestCase):
+    """AES-128-GCM against the spec vectors and a bit-by-bit reference"""
+
+    def setUp(self):
+        self.saved_engine = aes_ctypes.get_engine()
+
+    def tearDown(self):
+        aes_ctypes.set_engine(self.saved_engine)
+
+    def each_engine(self):
+        # The AES-NI engine also switches GHASH to PCLMULQDQ where available
+        for engine in aes_ctypes.available_engines():
+            aes_ctypes.set_engine(engine)
+            yield engine
+
+    def test_nist_vectors(self):
+        for engine in self.each_engine():
+            for key, iv, pt, aad, ct, tag in GCM_VECTORS:
+                key, iv, pt, aad, ct, tag = map(bytes.fromhex, (key, iv, pt, aad, ct, tag))
+                with aes_ctypes.AESGCM(key) as gcm:
+                    got_ct, got_tag = gcm.seal(pt, iv, aad)
+                    self.assertEqual(bytes(got_ct), ct, engine)
+                    self.assertEqual(got_tag, tag, engine)
+                    self.assertEqual(bytes(gcm.open(ct, iv, tag, aad)), pt, engine)
+
+    def test_matches_reference(self):
+        """Lengths around the 8-block groups and 1 KiB stripes, odd tails, long IVs"""
+        rng = random.Random(12)
+
+        def randbytes(n):
+            return bytes(rng.getrandbits(8) for _ in range(n))
+
+        key = randbytes(16)
+        cases = [(randbytes(12), randbytes(n), randbytes(a))
+                 for n, a in ((1, 0), (15, 3), (127, 16), (128, 17), (1024, 0),
+                              (1040, 5), (2000, 33))]
+        cases.append((randbytes(7), randbytes(300), b""))
+        cases.append((randbytes(40), randbytes(129), randbytes(64)))
+        expected = [_reference_gcm(key, iv, pt, aad) for iv, pt, aad in cases]
+
+        for engine in self.each_engine():
+            with aes_ctypes.AESGCM(key) as gcm:
+                for (iv, pt, aad), (ct, tag) in zip(cases, expected):
+                    got_ct, got_tag = gcm.seal(pt, iv, aad)
+                    self.assertEqual((bytes(got_ct), got_tag), (ct, tag), (engine, len(pt)))
+                    self.assertEqual(bytes(gcm.open(ct, iv, tag, aad)), pt)
+
+    def test_counter_wraps_low_32_bits(self):
+        """inc32 wraps without carrying into the IV part of the counter block"""
+        key = bytes(range(16))
+        h = int.from_bytes(aes_ctypes.AES(key).encrypt_block(bytes(16)), "big")
+        h_inv = 1 << 127  # the multiplicative identity in GCM bit order
+        base, exp = h, (1 << 128) - 2
+        while exp:
+            if exp & 1:
+                h_inv = _gf128_mul(h_inv, base)
+            base = _gf128_mul(base, base)
+            exp >>= 1
+        # Pick a 16-byte IV whose J0 = GHASH(IV || lengths) ends in fffffffd
+        j0 = int.from_bytes(bytes(range(12)) + b"\xff\xff\xff\xfd", "big")
+        iv = _gf128_mul(_gf128_mul(j0, h_inv) ^ 128, h_inv).to_bytes(16, "big")
+        self.assertEqual(_ghash(h, iv + (128).to_bytes(16, "big")), j0)
+        pt = bytes(range(256)) * 2
+
+        ct, tag = _reference_gcm(key, iv, pt, b"")
+        for engine in self.each_engine():
+            with aes_ctypes.AESGCM(key) as gcm:
+                got_ct, got_tag = gcm.seal(pt, iv)
+                self.assertEqual((bytes(got_ct), got_tag), (ct, tag), engine)
+
+    def test_tampering_detected(self):
+        """Any change to ciphertext, AAD, IV or tag fails and wipes the buffer"""
+        gcm = aes_ctypes.AESGCM(bytes(16))
+        iv, aad = bytes(12), b"header"
+        ct, tag = gcm.seal(bytes(range(100)), iv, aad)
+        ct = bytes(ct)
+
+        bad = bytearray(ct)
+        bad[50] ^= 1
+        with self.assertRaises(aes_ctypes.AuthenticationError):
+            gcm.open(bad, iv, tag, aad)
+        self.assertEqual(bad, bytes(100))
+
+        for args in ((ct, iv, tag, b"Header"), (ct, b"\x01" + iv[1:], tag, aad),
+                     (ct, iv, tag[:-1] + bytes([tag[-1] ^ 1]), aad)):
+            with self.assertRaises(aes_ctypes.AuthenticationError):
+                gcm.open(*args)
+        self.assertEqual(bytes(gcm.open(ct, iv, tag, aad)), bytes(range(100)))
+
+    def test_truncated_tags(self):
+        gcm = aes_ctypes.AESGCM(bytes(16))
+        _, full = gcm.seal(b"data", bytes(12))
+        for n in aes_ctypes.GCM_TAG_SIZES:
+            _, tag = gcm.seal(b"data", bytes(12), tag_length=n)
+            self.assertEqual(tag, full[:n])
+            self.assertEqual(bytes(gcm.open(gcm.seal(b"data", bytes(12))[0], bytes(12), tag)), b"data")
+        for n in (0, 3, 10, 17):
+            with self.assertRaises(ValueError):
+                gcm.seal(b"data", bytes(12), tag_length=n)
+        with self.assertRaises(ValueError):
+            gcm.seal(b"data", b"")
+        with self.assertRaises(ValueError):
+            aes_ctypes.AESGCM(b"short")
+
+    def test_closed_context_raises(self):
+        gcm = aes_ctypes.AESGCM(bytes(16))
+        ct, tag = gcm.seal(bytearray(16), bytes(12))
+        gcm.close()
+        with self.assertRaisesRegex(ValueError, "closed"):
+            gcm.seal(bytearray(16), bytes(12))
+        with self.assertRaisesRegex(ValueError, "closed"):
+            gcm.open(ct, bytes(12), tag)
+
+
+# IEEE 1619-2007 XTS-AES-128 vectors: (key1, key2, sector, plaintext, ciphertext)
+XTS_VECTORS = [
+    ("11" * 16, "22" * 16, 0x3333333333, "44" * 32,
+     "c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0"),
+    ("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0", "22" * 16, 0x3333333333, "44" * 32,
+     "af85336b597afc1a900b2eb21ec949d292df4c047e0b21532186a5971a227a89"),
+    # Vectors 15-18: ciphertext stealing over 17-20 byte data units
+    ("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0", "bfbebdbcbbbab9b8b7b6b5b4b3b2b1b0", 0x123456789a,
+     "000102030405060708090a0b0c0d0e0f10", "6c1625db4671522d3d7599601de7ca09ed"),
+    ("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0", "bfbebdbcbbbab9b8b7b6b5b4b3b2b1b0", 0x123456789a,
+     "000102030405060708090a0b0c0d0e0f1011", "d069444b7a7e0cab09e24447d24deb1fedbf"),
+    ("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0", "bfbebdbcbbbab9b8b7b6b5b4b3b2b1b0", 0x123456789a,
+     "000102030405060708090a0b0c0d0e0f101112", "e5df1351c0544ba1350b3363cd8ef4beedbf9d"),
+    ("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0", "bfbebdbcbbbab9b8b7b6b5b4b3b2b1b0", 0x123456789a,
+     "000102030405060708090a0b0c0d0e0f10111213", "9d84c813f719aa2c7be3f66171c7c5c2edbf9dac"),
+]
+
+
+def _reference_xts_encrypt(key, sector, data):
+    """Block-at-a-time XTS encryption with ciphertext stealing."""
+    aes = aes_ctypes.AES(key[:16])
+    t = int.from_bytes(aes_ctypes.AES(key[16:]).encrypt_block(sector.to_bytes(16, "little")), "little")
+
+    def block(p, t):
+        tb = t.to_bytes(16, "little")
+        x = aes.encrypt_block(bytes(a ^ b for a, b in zip(p, tb)))
+        return bytes(a ^ b for a, b in zip(x, tb))
+
+    def double(t):
+        t <<= 1
+        return (t ^ 0x87) & ((1 << 128) - 1) if t >> 128 else t
+
+    n, rest = divmod(len(data), 16)
+    out = b""
+    for i in range(n - (1 if rest else 0)):
+        out += block(data[16 * i:16 * i + 16], t)
+        t = double(t)
+    if rest:
+        cc = block(data[16 * (n - 1):16 * n], t)
+        pp = data[16 * n:] + cc[rest:]
+        out += block(pp, double(t)) + cc[:rest]
+    return out
+
+
+class TestXTS(unittest.TestCase):
+    """AES-XTS against IEEE 1619 and a block-at-a-time reference"""
+
+    def setUp(self):
+        self.saved_engine = aes_ctypes.get_engine()
+
+    def tearDown(self):
+        aes_ctypes.set_engine(self.saved_engine)
+
+    def test_ieee_vectors(self):
+        for engine in aes_ctypes.available_engines():
+            aes_ctypes.set_engine(engine)
+            for key1, key2, sector, pt, ct in XTS_VECTORS:
+                pt, ct = bytes.fromhex(pt), bytes.fromhex(ct)
+                with aes_ctypes.AESXTS(bytes.fromhex(key1 + key2)) as xts:
+                    self.assertEqual(bytes(xts.encrypt_sector(pt, sector)), ct, engine)
+                    self.assertEqual(bytes(xts.decrypt_sector(ct, sector)), pt, engine)
+
+    def test_matches_reference(self):
+        """Every engine, sector lengths with and without a partial block"""
+        rng = random.Random(13)
+        key = bytes(rng.getrandbits(8) for _ in range(32))
+        for length in (16, 31, 128, 129, 512, 527, 4096):
+            data = bytes(rng.getrandbits(8) for _ in range(length))
+            sector = rng.getrandbits(64)
+            expected = _reference_xts_encrypt(key, sector, data)
+            for engine in aes_ctypes.available_engines():
+                aes_ctypes.set_engine(engine)
+                with aes_ctypes.AESXTS(key) as xts:
+                    self.assertEqual(bytes(xts.encrypt_sector(data, sector)), expected, (engine, length))
+                    self.assertEqual(bytes(xts.decrypt_sector(expected, sector)), data, (engine, length))
+
+    def test_random_access(self):
+        """Any sector of a bulk-encrypted run decrypts on its own"""
+        key = bytes(range(32))
+        sector_size, first = 520, 1000
+        data = bytes(random.randint(0, 255) for _ in range(sector_size * 9))
+        with aes_ctypes.AESXTS(key) as xts:
+            ct = bytes(xts.encrypt_sectors(data, first, sector_size))
+            for i in (0, 4, 8):
+                chunk = ct[i * sector_size:(i + 1) * sector_size]
+                self.assertEqual(bytes(xts.decrypt_sector(chunk, first + i)),
+                                 data[i * sector_size:(i + 1) * sector_size])
+            self.assertEqual(bytes(xts.decrypt_sectors(ct, first, sector_size)), data)
+
+    def test_parallel_matches_serial(self):
+        key = bytes(range(32))
+        data = bytes(random.randint(0, 255) for _ in range(512 * 37))
+        with aes_ctypes.AESXTS(key) as xts:
+            expected = bytes(xts.encrypt_sectors(data, 7, 512))
+        buf = bytearray(data)
+        self.assertIs(aes_parallel.encrypt_xts(key, buf, 7, sector_size=512, workers=4, chunk_size=1500), buf)
+        self.assertEqual(bytes(buf), expected)
+        aes_parallel.decrypt_xts(key, buf, 7, sector_size=512, workers=4, chunk_size=1500)
+        self.assertEqual(bytes(buf), data)
+
+    def test_rejects_bad_parameters(self):
+        with self.assertRaises(ValueError):
+            aes_ctypes.AESXTS(bytes(16))
+        with self.assertRaises(ValueError):
+            aes_ctypes.AESXTS(bytes(32))  # identical data and tweak keys
+        xts = aes_ctypes.AESXTS(bytes(range(32)))
+        with self.assertRaises(ValueError):
+            xts.encrypt_sector(bytes(15), 0)
+        with self.assertRaises(ValueError):
+            xts.encrypt_sector(bytes(16), 1 << 64)
+        with self.assertRaises(ValueError):
+            xts.encrypt_sectors(bytes(100), 0, 32)
+        with self.assertRaises(ValueError):
+            xts.encrypt_sectors(bytes(64), 0, 8)
+        with self.assertRaises(ValueError):
+            aes_parallel.encrypt_xts(bytes(range(32)), bytes(100), sector_size=32)
+
+    def test_closed_context_raises(self):
+        xts = aes_ctypes.AESXTS(bytes(range(32)))
+        xts.close()
+        calls = [
+            lambda: xts.encrypt_sector(bytearray(32), 0),
+            lambda: xts.decrypt_sector(bytearray(32), 0),
+            lambda: xts.encrypt_sectors(bytearray(64), 0, 32),
+            lambda: xts.decrypt_sectors(bytearray(64), 0, 32),
+        ]
+        for call in calls:
+            with self.assertRaisesRegex(ValueError, "closed"):
+                call()
+
+
+@unittest.skipIf(_rijndael is None, "_rijndael extension not built")
+class TestExtension(unittest.TestCase):
+    """_rijndael.AES is a drop-in for test_aes.AES and aes_ctypes.AES"""
+
+    def setUp(self):
+        self.key = bytes([random.randint(0, 255) for _ in range(16)])
+        self.ext = _rijndael.AES(self.key)
+
+    def test_fips197(self):
+        aes = _rijndael.AES(bytes(range(16)))
+        ciphertext = aes.encrypt_block(bytes.fromhex("00112233445566778899aabbccddeeff"))
+        self.assertEqual(ciphertext.hex(), "69c4e0d86a7b0430d8cdb78070b4c55a")
+        self.assertEqual(aes.decrypt_block(ciphertext).hex(), "00112233445566778899aabbccddeeff")
+
+    def test_matches_python_aes(self):
+        python = AES(self.key)
+        for i in range(3):
+            block = bytes([random.randint(0, 255) for _ in range(16)])
+            self.assertEqual(self.ext.encrypt_block(block), python.encrypt_block(block))
+            self.assertEqual(self.ext.decrypt_block(block), python.decrypt_block(block))
+
+    @unittest.skipIf(test_aes.np is None, "NumPy not installed")
+    def test_batch_api_matches_numpy(self):
+        python = test_aes.AES(self.key)
+        data = bytes([random.randint(0, 255) for _ in range(16 * 20)])
+        for ours, theirs in ((self.ext.encrypt_blocks, python.encrypt_blocks),
+                             (self.ext.decrypt_blocks, python.decrypt_blocks)):
+            got, expected = ours(data), theirs(data)
+            self.assertEqual(got.shape, expected.shape)
+            self.assertEqual(got.tobytes(), expected.tobytes())
+        self.assertEqual(self.ext.encrypt_blocks(b"").shape, (0, 16))
+
+    def test_bulk_modes_match_ctypes(self):
+        iv = bytes([random.randint(0, 255) for _ in range(16)])
+        data = bytes([random.randint(0, 255) for _ in range(16 * 300)])
+        with aes_ctypes.AES(self.key) as native:
+            for name, args in (("encrypt_ecb", ()), ("decrypt_ecb", ()), ("encrypt_cbc", (iv,)),
+                               ("decrypt_cbc", (iv,)), ("encrypt_ctr", (iv,))):
+                self.assertEqual(bytes(getattr(self.ext, name)(data, *args)),
+                                 bytes(getattr(native, name)(data, *args)), name)
+            self.assertEqual(bytes(self.ext.decrypt_ctr(data[:-5], iv)),
+                             bytes(native.decrypt_ctr(data[:-5], iv)))
+
+    def test_buffers_in_place(self):
+        """Writable buffers are modified in place; read-only ones are copied"""
+        data = bytes(range(64))
+        buf = bytearray(data)
+        self.assertIs(self.ext.encrypt_ecb(buf), buf)
+        view = memoryview(bytearray(data))
+        self.assertIs(self.ext.encrypt_ecb(view), view)
+        self.assertEqual(bytes(view), bytes(buf))
+
+        copied = self.ext.encrypt_ecb(data)
+        self.assertIsInstance(copied, bytearray)
+        self.assertEqual(bytes(copied), bytes(buf))
+        self.assertEqual(data, bytes(range(64)))
+
+        iv = bytearray(16)
+        out = self.ext.encrypt_cbc(bytearray(data), iv)
+        self.assertEqual(iv, out[-16:])
+        counter = bytearray(16)
+        self.ext.encrypt_ctr(bytearray(40), counter)
+        self.assertEqual(counter, bytes(15) + b"\x03")
+
+    def test_threads_share_schedule(self):
+        """Large calls release the GIL; results stay correct across threads"""
+        data = bytes(range(256)) * 64
+        expected = bytes(self.ext.encrypt_ctr(data, bytes(16)))
+        self.assertGreaterEqual(len(data), _rijndael.GIL_THRESHOLD)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: bytes(self.ext.encrypt_ctr(data, bytes(16))), range(16)))
+        self.assertEqual(results, [expected] * 16)
+
+    def test_errors_and_close(self):
+        with self.assertRaises(ValueError):
+            _rijndael.AES(b"short key")
+        with self.assertRaises(ValueError):
+            self.ext.encrypt_block(bytes(15))
+        with self.assertRaises(ValueError):
+            self.ext.encrypt_ecb(bytes(17))
+        with self.assertRaises(ValueError):
+            self.ext.encrypt_ctr(b"data", bytes(8))
+        with self.assertRaises(TypeError):
+            self.ext.encrypt_block("not bytes")
+
+        with _rijndael.AES(self.key) as aes:
+            aes.encrypt_block(bytes(16))
+        with self.assertRaises(ValueError):
+            aes.encrypt_block(bytes(16))
+
+    def test_close_during_call_without_gil(self):
+        """close() from another thread waits for a running bulk call"""
+        buf = bytearray(32 << 20)
+        with aes_ctypes.AES(self.key) as c_aes:
+            expected = bytes(c_aes.encrypt_ecb(bytes(len(buf))))
+        aes = _rijndael.AES(self.key)
+        started = threading.Event()
+
+        def work():
+            started.set()
+            try:
+                return bytes(aes.encrypt_ecb(buf))
+            except ValueError:  # close() won the race outright
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(work)
+            started.wait()
+            aes.close()
+            result = future.result()
+        self.assertIn(result, (expected, None))
+        with self.assertRaises(ValueError):
+            aes.encrypt_ecb(bytearray(16))
+
+    def test_engines(self):
+        saved = _rijndael.get_engine()
+        try:
+            self.assertEqual(_rijndael.engines(), aes_ctypes.engines())
+            self.assertEqual(_rijndael.available_engines(), aes_ctypes.available_engines())
+            block = bytes(16)
+            expected = self.ext.encrypt_block(block)
+            for engine in _rijndael.available_engines():
+                _rijndael.set_engine(engine)
+                self.assertEqual(_rijndael.get_engine(), engine)
+                self.assertEqual(self.ext.encrypt_block(block), expected, engine)
+            with self.assertRaises(ValueError):
+                _rijndael.set_engine("no-such-engine")
+        finally:
+            _rijndael.set_engine(saved)
+
+
+_PROFILE_SCRIPT = """
+import json
+import aes_ctypes
+aes_ctypes.set_engine('bytewise')
+aes_ctypes.profile_reset()
+with aes_ctypes.AES(bytes(16)) as aes:
+    aes.encrypt_ecb(bytearray(64))
+    aes.encrypt_ctr(bytearray(40), bytes(16))
+before_reset = aes_ctypes.profile_snapshot()
+aes_ctypes.profile_reset()
+print(json.dumps([aes_ctypes.profile_enabled(), before_reset, aes_ctypes.profile_snapshot()]))
+"""
+
+
+class TestProfiling(unittest.TestCase):
+    """Opt-in profiling counters (aes_profile, make PROFILE=1)"""
+
+    def tearDown(self):
+        aes_profile.disable()
+        aes_profile.reset()
+
+    def test_default_build_has_no_counters(self):
+        snapshot = aes_ctypes.profile_snapshot()
+        self.assertFalse(aes_ctypes.profile_enabled())
+        self.assertIn('sub_bytes', snapshot)
+        self.assertIn('gcm_seal', snapshot)
+        with aes_ctypes.AES(bytes(16)) as aes:
+            aes.encrypt_ecb(bytearray(64))
+        self.assertEqual(aes_ctypes.profile_snapshot(), snapshot)
+        self.assertTrue(all(c == {'calls': 0, 'bytes': 0, 'ns': 0} for c in snapshot.values()))
+
+    @unittest.skipIf(shutil.which(os.environ.get('CC', 'cc')) is None, "no C compiler")
+    def test_profiled_build(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            lib = os.path.join(tmp, 'rijndael_profile.so')
+            subprocess.run([os.environ.get('CC', 'cc'), '-O2', '-DRIJNDAEL_PROFILE', '-shared',
+                            '-fPIC', '-o', lib, 'rijndael.c'], check=True)
+            out = subprocess.run([sys.executable, '-c', _PROFILE_SCRIPT], check=True,
+                                 capture_output=True, text=True,
+                                 env=dict(os.environ, RIJNDAEL_LIBRARY=lib)).stdout
+        enabled, counters, after_reset = json.loads(out)
+        self.assertTrue(enabled)
+        self.assertEqual(counters['ecb_encrypt'], {'calls': 1, 'bytes': 64, 'ns': counters['ecb_encrypt']['ns']})
+        self.assertEqual(counters['ctr']['bytes'], 40)
+        # 4 ECB blocks + 3 CTR keystream blocks, one key expansion
+        self.assertEqual(counters['encrypt_block']['calls'], 7)
+        self.assertEqual(counters['sub_bytes']['calls'], 70)
+        self.assertEqual(counters['mix_columns']['calls'], 63)
+        self.assertEqual(counters['key_expansion']['calls'], 1)
+        # Deriving the decryption schedule is key setup, not a cipher stage
+        self.assertEqual(counters['inv_mix_columns']['calls'], 0)
+        self.assertEqual(counters['alloc']['calls'], 1)
+        self.assertEqual(counters['free']['calls'], 1)
+        self.assertGreater(counters['ecb_encrypt']['ns'], 0)
+        self.assertTrue(all(c['calls'] == 0 for c in after_reset.values()))
+
+    def test_python_counters(self):
+        aes_profile.reset()
+        with aes_profile.profiling():
+            aes = test_aes.AES(bytes(16), engine='matrix')
+            block = aes.encrypt_block(bytes(16))
+            aes.decrypt_block(block)
+            aes.close()
+        counters = aes_profile.snapshot()['python']
+        self.assertEqual(counters['key_expansion']['calls'], 1)
+        self.assertNotIn('alloc', counters)  # only the C library counts allocations
+        self.assertEqual(counters['encrypt_block'], {'calls': 1, 'bytes': 16, 'ns': counters['encrypt_block']['ns']})
+        self.assertEqual(counters['sub_bytes']['calls'], 10)
+        self.assertEqual(counters['mix_columns']['calls'], 9)
+        self.assertEqual(counters['inv_mix_columns']['calls'], 9)
+        self.assertEqual(counters['add_round_key']['calls'], 22)
+
+    def test_disabled_is_uninstrumented(self):
+        sub_bytes, encrypt_block = test_aes.sub_bytes, test_aes.AES.encrypt_block
+        with aes_profile.profiling():
+            self.assertTrue(aes_profile.enabled())
+            self.assertIsNot(test_aes.sub_bytes, sub_bytes)
+        self.assertFalse(aes_profile.enabled())
+        self.assertIs(test_aes.sub_bytes, sub_bytes)
+        self.assertIs(test_aes.AES.encrypt_block, encrypt_block)
+        aes_profile.reset()
+        test_aes.AES(bytes(16)).encrypt_block(bytes(16))
+        self.assertTrue(all(c['calls'] == 0 for c in aes_profile.snapshot()['python'].values()))
+
+    @unittest.skipIf(test_aes.np is None, "numpy is not installed")
+    def test_metrics(self):
+        with aes_profile.profiling():
+            test_aes.AES(bytes(16)).encrypt_blocks(bytes(64))
+        metrics = aes_profile.metrics()
+        self.assertEqual(metrics['aes.python.ecb_encrypt.calls'], 1)
+        self.assertEqual(metrics['aes.python.ecb_encrypt.bytes'], 64)
+        self.assertIn('aes.c.ctr.ns', metrics)
+
+
+def _flip_one_byte(group, inputs, decrypt):
+    """Bulk path that corrupts flat block 40 of every group it encrypts"""
+    out = fuzz_aes._run_c(group, inputs, decrypt)
+    if not decrypt:
+        out[40, 0] ^= 1
+    return out
+
+
+@unittest.skipIf(test_aes.np is None, "numpy is not installed")
+class TestFuzz(unittest.TestCase):
+    """Smoke tests for the fuzz_aes differential harness"""
+
+    def test_kats(self):
+        self.assertIsNone(fuzz_aes.check_kats())
+
+    def test_small_run(self):
+        mismatch, checked = fuzz_aes.fuzz(seed=1, n_groups=2, slow_groups=1, group_keys=64)
+        self.assertIsNone(mismatch)
+        names = [name for name, _, _ in fuzz_aes.implementations()]
+        self.assertEqual(sorted(checked), sorted(names))
+        sizes = [int(fuzz_aes.Group(1, g, 64).counts.sum()) for g in (0, 1)]
+        for name in names:
+            expected = sizes[0] if name in fuzz_aes.SLOW_IMPLEMENTATIONS else sum(sizes)
+            self.assertEqual(checked[name], expected, name)
+
+    def test_reference_matches_python_aes(self):
+        group = fuzz_aes.Group(5, 0, 8)
+        ciphertexts = fuzz_aes.reference_encrypt(fuzz_aes.expand_keys(group.keys), group.counts, group.blocks)
+        for k, (start, n) in enumerate(zip(group.starts, group.counts)):
+            aes = test_aes.AES(group.keys[k].tobytes())
+            self.assertEqual(aes.encrypt_blocks(group.blocks[start:start + n]).tobytes(),
+                             ciphertexts[start:start + n].tobytes())
+
+    def test_groups_are_reproducible(self):
+        """A group depends only on (seed, group); keys get 1-16 blocks"""
+        a, b, other = fuzz_aes.Group(7, 3, 32), fuzz_aes.Group(7, 3, 32), fuzz_aes.Group(7, 4, 32)
+        self.assertEqual(a.keys.tobytes(), b.keys.tobytes())
+        self.assertEqual(a.blocks.tobytes(), b.blocks.tobytes())
+        self.assertNotEqual(a.keys.tobytes(), other.keys.tobytes())
+        self.assertTrue(((a.counts >= 1) & (a.counts <= fuzz_aes.MAX_BLOCKS_PER_KEY)).all())
+        self.assertEqual(len(a.blocks), a.counts.sum())
+        self.assertEqual(a.locate(0), (0, 0))
+        self.assertEqual(a.locate(int(a.starts[5]) + 1), (5, 1) if a.counts[5] > 1 else (6, 0))
+
+    def test_reports_first_mismatch(self):
+        saved = fuzz_aes.implementations
+        fuzz_aes.implementations = lambda: [("c/broken", None, _flip_one_byte)]
+        try:
+            mismatch, _ = fuzz_aes.fuzz(seed=9, n_groups=2, first_group=10, group_keys=64)
+            replayed, _ = fuzz_aes.fuzz(seed=9, n_groups=1, first_group=10, group_keys=64)
+        finally:
+            fuzz_aes.implementations = saved
+        group = fuzz_aes.Group(9, 10, 64)
+        key_index, block = group.locate(40)
+        self.assertEqual((mismatch.impl, mismatch.op), ("c/broken", "encrypt"))
+        self.assertEqual((mismatch.seed, mismatch.group), (9, 10))
+        self.assertEqual((mismatch.key_index, mismatch.block), (key_index, block))
+        self.assertEqual(mismatch.key, group.keys[key_index].tobytes())
+        self.assertEqual(mismatch.data, group.blocks[40].tobytes())
+        self.assertEqual(bytes(aes_ctypes.AES(mismatch.key).encrypt_block(mismatch.data)),
+                         mismatch.expected)
+        self.assertIn("--seed 9 --group 10 --group-keys 64", str(mismatch))
+        self.assertEqual(str(replayed), str(mismatch))
+
+    def test_main_exit_status(self):
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            rc = fuzz_aes.main(["--seed", "3", "--groups", "1", "--group-keys", "32"])
+        self.assertEqual(rc, 0)
+        self.assertIn("seed 3:", err.getvalue())
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(fuzz_aes.main(["--groups", "0"]), 2)
+
+
 if __name__ == '__main__':
     unittest.main()